@@ -0,0 +1,93 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.utils.decorators import classonlymethod
+from django.utils.functional import classproperty
+from rest_framework import viewsets
+from rest_framework.views import APIView
+
+
+class AsyncDispatchMixin:
+    """
+    Makes a DRF view's dispatch a coroutine, so Django serves it as a native
+    async view under ASGI instead of parking a worker thread on it.
+
+    ``async def`` handlers are awaited on the event loop. Plain handlers,
+    along with authentication, permission and throttle checks (which may
+    touch the database), run through ``sync_to_async`` in Django's
+    thread-sensitive executor, as the ORM requires.
+    """
+
+    @classproperty
+    def view_is_async(cls):
+        return True
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            if iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class AsyncAPIView(AsyncDispatchMixin, APIView):
+    pass
+
+
+class AsyncModelViewSet(AsyncDispatchMixin, viewsets.ModelViewSet):
+    """
+    ModelViewSet whose ``async def`` actions are awaited. The stock CRUD
+    actions keep their sync implementations and run in the executor.
+    Inside async actions, use the async ORM (``acreate``, ``asave``) or
+    wrap sync helpers such as ``get_object`` in ``sync_to_async``.
+    """
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        # ViewSetMixin builds a plain function around dispatch; flag it so
+        # Django awaits the coroutine it returns
+        return markcoroutinefunction(super().as_view(actions, **initkwargs))
+
+
+def async_api_view(http_method_names):
+    """
+    ``@api_view`` for ``async def`` function views: the view is awaited
+    directly rather than run through ``async_to_sync``.
+    """
+    def decorator(func):
+        attrs = {'__doc__': func.__doc__, 'http_method_names': [m.lower() for m in http_method_names] + ['options']}
+
+        async def handler(self, *args, **kwargs):
+            return await func(*args, **kwargs)
+
+        for method in http_method_names:
+            attrs[method.lower()] = handler
+
+        # Honour the same per-view policy decorators as @api_view
+        for name in ('renderer_classes', 'parser_classes', 'authentication_classes',
+                     'throttle_classes', 'permission_classes', 'schema'):
+            if hasattr(func, name):
+                attrs[name] = getattr(func, name)
+
+        WrappedAPIView = type('WrappedAPIView', (AsyncAPIView,), attrs)
+        WrappedAPIView.__name__ = func.__name__
+        WrappedAPIView.__module__ = func.__module__
+        return WrappedAPIView.as_view()
+    return decorator
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import weakref
+
+import anthropic
+import httpx
+import openai
+from django.conf import settings
+
+# Async clients are bound to the event loop that created them: under ASGI
+# that is the one server loop, so every request shares one connection pool
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_MAX_CONNECTIONS
+    )
+
+
+def _get_client(name, factory):
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _clients.setdefault(loop, {})
+        client = clients.get(name)
+        if client is None:
+            client = factory()
+            clients[name] = client
+        return client
+
+
+def get_openai_client(api_key=None):
+    """
+    The shared ``AsyncOpenAI`` client for the running event loop. Retries
+    are left to the resilience layer, so the SDK's own are disabled.
+    """
+    api_key = api_key or settings.OPENAI_API_KEY
+    return _get_client(('openai', api_key), lambda: openai.AsyncOpenAI(
+        api_key=api_key,
+        max_retries=0,
+        http_client=httpx.AsyncClient(limits=_limits(), timeout=None)
+    ))
+
+
+def get_anthropic_client(api_key=None):
+    """The shared ``AsyncAnthropic`` client for the running event loop"""
+    api_key = api_key or settings.ANTHROPIC_API_KEY
+    return _get_client(('anthropic', api_key), lambda: anthropic.AsyncAnthropic(
+        api_key=api_key,
+        max_retries=0,
+        http_client=httpx.AsyncClient(limits=_limits(), timeout=None)
+    ))
+
+
+def get_http_client(base_url):
+    """
+    The shared ``httpx.AsyncClient`` for ``base_url`` on the running event
+    loop, for providers called over plain HTTP. Send credentials as
+    per-request headers: the client is shared by every caller of that URL.
+    """
+    return _get_client(('http', base_url), lambda: httpx.AsyncClient(
+        base_url=base_url,
+        limits=_limits(),
+        timeout=None
+    ))
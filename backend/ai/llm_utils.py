@@ -1,157 +1,193 @@
-import os
-from pathlib import Path
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+import asyncio
+import threading
+import weakref
 import logging
 
+import httpx
+from django.conf import settings
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class LocalLLM:
-    """Local LLM for code generation using GPT2-small"""
-    
-    def __init__(self):
-        self.model_name = "distilgpt2"  # Much smaller model
-        self.device = torch.device("cpu")
-        self.response_cache = {}
-        self.is_loaded = False
-        logger.info(f"Initialized LocalLLM with device: {self.device}")
-        
-        # Preload model in background
-        import threading
-        threading.Thread(target=self._preload_model, daemon=True).start()
-    
-    def _preload_model(self):
-        """Preload model in background"""
-        try:
-            logger.info("Preloading model in background...")
-            import torch
-            
-            # Maximum optimization
-            torch.set_grad_enabled(False)
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            
-            # Load minimal tokenizer
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                self.model_name,
-                model_max_length=32,
-                padding_side='left'
-            )
-            
-            # Set special tokens
-            self.tokenizer.pad_token = self.tokenizer.eos_token
-            
-            # Load minimal model
-            self.model = AutoModelForCausalLM.from_pretrained(
-                self.model_name,
-                torch_dtype=torch.float16,
-                low_cpu_mem_usage=True
+# Time allowed on top of a request's deadline for the round trip itself
+DEADLINE_GRACE_SECONDS = 2.0
+
+
+class ModelNotReadyError(Exception):
+    """Raised when generation is requested before the model has finished loading"""
+
+    def __init__(self, status):
+        super().__init__(f"Model not loaded ({status['state']}, {status['progress']:.0%})")
+        self.status = status
+
+
+def build_prompt(prompt):
+    """Minimal completion prompt shared by the local backends"""
+    return f"# Python code to {prompt}:\ndef"
+
+
+class RemoteLLM:
+    """
+    Client for the shared local inference process (ml_service).
+
+    Workers hold no model weights; generation requests go over a pooled
+    keep-alive connection (TCP or a Unix socket) to the one process that does.
+    When ``fallback`` is given, it is called to build an in-process model if
+    the service cannot be reached.
+    """
+
+    def __init__(self, base_url, uds=None, model=None, max_connections=20, fallback=None):
+        self.base_url = base_url.rstrip('/')
+        self.uds = uds or None
+        self.model = model or None
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections
+        )
+        self._fallback_factory = fallback
+        self._fallback = None
+        self._fallback_lock = threading.Lock()
+        # httpx async clients are bound to the event loop that created them
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._sync_client = httpx.Client(
+            base_url=self.base_url,
+            transport=httpx.HTTPTransport(uds=self.uds, limits=self.limits),
+            timeout=1.0
+        )
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                transport=httpx.AsyncHTTPTransport(uds=self.uds, limits=self.limits)
             )
-            
-            # Optimize model
-            self.model.eval()
-            for param in self.model.parameters():
-                param.requires_grad_(False)
-            
-            # Quick test
-            with torch.inference_mode():
-                input_text = "def test():"
-                input_ids = self.tokenizer.encode(input_text, return_tensors="pt")
-                attention_mask = torch.ones_like(input_ids)
-                outputs = self.model.generate(
-                    input_ids,
-                    attention_mask=attention_mask,
-                    max_new_tokens=2,
-                    pad_token_id=self.tokenizer.eos_token_id
-                )
-                result = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-                logger.info(f"Test generation: {result}")
-            
-            self.is_loaded = True
-            logger.info("Model preloaded successfully")
-            
-        except Exception as e:
-            logger.error(f"Error preloading model: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-    
-    async def generate_code_async(self, prompt, max_length=200, temperature=0.7):
-        """Async code generation"""
+            self._async_clients[loop] = client
+        return client
+
+    def fallback(self):
+        """The in-process model, created on first use"""
+        if self._fallback_factory is None:
+            return None
+        with self._fallback_lock:
+            if self._fallback is None:
+                logger.warning("Local inference service unreachable; loading in-process fallback model")
+                self._fallback = self._fallback_factory()
+        return self._fallback
+
+    async def generate_async(self, prompt, max_new_tokens=16, temperature=0.7, timeout=None):
+        """Same contract as LocalLLM.generate_async, served by ml_service"""
+        full_prompt = build_prompt(prompt)
+        payload = {
+            'prompt': full_prompt,
+            'max_new_tokens': max_new_tokens,
+            'temperature': temperature,
+        }
+        if self.model:
+            payload['model'] = self.model
+        if timeout is not None:
+            payload['deadline_ms'] = int(timeout * 1000)
+
         try:
-            # Check cache
-            cache_key = f"{prompt}_{max_length}_{temperature}"
-            if cache_key in self.response_cache:
-                logger.info("Using cached response")
-                return self.response_cache[cache_key]
-            
-            # Quick model check
-            if not self.is_loaded:
-                raise Exception("Model not loaded")
-            
-            # Minimal prompt
-            full_prompt = f"# Python code to {prompt}:\ndef"
-            logger.info(f"Using prompt: {full_prompt}")
-            
-            logger.info("Generating code...")
-            
-            # Efficient tokenization
-            input_ids = self.tokenizer.encode(
-                full_prompt, 
-                return_tensors="pt",
-                max_length=24,
-                truncation=True,
-                padding=False
-            )
-            
-            # Create attention mask
-            attention_mask = torch.ones_like(input_ids)
-            
-            # Generate with minimal settings
-            with torch.inference_mode():
-                outputs = self.model.generate(
-                    input_ids,
-                    attention_mask=attention_mask,
-                    max_new_tokens=16,
-                    do_sample=False,
-                    num_return_sequences=1,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    use_cache=True,
-                    temperature=1.0,  # Pure greedy
-                    top_p=0.0,       # No sampling
-                    top_k=1          # Single token
-                )
-            
-            # Quick decode
-            generated_text = self.tokenizer.decode(
-                outputs[0],
-                skip_special_tokens=True,
-                clean_up_tokenization_spaces=False
+            response = await self._client().post(
+                '/generate',
+                json=payload,
+                timeout=timeout + DEADLINE_GRACE_SECONDS if timeout is not None else None
             )
-            
-            # Clean up the code
-            code = generated_text[len(full_prompt):].strip()
-            if not code:
-                code = "# No code generated"
-            
-            logger.info(f"Generated code: {code}")
-            
-            # Cache response
-            self.response_cache[cache_key] = code
-            
-            logger.info("Code generation completed")
-            return code
-
-        except Exception as e:
-            logger.error(f"Error generating code: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-            raise
-    
-    def generate_code(self, prompt, max_length=200, temperature=0.7):
-        """Sync wrapper for async generation"""
-        import asyncio
-        return asyncio.run(self.generate_code_async(prompt, max_length, temperature))
-
-# Create singleton instance
-llm = LocalLLM()
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            fallback = self.fallback()
+            if fallback is None:
+                raise Exception(f"Local inference service unavailable: {str(e)}")
+            return await fallback.generate_async(prompt, max_new_tokens, temperature, timeout)
+
+        if response.status_code == 503:
+            # ml_service answers with the model's load status; no second round trip
+            try:
+                model_status = response.json().get('status') or {}
+            except ValueError:
+                model_status = {}
+            raise ModelNotReadyError(self._status(model_status.get('model') or self.model, model_status, False))
+        response.raise_for_status()
+        data = response.json()
+
+        # ml_service echoes the prompt ahead of the completion
+        generated = data['generated_code']
+        code = generated[len(full_prompt):].strip() if generated.startswith(full_prompt) else generated.strip()
+        return {
+            'code': code or "# No code generated",
+            'truncated': data['truncated'],
+            'finish_reason': data['finish_reason'],
+            'prompt_tokens': data['usage']['prompt_tokens'],
+            'completion_tokens': data['usage']['completion_tokens'],
+            'timing': data['timing'],
+            'cached': False,
+        }
+
+    def status(self):
+        """Readiness of the inference service, shaped like LocalLLM.status()"""
+        try:
+            response = self._sync_client.get('/health/ready')
+            data = response.json()
+        except httpx.HTTPError as e:
+            fallback = self._fallback
+            if fallback is not None:
+                return fallback.status()
+            return {
+                'backend': 'remote',
+                'url': self.base_url,
+                'model': self.model,
+                'state': 'unreachable',
+                'ready': False,
+                'progress': 0.0,
+                'error': str(e),
+            }
+
+        model = self.model or data.get('default_model')
+        return self._status(model, data.get('models', {}).get(model, {}), response.status_code == 200)
+
+    def _status(self, model, model_status, ready):
+        return {
+            'backend': 'remote',
+            'url': self.base_url,
+            'model': model,
+            'state': model_status.get('state', 'unknown'),
+            'ready': ready,
+            'progress': model_status.get('progress', 0.0),
+            'error': model_status.get('error'),
+        }
+
+
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def _in_process_llm():
+    # Imported lazily: torch and transformers cost hundreds of MB per process
+    from .local_llm import LocalLLM
+    return LocalLLM()
+
+
+def get_llm():
+    """
+    The configured local LLM backend, created on first use.
+
+    By default this is a client for the shared ml_service process; set
+    LOCAL_LLM_IN_PROCESS to load the model inside this worker instead, or
+    LOCAL_LLM_FALLBACK to do so only when the service is unreachable.
+    """
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                if settings.LOCAL_LLM_IN_PROCESS:
+                    _llm = _in_process_llm()
+                else:
+                    _llm = RemoteLLM(
+                        settings.LOCAL_INFERENCE_URL,
+                        uds=settings.LOCAL_INFERENCE_UDS,
+                        model=settings.LOCAL_INFERENCE_MODEL,
+                        max_connections=settings.LOCAL_INFERENCE_MAX_CONNECTIONS,
+                        fallback=_in_process_llm if settings.LOCAL_LLM_FALLBACK else None
+                    )
+    return _llm
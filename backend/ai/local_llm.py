@@ -0,0 +1,288 @@
+import os
+import time
+import asyncio
+import threading
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, StoppingCriteriaList
+import logging
+
+from .llm_utils import ModelNotReadyError, build_prompt
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class DeadlineStoppingCriteria(StoppingCriteria):
+    """Stops generation once a time.monotonic() deadline has passed"""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.triggered = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if not self.triggered and time.monotonic() >= self.deadline:
+            self.triggered = True
+        return torch.full(
+            (input_ids.shape[0],),
+            self.triggered,
+            dtype=torch.bool,
+            device=input_ids.device
+        )
+
+
+class LocalLLM:
+    """Local LLM for code generation using GPT2-small"""
+    
+    def __init__(self, load_mode=None):
+        self.model_name = "distilgpt2"  # Much smaller model
+        self.device = torch.device("cpu")
+        self.response_cache = {}
+        self.is_loaded = False
+        self.state = 'idle'
+        self.progress = 0.0
+        self.error = None
+        self.load_started_at = None
+        self.load_finished_at = None
+        self._ready = threading.Event()
+        self._load_lock = threading.Lock()
+        self._load_thread = None
+        logger.info(f"Initialized LocalLLM with device: {self.device}")
+        
+        # eager: preload in background now, lazy: on first generation request
+        self.load_mode = load_mode or os.getenv('LOCAL_LLM_LOAD_MODE', 'eager')
+        if self.load_mode == 'eager':
+            self.start_loading()
+
+    def start_loading(self):
+        """Start the background load unless it is running or already done"""
+        with self._load_lock:
+            if self.is_loaded or (self._load_thread and self._load_thread.is_alive()):
+                return
+            self.state = 'loading'
+            self.progress = 0.0
+            self.error = None
+            self.load_started_at = time.monotonic()
+            self.load_finished_at = None
+            self._load_thread = threading.Thread(target=self._preload_model, daemon=True)
+            self._load_thread.start()
+
+    def status(self):
+        """Load state and progress for readiness probes"""
+        load_seconds = None
+        if self.load_started_at is not None:
+            end = self.load_finished_at or time.monotonic()
+            load_seconds = round(end - self.load_started_at, 2)
+        return {
+            'backend': 'in_process',
+            'model': self.model_name,
+            'state': self.state,
+            'ready': self.is_loaded,
+            'progress': round(self.progress, 2),
+            'load_mode': self.load_mode,
+            'load_seconds': load_seconds,
+            'error': self.error,
+        }
+
+    async def wait_until_ready(self, timeout=None):
+        """Wait for the model without blocking the event loop"""
+        self.start_loading()
+        loop = asyncio.get_running_loop()
+        ready = await loop.run_in_executor(None, self._ready.wait, timeout)
+        if not ready:
+            raise ModelNotReadyError(self.status())
+    
+    def _preload_model(self):
+        """Preload model in background"""
+        try:
+            logger.info("Preloading model in background...")
+            
+            # Maximum optimization
+            torch.set_grad_enabled(False)
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            
+            # Load minimal tokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(
+                self.model_name,
+                model_max_length=32,
+                padding_side='left'
+            )
+            
+            # Set special tokens
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+            self.progress = 0.1
+            
+            # Load minimal model (safetensors weights are memory-mapped)
+            self.model = AutoModelForCausalLM.from_pretrained(
+                self.model_name,
+                torch_dtype=torch.float16,
+                low_cpu_mem_usage=True,
+                use_safetensors=True
+            )
+            self.progress = 0.8
+            
+            # Optimize model
+            self.model.eval()
+            for param in self.model.parameters():
+                param.requires_grad_(False)
+            
+            # Quick test
+            with torch.inference_mode():
+                input_text = "def test():"
+                input_ids = self.tokenizer.encode(input_text, return_tensors="pt")
+                attention_mask = torch.ones_like(input_ids)
+                outputs = self.model.generate(
+                    input_ids,
+                    attention_mask=attention_mask,
+                    max_new_tokens=2,
+                    pad_token_id=self.tokenizer.eos_token_id
+                )
+                result = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+                logger.info(f"Test generation: {result}")
+            
+            self.progress = 1.0
+            self.is_loaded = True
+            self.state = 'ready'
+            self._ready.set()
+            logger.info("Model preloaded successfully")
+            
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            logger.error(f"Error preloading model: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+        finally:
+            self.load_finished_at = time.monotonic()
+    
+    async def generate_code_async(self, prompt, max_length=200, temperature=0.7):
+        """Async code generation"""
+        result = await self.generate_async(prompt, max_new_tokens=16, temperature=temperature)
+        return result['code']
+
+    async def generate_async(self, prompt, max_new_tokens=16, temperature=0.7, timeout=None):
+        """
+        Generate code within a token budget and an optional deadline (seconds).
+
+        When the deadline passes generation stops at the next token boundary and
+        the tokens produced so far are returned with ``truncated`` set.
+        """
+        try:
+            # Check cache
+            cache_key = f"{prompt}_{max_new_tokens}_{temperature}"
+            if cache_key in self.response_cache:
+                logger.info("Using cached response")
+                return dict(self.response_cache[cache_key], cached=True)
+
+            # Quick model check; in lazy mode the first request starts the load
+            if not self.is_loaded:
+                self.start_loading()
+                raise ModelNotReadyError(self.status())
+
+            started = time.monotonic()
+            deadline = started + timeout if timeout is not None else None
+
+            # Run the blocking forward passes off the event loop
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                None, self._generate, prompt, max_new_tokens, deadline
+            )
+
+            elapsed = time.monotonic() - started
+            result['timing'] = {
+                'elapsed_ms': round(elapsed * 1000, 1),
+                'deadline_ms': round(timeout * 1000, 1) if timeout is not None else None,
+                'tokens_per_second': round(result['completion_tokens'] / elapsed, 2) if elapsed > 0 else None,
+            }
+            result['cached'] = False
+
+            # Only complete generations are worth reusing
+            if not result['truncated']:
+                self.response_cache[cache_key] = result
+
+            logger.info("Code generation completed")
+            return result
+
+        except Exception as e:
+            logger.error(f"Error generating code: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            raise
+
+    def _generate(self, prompt, max_new_tokens, deadline=None):
+        """Blocking generation; returns the decoded code and stop metadata"""
+        # Minimal prompt
+        full_prompt = build_prompt(prompt)
+        logger.info(f"Using prompt: {full_prompt}")
+
+        logger.info("Generating code...")
+
+        # Efficient tokenization
+        input_ids = self.tokenizer.encode(
+            full_prompt,
+            return_tensors="pt",
+            max_length=24,
+            truncation=True,
+            padding=False
+        )
+
+        # Create attention mask
+        attention_mask = torch.ones_like(input_ids)
+
+        stopping_criteria = StoppingCriteriaList()
+        deadline_criteria = None
+        if deadline is not None:
+            deadline_criteria = DeadlineStoppingCriteria(deadline)
+            stopping_criteria.append(deadline_criteria)
+
+        # Generate with minimal settings
+        with torch.inference_mode():
+            outputs = self.model.generate(
+                input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                num_return_sequences=1,
+                pad_token_id=self.tokenizer.eos_token_id,
+                use_cache=True,
+                stopping_criteria=stopping_criteria,
+                temperature=1.0,  # Pure greedy
+                top_p=0.0,       # No sampling
+                top_k=1          # Single token
+            )
+
+        prompt_tokens = input_ids.shape[1]
+        completion_tokens = outputs.shape[1] - prompt_tokens
+
+        if deadline_criteria is not None and deadline_criteria.triggered:
+            finish_reason = 'deadline'
+        elif completion_tokens >= max_new_tokens:
+            finish_reason = 'length'
+        else:
+            finish_reason = 'stop'
+
+        # Quick decode
+        generated_text = self.tokenizer.decode(
+            outputs[0],
+            skip_special_tokens=True,
+            clean_up_tokenization_spaces=False
+        )
+
+        # Clean up the code
+        code = generated_text[len(full_prompt):].strip()
+        if not code:
+            code = "# No code generated"
+
+        logger.info(f"Generated code: {code}")
+
+        return {
+            'code': code,
+            'truncated': finish_reason != 'stop',
+            'finish_reason': finish_reason,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+        }
+
+    def generate_code(self, prompt, max_length=200, temperature=0.7):
+        """Sync wrapper for async generation"""
+        return asyncio.run(self.generate_code_async(prompt, max_length, temperature))
@@ -0,0 +1,320 @@
+import asyncio
+import contextvars
+import email.utils
+import logging
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+# Exception class names (across httpx, requests, openai and anthropic) for
+# failures that happen before any response arrives
+RETRYABLE_EXCEPTION_NAMES = {
+    'ConnectError', 'ConnectTimeout', 'ReadTimeout', 'WriteTimeout', 'PoolTimeout',
+    'RemoteProtocolError', 'ReadError', 'TimeoutException', 'NetworkError',
+    'ConnectionError', 'Timeout', 'APIConnectionError', 'APITimeoutError',
+}
+
+# Absolute deadline (time.monotonic()) shared by every call in the current request
+_deadline = contextvars.ContextVar('llm_deadline', default=None)
+
+
+class LLMUnavailableError(Exception):
+    """The provider cannot be called right now; ``retry_after`` is a hint in seconds"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Raised without calling the provider while its circuit breaker is open"""
+    pass
+
+
+class DeadlineExceededError(LLMUnavailableError):
+    """Raised when the request's time budget runs out before a call succeeds"""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+
+    After ``failure_threshold`` consecutive retryable failures the circuit
+    opens and calls fail fast. Once ``reset_timeout`` has passed it goes
+    half-open and lets ``half_open_max_calls`` probe calls through: a success
+    closes it again, a failure re-opens it for another ``reset_timeout``.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.probes = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go out now; counts it as a probe when half-open"""
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = 'half_open'
+                self.probes = 0
+                logger.info(f"Circuit for {self.name} half-open; probing")
+            if self.state == 'half_open':
+                if self.probes >= self.half_open_max_calls:
+                    return False
+                self.probes += 1
+            return True
+
+    def retry_after(self):
+        if self.state != 'open':
+            return None
+        return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info(f"Circuit for {self.name} closed")
+            self.state = 'closed'
+            self.failures = 0
+            self.probes = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning(f"Circuit for {self.name} opened after {self.failures} failures")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.probes = 0
+
+    def record_neutral(self):
+        """A call finished with an error that says nothing about provider health"""
+        with self._lock:
+            if self.state == 'half_open':
+                self.probes = max(self.probes - 1, 0)
+
+    def status(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'retry_after': self.retry_after(),
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider):
+    with _breakers_lock:
+        breaker = _breakers.get(provider)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                provider,
+                failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout=settings.LLM_CIRCUIT_RESET_SECONDS,
+            )
+            _breakers[provider] = breaker
+        return breaker
+
+
+def retry_after_headers(error):
+    """Retry-After header for a response to an LLMUnavailableError, if it carries a hint"""
+    if getattr(error, 'retry_after', None) is None:
+        return {}
+    return {'Retry-After': str(max(math.ceil(error.retry_after), 1))}
+
+
+def breaker_status():
+    return {name: breaker.status() for name, breaker in _breakers.items()}
+
+
+@contextmanager
+def deadline_budget(seconds):
+    """
+    Bound every LLM call (and retry) made inside the block by one overall
+    deadline. Nested budgets can only shorten the deadline, never extend it.
+    """
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _parse_retry_after(headers):
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        if parsed is None:
+            return None
+        return max(parsed.timestamp() - time.time(), 0.0)
+
+
+def classify(exc):
+    """``(retryable, retry_after)`` for an exception raised by a provider call"""
+    response = getattr(exc, 'response', None)
+    status_code = getattr(exc, 'status_code', None) or getattr(response, 'status_code', None)
+    if status_code is not None:
+        headers = getattr(response, 'headers', None)
+        try:
+            retry_after = _parse_retry_after(headers)
+        except (TypeError, ValueError):
+            retry_after = None
+        return status_code in RETRYABLE_STATUS_CODES, retry_after
+    if isinstance(exc, asyncio.TimeoutError):
+        return True, None
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    return bool(names & RETRYABLE_EXCEPTION_NAMES), None
+
+
+class _Attempts:
+    """Retry bookkeeping shared by the async and sync call paths"""
+
+    def __init__(self, provider, max_attempts=None, deadline=None):
+        self.provider = provider
+        self.breaker = get_breaker(provider)
+        self.max_attempts = max_attempts or settings.LLM_MAX_ATTEMPTS
+        budget_end = _deadline.get()
+        if deadline is not None:
+            own_end = time.monotonic() + deadline
+            budget_end = own_end if budget_end is None else min(budget_end, own_end)
+        if budget_end is None:
+            budget_end = time.monotonic() + settings.LLM_DEADLINE_SECONDS
+        self.deadline = budget_end
+        self.attempt = 0
+
+    def start(self):
+        """Seconds left for this attempt; raises instead of calling a provider that cannot answer"""
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceededError(f"{self.provider} request exceeded its deadline")
+        if not self.breaker.allow():
+            raise CircuitOpenError(
+                f"{self.provider} is unavailable (circuit open)",
+                retry_after=self.breaker.retry_after()
+            )
+        self.attempt += 1
+        return remaining
+
+    def succeeded(self):
+        self.breaker.record_success()
+
+    def abandoned(self):
+        """The attempt was cancelled before it finished: release its half-open probe"""
+        self.breaker.record_neutral()
+
+    def failed(self, exc):
+        """
+        Delay before the next attempt. Errors that are not retryable are
+        re-raised as they are; retryable ones that cannot be retried again
+        become LLMUnavailableError.
+        """
+        retryable, retry_after = classify(exc)
+        if not retryable:
+            self.breaker.record_neutral()
+            raise exc
+        self.breaker.record_failure()
+        if isinstance(exc, asyncio.TimeoutError) and time.monotonic() >= self.deadline:
+            raise DeadlineExceededError(f"{self.provider} request exceeded its deadline") from exc
+        if self.breaker.state == 'open':
+            # This failure tripped the breaker; don't wait out a backoff first
+            raise CircuitOpenError(
+                f"{self.provider} is unavailable (circuit open): {exc}",
+                retry_after=self.breaker.retry_after()
+            ) from exc
+        if self.attempt >= self.max_attempts:
+            raise LLMUnavailableError(
+                f"{self.provider} failed after {self.attempt} attempts: {exc}", retry_after=retry_after
+            ) from exc
+
+        # Full jitter keeps clients that failed together from retrying together
+        backoff = random.uniform(0, min(
+            settings.LLM_BACKOFF_MAX_SECONDS,
+            settings.LLM_BACKOFF_BASE_SECONDS * 2 ** (self.attempt - 1)
+        ))
+        delay = max(backoff, retry_after or 0.0)
+        if time.monotonic() + delay >= self.deadline:
+            # Waiting as asked would overrun the budget; fail now instead
+            raise DeadlineExceededError(
+                f"{self.provider} unavailable within the request deadline: {exc}", retry_after=retry_after
+            ) from exc
+        logger.warning(
+            f"{self.provider} call failed ({type(exc).__name__}: {exc}); "
+            f"retry {self.attempt}/{self.max_attempts - 1} in {delay:.2f}s"
+        )
+        return delay
+
+
+async def call_with_resilience(provider, func, max_attempts=None, deadline=None):
+    """
+    Await ``func()`` with jittered exponential backoff on retryable errors,
+    honouring Retry-After, within the request's deadline budget and behind
+    the provider's circuit breaker. ``deadline`` (seconds) tightens the
+    budget for this call alone.
+    """
+    attempts = _Attempts(provider, max_attempts, deadline)
+    while True:
+        remaining = attempts.start()
+        try:
+            result = await asyncio.wait_for(func(), timeout=remaining)
+        except Exception as e:
+            delay = attempts.failed(e)
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # Cancelled (e.g. the client disconnected); not a verdict on the provider
+            attempts.abandoned()
+            raise
+        attempts.succeeded()
+        return result
+
+
+def call_with_resilience_sync(provider, func, max_attempts=None, deadline=None):
+    """
+    Blocking counterpart of ``call_with_resilience``. ``func`` receives the
+    seconds left in the budget and should pass them on as its own timeout.
+    """
+    attempts = _Attempts(provider, max_attempts, deadline)
+    while True:
+        remaining = attempts.start()
+        try:
+            result = func(remaining)
+        except Exception as e:
+            time.sleep(attempts.failed(e))
+            continue
+        except BaseException:
+            attempts.abandoned()
+            raise
+        attempts.succeeded()
+        return result
@@ -1,3 +1,276 @@
-from django.test import TestCase
+import asyncio
+import json
+import time
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from django.test import SimpleTestCase, override_settings
+
+from .clients import get_anthropic_client, get_http_client, get_openai_client
+from .llm_utils import ModelNotReadyError, RemoteLLM, build_prompt
+from .resilience import (
+    CircuitBreaker, CircuitOpenError, LLMUnavailableError, _breakers, call_with_resilience,
+    call_with_resilience_sync, get_breaker,
+)
+
+
+class HealthTests(SimpleTestCase):
+    def llm(self, ready):
+        llm = mock.Mock()
+        llm.status.return_value = {'state': 'ready' if ready else 'loading', 'ready': ready, 'progress': 0.5}
+        return mock.patch('ai.views.get_llm', return_value=llm)
+
+    def test_live_does_not_wait_for_the_model(self):
+        with self.llm(False) as get_llm:
+            response = self.client.get('/api/ai/health/live/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'alive'})
+        get_llm.assert_not_called()
+
+    def test_ready_reports_model_state(self):
+        with self.llm(False):
+            response = self.client.get('/api/ai/health/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['llm']['state'], 'loading')
+        with self.llm(True):
+            response = self.client.get('/api/ai/health/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'ready')
+
+
+class RemoteLLMTests(SimpleTestCase):
+    def llm(self, handler, **kwargs):
+        llm = RemoteLLM('http://ml-service', **kwargs)
+        transport = httpx.MockTransport(handler)
+        llm._sync_client = httpx.Client(base_url=llm.base_url, transport=transport)
+        llm._client = lambda: httpx.AsyncClient(base_url=llm.base_url, transport=transport)
+        return llm
+
+    def generate(self, llm, **kwargs):
+        return asyncio.run(llm.generate_async('add two numbers', **kwargs))
+
+    def test_generation_strips_the_echoed_prompt(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={
+                'generated_code': build_prompt('add two numbers') + ' add(a, b):\n    return a + b',
+                'truncated': False, 'finish_reason': 'stop',
+                'usage': {'prompt_tokens': 9, 'completion_tokens': 12}, 'timing': {'elapsed_ms': 40.0},
+            })
+
+        result = self.generate(self.llm(handler, model='small'), max_new_tokens=32, timeout=1.5)
+        self.assertEqual(result['code'], 'add(a, b):\n    return a + b')
+        self.assertEqual((result['finish_reason'], result['completion_tokens']), ('stop', 12))
+        body = json.loads(requests[0].content)
+        self.assertEqual((body['model'], body['max_new_tokens'], body['deadline_ms']), ('small', 32, 1500))
+
+    def test_loading_model_raises_not_ready_from_the_response(self):
+        def handler(request):
+            return httpx.Response(503, headers={'Retry-After': '5'}, json={
+                'detail': 'Model is still loading',
+                'status': {'model': 'big', 'state': 'loading', 'progress': 0.25},
+            })
+
+        with self.assertRaises(ModelNotReadyError) as raised:
+            self.generate(self.llm(handler))
+        self.assertEqual(str(raised.exception), 'Model not loaded (loading, 25%)')
+        self.assertEqual(raised.exception.status['model'], 'big')
+
+        with self.assertRaises(ModelNotReadyError) as raised:
+            self.generate(self.llm(lambda request: httpx.Response(503, text='busy')))
+        self.assertEqual(raised.exception.status['state'], 'unknown')
+
+    def test_unreachable_service_uses_the_fallback(self):
+        def handler(request):
+            raise httpx.ConnectError('refused', request=request)
+
+        with self.assertRaisesMessage(Exception, 'Local inference service unavailable'):
+            self.generate(self.llm(handler))
+
+        fallback = mock.Mock()
+        fallback.generate_async = mock.AsyncMock(return_value={'code': 'pass'})
+        llm = self.llm(handler, fallback=lambda: fallback)
+        self.assertEqual(self.generate(llm), {'code': 'pass'})
+        self.assertEqual(self.generate(llm), {'code': 'pass'})
+        self.assertEqual(fallback.generate_async.await_count, 2)
+
+    def test_status_reads_the_readiness_probe(self):
+        def handler(request):
+            self.assertEqual(request.url.path, '/health/ready')
+            return httpx.Response(503, json={
+                'status': 'failed', 'default_model': 'big',
+                'models': {'big': {'state': 'failed', 'progress': 0.0, 'error': 'out of memory'}},
+            })
+
+        status = self.llm(handler).status()
+        self.assertEqual((status['model'], status['state'], status['ready'], status['error']),
+                         ('big', 'failed', False, 'out of memory'))
+
+        def refused(request):
+            raise httpx.ConnectError('refused', request=request)
+        self.assertEqual(self.llm(refused).status()['state'], 'unreachable')
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('ai.resilience.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=30.0)
+
+    def trip(self):
+        for _ in range(3):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertEqual(self.breaker.failures, 0)
+
+        self.trip()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 10
+        self.assertEqual(self.breaker.retry_after(), 20.0)
+
+    def test_half_open_probe_closes_on_success(self):
+        self.trip()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, 'half_open')
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.status(), {'state': 'closed', 'failures': 0, 'retry_after': None})
+        self.assertTrue(self.breaker.allow())
+
+    def test_half_open_probe_reopens_on_failure(self):
+        self.trip()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertEqual(self.breaker.retry_after(), 30.0)
+        self.assertFalse(self.breaker.allow())
+
+    def test_neutral_result_releases_probe(self):
+        self.trip()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_neutral()
+        self.assertEqual(self.breaker.state, 'half_open')
+        self.assertTrue(self.breaker.allow())
+
+
+@override_settings(LLM_MAX_ATTEMPTS=3, LLM_CIRCUIT_FAILURE_THRESHOLD=2, LLM_CIRCUIT_RESET_SECONDS=30.0,
+                   LLM_BACKOFF_BASE_SECONDS=0.0, LLM_DEADLINE_SECONDS=60.0)
+class CallWithResilienceTests(SimpleTestCase):
+    def setUp(self):
+        _breakers.pop('test', None)
+        self.addCleanup(_breakers.pop, 'test', None)
+        patcher = mock.patch('ai.resilience.time.sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def flaky(self, *errors):
+        remaining = list(errors)
+
+        def call(timeout):
+            if remaining:
+                raise remaining.pop(0)
+            return 'ok'
+        return call
+
+    def test_retries_retryable_errors(self):
+        self.assertEqual(call_with_resilience_sync('test', self.flaky(ProviderError(429))), 'ok')
+        self.assertEqual(get_breaker('test').state, 'closed')
+
+    def test_non_retryable_errors_are_raised_without_tripping(self):
+        with self.assertRaises(ProviderError):
+            call_with_resilience_sync('test', self.flaky(ProviderError(400)))
+        self.assertEqual(get_breaker('test').failures, 0)
+
+    def test_repeated_failures_open_the_circuit(self):
+        with self.assertRaises(CircuitOpenError) as raised:
+            call_with_resilience_sync('test', self.flaky(ProviderError(503), ProviderError(503)))
+        self.assertAlmostEqual(raised.exception.retry_after, 30.0, places=1)
+        self.assertIsInstance(raised.exception, LLMUnavailableError)
+        called = mock.Mock()
+        with self.assertRaises(CircuitOpenError):
+            call_with_resilience_sync('test', called)
+        called.assert_not_called()
+
+    def test_gives_up_after_max_attempts(self):
+        with override_settings(LLM_CIRCUIT_FAILURE_THRESHOLD=10):
+            with self.assertRaisesMessage(LLMUnavailableError, 'failed after 3 attempts'):
+                call_with_resilience_sync('test', self.flaky(*[ProviderError(500)] * 3))
+
+    def test_cancelled_probe_is_released(self):
+        breaker = get_breaker('test')
+        breaker.state = 'open'
+        breaker.opened_at = time.monotonic() - 60
+
+        async def cancelled():
+            started = asyncio.Event()
+
+            async def hang():
+                started.set()
+                await asyncio.sleep(60)
+            task = asyncio.ensure_future(call_with_resilience('test', hang))
+            await started.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancelled())
+        self.assertEqual(breaker.state, 'half_open')
+        self.assertEqual(breaker.probes, 0)
+        self.assertTrue(breaker.allow())
+
+
+class SharedClientTests(SimpleTestCase):
+    def clients(self, factory):
+        async def twice():
+            return factory(), factory()
+        return asyncio.run(twice())
+
+    def test_clients_are_shared_within_an_event_loop(self):
+        for factory in (lambda: get_http_client('http://provider'), lambda: get_openai_client('key'),
+                        lambda: get_anthropic_client('key')):
+            first, second = self.clients(factory)
+            self.assertIs(first, second)
+            # A client is bound to its loop, so another loop gets its own
+            self.assertIsNot(self.clients(factory)[0], first)
+
+    def test_http_clients_are_keyed_by_url(self):
+        a, b = self.clients(lambda: get_http_client('http://a'))
+        c, _ = self.clients(lambda: get_http_client('http://b'))
+        self.assertEqual(str(a.base_url), 'http://a')
+        self.assertEqual(str(c.base_url), 'http://b')
+
+
+class AsyncViewTests(SimpleTestCase):
+    def test_async_view_validates_and_answers(self):
+        response = self.client.post('/api/ai/chat/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Message is required'})
+        self.assertEqual(self.client.get('/api/ai/chat/').status_code, 405)
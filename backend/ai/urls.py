@@ -4,4 +4,6 @@ from . import views
 urlpatterns = [
     path('chat/', views.chat, name='ai_chat'),
     path('generate/', views.generate, name='ai_generate'),
+    path('health/live/', views.health_live, name='ai_health_live'),
+    path('health/ready/', views.health_ready, name='ai_health_ready'),
 ]
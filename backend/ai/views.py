@@ -3,26 +3,16 @@ from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.conf import settings
-from .llm_utils import llm
+from .async_views import async_api_view
+from .clients import get_openai_client
+from .llm_utils import get_llm, ModelNotReadyError
+from .resilience import LLMUnavailableError, breaker_status, call_with_resilience, retry_after_headers
 import openai
-import asyncio
-from functools import wraps
-from asgiref.sync import async_to_sync
 
 # Create your views here.
 
-def async_api_view(methods):
-    """Decorator for async API views"""
-    def decorator(func):
-        @api_view(methods)
-        @wraps(func)
-        def wrapped(*args, **kwargs):
-            return async_to_sync(func)(*args, **kwargs)
-        return wrapped
-    return decorator
-
-@api_view(['POST'])
-def chat(request):
+@async_api_view(['POST'])
+async def chat(request):
     """
     Handle AI chat messages and return responses
     """
@@ -40,18 +30,21 @@ def chat(request):
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
 
-        # Initialize OpenAI client
-        client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-
-        # Create chat completion
-        response = client.chat.completions.create(
-            model="gpt-4",  # or your preferred model
-            messages=[
-                {"role": "system", "content": "You are a helpful AI coding assistant."},
-                {"role": "user", "content": message}
-            ],
-            temperature=0.7,
-            max_tokens=1000
+        # Shared async client: the request waits on the event loop, not a thread
+        client = get_openai_client()
+
+        # Create chat completion, retried with backoff within the deadline
+        response = await call_with_resilience(
+            "openai",
+            lambda: client.chat.completions.create(
+                model="gpt-4",  # or your preferred model
+                messages=[
+                    {"role": "system", "content": "You are a helpful AI coding assistant."},
+                    {"role": "user", "content": message}
+                ],
+                temperature=0.7,
+                max_tokens=1000
+            )
         )
 
         # Extract the response
@@ -61,7 +54,13 @@ def chat(request):
             'response': ai_response
         })
 
-    except openai.error.OpenAIError as e:
+    except LLMUnavailableError as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers=retry_after_headers(e)
+        )
+    except openai.OpenAIError as e:
         return Response(
             {'error': str(e)},
             status=status.HTTP_503_SERVICE_UNAVAILABLE
@@ -75,12 +74,12 @@ def chat(request):
 
 async def generate_code(prompt, max_length, temperature):
     try:
-        result = llm.generate_code(
-            prompt=prompt,
-            max_length=max_length,
+        result = await get_llm().generate_async(
+            prompt,
+            max_new_tokens=max_length,
             temperature=temperature
         )
-        return result
+        return result['code']
     except Exception as e:
         raise Exception(str(e))
 
@@ -99,24 +98,35 @@ async def generate(request):
             )
 
         # Get optional parameters with minimal defaults
-        max_length = min(request.data.get('max_length', 16), 24)  # Strict cap
+        max_length = min(request.data.get('max_length', 16), 24)  # Strict cap on new tokens
         temperature = min(max(request.data.get('temperature', 0.7), 0.1), 1.0)
+        # Latency budget: stop at the deadline and return what we have so far
+        deadline_ms = min(max(request.data.get('deadline_ms', 1000), 100), 10000)
+
+        result = await get_llm().generate_async(
+            prompt,
+            max_new_tokens=max_length,
+            temperature=temperature,
+            timeout=deadline_ms / 1000
+        )
+        return Response({
+            'generated_code': result['code'],
+            'truncated': result['truncated'],
+            'finish_reason': result['finish_reason'],
+            'usage': {
+                'prompt_tokens': result['prompt_tokens'],
+                'completion_tokens': result['completion_tokens'],
+            },
+            'timing': result['timing'],
+            'cached': result['cached'],
+        })
 
-        try:
-            # Generate code with timeout
-            result = await asyncio.wait_for(
-                llm.generate_code_async(prompt, max_length, temperature),
-                timeout=1.0
-            )
-            return Response({
-                'generated_code': result
-            })
-        except asyncio.TimeoutError:
-            return Response(
-                {'error': 'Code generation timed out. Please try again with a simpler prompt.'},
-                status=status.HTTP_504_GATEWAY_TIMEOUT
-            )
-
+    except ModelNotReadyError as e:
+        return Response(
+            {'error': str(e), 'status': e.status},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': '5'}
+        )
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
@@ -128,3 +138,29 @@ async def generate(request):
             },
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+@api_view(['GET'])
+def health_live(request):
+    """
+    Liveness probe: the process is up and serving requests
+    """
+    return Response({'status': 'alive'})
+
+
+@api_view(['GET'])
+def health_ready(request):
+    """
+    Whether the local model is warm. Informational: it answers 503 until
+    ml_service has loaded, so load balancers should probe health_live.
+    """
+    llm_status = get_llm().status()
+    # Provider circuits are informational: an open circuit is not a reason to
+    # take this instance out of rotation
+    circuits = breaker_status()
+    if llm_status['ready']:
+        return Response({'status': 'ready', 'llm': llm_status, 'circuits': circuits})
+    return Response(
+        {'status': 'not_ready', 'llm': llm_status, 'circuits': circuits},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
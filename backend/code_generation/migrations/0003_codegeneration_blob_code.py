@@ -0,0 +1,69 @@
+# Generated by Django 5.0.2 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+def move_code_to_blobs(apps, schema_editor):
+    from project_management.blobs import get_blob_store
+
+    CodeGeneration = apps.get_model('code_generation', 'CodeGeneration')
+    store = get_blob_store()
+    batch = []
+    queryset = CodeGeneration.objects.exclude(inline_code='').only('id', 'inline_code')
+    for generation in queryset.iterator(chunk_size=500):
+        generation.code_hash = store.put(generation.inline_code.encode('utf-8'))
+        generation.inline_code = ''
+        batch.append(generation)
+        if len(batch) >= 500:
+            CodeGeneration.objects.bulk_update(batch, ['inline_code', 'code_hash'])
+            batch = []
+    if batch:
+        CodeGeneration.objects.bulk_update(batch, ['inline_code', 'code_hash'])
+
+
+def restore_inline_code(apps, schema_editor):
+    from project_management.blobs import get_blob_store
+
+    CodeGeneration = apps.get_model('code_generation', 'CodeGeneration')
+    store = get_blob_store()
+    batch = []
+    queryset = CodeGeneration.objects.filter(inline_code='').exclude(code_hash='').only('id', 'code_hash')
+    for generation in queryset.iterator(chunk_size=500):
+        generation.inline_code = store.get(generation.code_hash).decode('utf-8')
+        batch.append(generation)
+        if len(batch) >= 500:
+            CodeGeneration.objects.bulk_update(batch, ['inline_code'])
+            batch = []
+    if batch:
+        CodeGeneration.objects.bulk_update(batch, ['inline_code'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('code_generation', '0002_codegeneration_usage'),
+    ]
+
+    operations = [
+        # Same column, new attribute name: ``generated_code`` is now a
+        # property backed by the blob store
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveField(
+                    model_name='codegeneration',
+                    name='generated_code',
+                ),
+                migrations.AddField(
+                    model_name='codegeneration',
+                    name='inline_code',
+                    field=models.TextField(blank=True, db_column='generated_code', default=''),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='codegeneration',
+            name='code_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.RunPython(move_code_to_blobs, restore_inline_code),
+    ]
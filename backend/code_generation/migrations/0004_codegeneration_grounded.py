@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-19 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('code_generation', '0003_codegeneration_blob_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='codegeneration',
+            name='grounded',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
+from project_management.blobs import blob_text_property, store_blob_text
 
 User = get_user_model()
 
@@ -16,7 +17,9 @@ class CodeGeneration(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     prompt = models.TextField()
     language = models.CharField(max_length=50)
-    generated_code = models.TextField()
+    # Only rows written before blob storage still hold their code here
+    inline_code = models.TextField(db_column='generated_code', blank=True, default='')
+    code_hash = models.CharField(max_length=64, blank=True)
     ai_model = models.CharField(max_length=50, choices=AI_MODEL_CHOICES, default='gpt-4')
     created_at = models.DateTimeField(auto_now_add=True)
     rating = models.IntegerField(
@@ -25,12 +28,18 @@ class CodeGeneration(models.Model):
         validators=[MinValueValidator(1), MaxValueValidator(5)]
     )
     feedback = models.TextField(blank=True)
+    # Provider token counts for the call(s) behind this generation, incl. cached prompt tokens
+    usage = models.JSONField(default=dict, blank=True)
     template = models.ForeignKey(
         'CodeTemplate',
         on_delete=models.SET_NULL,
         null=True,
         blank=True
     )
+    # Generated with retrieved project snippets; kept out of the shared prompt cache
+    grounded = models.BooleanField(default=False)
+
+    generated_code = blob_text_property('inline_code', 'code_hash', doc="The generated code, loaded from the blob store")
 
     class Meta:
         ordering = ['-created_at']
@@ -38,6 +47,13 @@ class CodeGeneration(models.Model):
     def __str__(self):
         return f"{self.language} code generation - {self.created_at}"
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'generated_code' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'inline_code', 'code_hash'} - {'generated_code'}
+        store_blob_text(self, 'inline_code', 'code_hash')
+        super().save(*args, **kwargs)
+
 
 class CodeTemplate(models.Model):
     name = models.CharField(max_length=255)
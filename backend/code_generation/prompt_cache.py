@@ -0,0 +1,192 @@
+import re
+import threading
+import zlib
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+# Mersenne prime for the universal hash family h(x) = (a * x + b) mod p
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+SHINGLE_SIZE = 5
+FILLER_WORDS = {"please", "a", "an", "the", "me", "some", "can", "you", "could", "i", "want", "need"}
+# Any script's letters and digits, not just ASCII
+WORD_PATTERN = re.compile(r"\w+")
+# Prompts with fewer distinct shingles than this say too little to match on
+MIN_SHINGLES = 8
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase, drop punctuation and filler words, collapse whitespace."""
+    words = WORD_PATTERN.findall(prompt.lower())
+    return " ".join(word for word in words if word not in FILLER_WORDS)
+
+
+def shingle_count(text: str, size: int = SHINGLE_SIZE) -> int:
+    return len({text[i:i + size] for i in range(len(text) - size + 1)})
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """32-bit hashes of the character n-grams of ``text``."""
+    if len(text) <= size:
+        grams = {text}
+    else:
+        grams = {text[i:i + size] for i in range(len(text) - size + 1)}
+    return np.fromiter((zlib.crc32(gram.encode()) for gram in grams), dtype=np.uint64, count=len(grams))
+
+
+class MinHasher:
+    """MinHash signatures whose per-slot agreement estimates Jaccard similarity."""
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingles(text)
+        # (shingles x permutations), reduced to the minimum per permutation
+        permuted = (np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class SimilarPromptCache:
+    """
+    Finds earlier generations whose prompt is a near-duplicate of a new one.
+
+    Prompts are normalized, reduced to MinHash signatures and bucketed with
+    LSH banding, so a lookup only compares against the few entries sharing a
+    band; candidates are then scored by signature agreement (estimated
+    Jaccard similarity of their character shingles). Entries are partitioned
+    by (language, ai_model) and each partition is seeded lazily from the most
+    recent CodeGeneration rows, so every worker converges on the same index.
+    Generations grounded in a project's code are never seeded, since they
+    may quote another user's private files.
+    """
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 128, bands: int = 32,
+                 max_entries: int = 10000):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        self.hasher = MinHasher(num_perm)
+        # partition -> generation id -> signature (LRU order)
+        self._signatures: Dict[Tuple[str, str], "OrderedDict[int, np.ndarray]"] = defaultdict(OrderedDict)
+        # partition -> (band, band hash) -> generation ids
+        self._buckets: Dict[Tuple[str, str], Dict[Tuple[int, bytes], set]] = defaultdict(lambda: defaultdict(set))
+        self._seeded = set()
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0}
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _seed(self, partition: Tuple[str, str]) -> None:
+        if partition in self._seeded:
+            return
+        from .models import CodeGeneration
+        language, ai_model = partition
+        recent = (
+            CodeGeneration.objects
+            .filter(language=language, ai_model=ai_model, template__isnull=True, grounded=False)
+            .order_by('-created_at')
+            .values_list('id', 'prompt')[:self.max_entries]
+        )
+        for generation_id, prompt in reversed(list(recent)):
+            self._add(partition, generation_id, prompt)
+        self._seeded.add(partition)
+
+    def _add(self, partition: Tuple[str, str], generation_id: int, prompt: str) -> None:
+        text = normalize_prompt(prompt)
+        if shingle_count(text) < MIN_SHINGLES:
+            return
+        signature = self.hasher.signature(text)
+        signatures = self._signatures[partition]
+        buckets = self._buckets[partition]
+        signatures[generation_id] = signature
+        for key in self._band_keys(signature):
+            buckets[key].add(generation_id)
+        while len(signatures) > self.max_entries:
+            self._remove(partition, next(iter(signatures)))
+
+    def _remove(self, partition: Tuple[str, str], generation_id: int) -> None:
+        signature = self._signatures[partition].pop(generation_id, None)
+        if signature is None:
+            return
+        buckets = self._buckets[partition]
+        for key in self._band_keys(signature):
+            bucket = buckets.get(key)
+            if bucket is not None:
+                bucket.discard(generation_id)
+                if not bucket:
+                    del buckets[key]
+
+    def add(self, generation) -> None:
+        """Index a freshly stored CodeGeneration."""
+        if generation.grounded:
+            return
+        partition = (generation.language, generation.ai_model)
+        with self._lock:
+            self._seed(partition)
+            self._add(partition, generation.id, generation.prompt)
+
+    def lookup(self, prompt: str, language: str, ai_model: str,
+               threshold: Optional[float] = None) -> Optional[Tuple[object, float]]:
+        """Most similar stored generation at or above ``threshold``, with its similarity."""
+        from .models import CodeGeneration
+        threshold = self.threshold if threshold is None else threshold
+        partition = (language, ai_model)
+        text = normalize_prompt(prompt)
+        if shingle_count(text) < MIN_SHINGLES:
+            return None
+        signature = self.hasher.signature(text)
+
+        with self._lock:
+            self._seed(partition)
+            self.stats["lookups"] += 1
+            signatures = self._signatures[partition]
+            buckets = self._buckets[partition]
+            candidates = set()
+            for key in self._band_keys(signature):
+                candidates.update(buckets.get(key, ()))
+            if not candidates:
+                return None
+            ids = list(candidates)
+            matrix = np.stack([signatures[generation_id] for generation_id in ids])
+            similarities = (matrix == signature).mean(axis=1)
+
+        ranked: List[Tuple[float, int]] = sorted(zip(similarities.tolist(), ids), reverse=True)
+        for similarity, generation_id in ranked:
+            if similarity < threshold:
+                break
+            generation = CodeGeneration.objects.filter(id=generation_id).first()
+            if generation is None:
+                # Deleted since it was indexed
+                with self._lock:
+                    self._remove(partition, generation_id)
+                continue
+            with self._lock:
+                self._signatures[partition].move_to_end(generation_id)
+                self.stats["hits"] += 1
+            return generation, similarity
+        return None
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(
+            self.stats,
+            entries=sum(len(signatures) for signatures in self._signatures.values()),
+            partitions=len(self._signatures),
+        )
+
+
+prompt_cache = SimilarPromptCache(
+    threshold=settings.PROMPT_CACHE_THRESHOLD,
+    max_entries=settings.PROMPT_CACHE_MAX_ENTRIES,
+)
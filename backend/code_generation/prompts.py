@@ -0,0 +1,64 @@
+"""
+System prompts for AICodeGenerator.
+
+Each prompt is a fixed, language-independent block of instructions followed
+by a short language line, built once per (kind, language) and reused
+verbatim. Keeping the leading bytes identical across calls is what lets
+providers serve the prefix from their prompt cache (OpenAI caches matching
+prefixes automatically, Anthropic caches blocks marked with cache_control);
+anything that varies per request belongs in later messages. These prompts
+are shorter than the 1024-token minimum both providers cache, so on their
+own they are never cached; the cached prefix only pays off once the
+retrieved project context that follows them pushes it past that size.
+"""
+from functools import lru_cache
+
+PROJECT_STRUCTURE_INSTRUCTIONS = """You are an expert software architect and developer. Create a complete project structure based on the project description you are given.
+Your response must be in JSON format with the following structure:
+{
+    "files": [
+        {"path": "relative/path/to/file", "content": "file content"},
+        ...
+    ],
+    "dependencies": {"package_name": "version"},
+    "setup_instructions": ["instruction1", "instruction2", ...]
+}
+
+Follow these guidelines:
+1. Include all necessary configuration files (e.g., package.json, requirements.txt)
+2. Create a comprehensive README.md
+3. Follow best practices for the project's language
+4. Include appropriate testing setup
+5. Add proper documentation
+6. Set up proper project structure with separate directories for source, tests, etc.
+7. Include basic CI/CD configuration if relevant"""
+
+CODE_GENERATION_INSTRUCTIONS = """You are an expert developer. Generate clean, efficient, and well-documented code based on the prompt you are given.
+Follow these guidelines:
+1. Use modern best practices
+2. Include proper error handling
+3. Add comprehensive documentation
+4. Follow the language's style guidelines
+5. Consider performance and security
+Your response should be properly formatted code, wrapped in markdown code blocks."""
+
+CODE_ANALYSIS_INSTRUCTIONS = """You are a code quality expert. Analyze the code you are given and provide detailed feedback."""
+
+TEMPLATE_FILL_INSTRUCTIONS = """You are an expert developer filling one marked slot in a code template. Reply with only the code for that slot, wrapped in a markdown code block."""
+
+INSTRUCTIONS = {
+    'project_structure': (PROJECT_STRUCTURE_INSTRUCTIONS, "The project is written in {language}."),
+    'code_generation': (CODE_GENERATION_INSTRUCTIONS, "Write {language} code."),
+    'code_analysis': (CODE_ANALYSIS_INSTRUCTIONS, "The code is written in {language}."),
+    'template_fill': (TEMPLATE_FILL_INSTRUCTIONS, "Write {language} code."),
+}
+
+
+@lru_cache(maxsize=None)
+def system_prompt(kind: str, language: str = '') -> str:
+    """The byte-stable system prompt of ``kind`` for ``language``."""
+    instructions, language_line = INSTRUCTIONS[kind]
+    language = language.strip()
+    if not language:
+        return instructions
+    return f"{instructions}\n\n{language_line.format(language=language)}"
@@ -1,14 +1,27 @@
 from rest_framework import serializers
 from .models import CodeGeneration, CodeTemplate
+from .templating import TemplateError, compile_template
 
 class CodeGenerationSerializer(serializers.ModelSerializer):
+    generated_code = serializers.CharField(allow_blank=True, trim_whitespace=False)
+
     class Meta:
         model = CodeGeneration
-        fields = '__all__'
-        read_only_fields = ('created_at',)
+        exclude = ('inline_code',)
+        read_only_fields = ('created_at', 'code_hash')
 
 class CodeTemplateSerializer(serializers.ModelSerializer):
     class Meta:
         model = CodeTemplate
         fields = '__all__'
         read_only_fields = ('created_at', 'updated_at')
+
+    def validate(self, attrs):
+        # Compile up front so broken templates are rejected at save time
+        code = attrs.get('code', getattr(self.instance, 'code', ''))
+        variables = attrs.get('variables', getattr(self.instance, 'variables', None))
+        try:
+            compile_template(code, variables)
+        except TemplateError as e:
+            raise serializers.ValidationError({'code': str(e)})
+        return attrs
@@ -1,12 +1,21 @@
 import openai
+import anthropic
 from django.conf import settings
 from typing import Dict, List, Optional, Tuple, Any
 import json
+import logging
 import os
 import re
+import time
 from enum import Enum
 from abc import ABC, abstractmethod
-import requests
+
+from ai.clients import get_anthropic_client, get_http_client, get_openai_client
+from ai.resilience import LLMUnavailableError, call_with_resilience, deadline_budget
+from .prompts import system_prompt
+from .templating import TemplateError, compile_template
+
+logger = logging.getLogger(__name__)
 
 class AIModel(Enum):
     GPT_4 = "gpt-4"
@@ -35,52 +44,213 @@ class AIModelConfig:
             self.api_base = settings.QWEN_API_BASE
 
 class AIModelInterface(ABC):
+    def __init__(self, model_config: AIModelConfig):
+        self.config = model_config
+        # Token counts summed over every call made through this adapter
+        self.usage = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "completion_tokens": 0,
+            "latency_ms": 0.0,
+        }
+
     @abstractmethod
-    async def generate_completion(self, messages: List[Dict[str, str]]) -> str:
+    async def generate_completion(
+        self, messages: List[Dict[str, str]], response_format: Optional[str] = None
+    ) -> str:
+        """
+        Complete a chat. ``response_format`` names the JSON schema the reply
+        must follow (e.g. "project_structure"); backends that can enforce it
+        do so, the rest rely on the prompt.
+        """
         pass
 
+    def _record_usage(self, prompt_tokens: int, cached_tokens: int, completion_tokens: int, started: float) -> None:
+        latency_ms = (time.monotonic() - started) * 1000
+        self.usage["calls"] += 1
+        self.usage["prompt_tokens"] += prompt_tokens or 0
+        self.usage["cached_tokens"] += cached_tokens or 0
+        self.usage["completion_tokens"] += completion_tokens or 0
+        self.usage["latency_ms"] = round(self.usage["latency_ms"] + latency_ms, 1)
+        logger.info(
+            f"{self.config.model_type.value}: {prompt_tokens} prompt tokens "
+            f"({cached_tokens} cached), {completion_tokens} completion tokens in {latency_ms:.0f}ms"
+        )
+
+
+def _openai_cached_tokens(usage) -> int:
+    """Cached prompt tokens from an OpenAI-style usage object or dict, when reported."""
+    if usage is None:
+        return 0
+    if isinstance(usage, dict):
+        return (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is None:
+        return 0
+    return getattr(details, "cached_tokens", 0) or 0
+
+
 class OpenAIModel(AIModelInterface):
-    def __init__(self, model_config: AIModelConfig):
-        self.config = model_config
-        openai.api_key = model_config.api_key
+    """
+    OpenAI chat completions. Prompts of 1024+ tokens are cached automatically
+    by matching prefix, so messages keep the stable system prompt first.
+    """
 
-    async def generate_completion(self, messages: List[Dict[str, str]]) -> str:
-        response = await openai.ChatCompletion.acreate(
-            model=self.config.model_type.value,
-            messages=messages
+    @property
+    def client(self) -> openai.AsyncOpenAI:
+        # Shared per event loop, so connections are reused across requests
+        return get_openai_client(self.config.api_key)
+
+    async def generate_completion(
+        self, messages: List[Dict[str, str]], response_format: Optional[str] = None
+    ) -> str:
+        # response_format is not passed on: gpt-4 rejects JSON mode, so the
+        # prompt alone asks for the schema
+        started = time.monotonic()
+        response = await call_with_resilience(
+            "openai",
+            lambda: self.client.chat.completions.create(
+                model=self.config.model_type.value,
+                messages=messages
+            )
+        )
+        usage = response.usage
+        self._record_usage(
+            usage.prompt_tokens if usage else 0,
+            _openai_cached_tokens(usage),
+            usage.completion_tokens if usage else 0,
+            started
         )
         return response.choices[0].message.content
 
 class CodeLLamaModel(AIModelInterface):
+    """
+    Local CodeLlama served by ml_service. JSON responses are decoded under the
+    requested schema there, so they always parse and never need a retry. The
+    service's prefix KV cache plays the role of provider prompt caching.
+    """
+
     def __init__(self, model_config: AIModelConfig):
-        self.config = model_config
-        # Initialize CodeLLama client here
+        super().__init__(model_config)
+        self.headers = {"Content-Type": "application/json"}
+        if model_config.api_key:
+            self.headers["Authorization"] = f"Bearer {model_config.api_key}"
 
-    async def generate_completion(self, messages: List[Dict[str, str]]) -> str:
-        # Implement CodeLLama API call
-        pass
+    def _build_prompt(self, messages: List[Dict[str, str]]) -> str:
+        # Base CodeLlama has no chat template; lay the turns out as plain text
+        return "\n\n".join(message["content"].strip() for message in messages) + "\n\n"
+
+    async def generate_completion(
+        self, messages: List[Dict[str, str]], response_format: Optional[str] = None
+    ) -> str:
+        payload = {
+            "prompt": self._build_prompt(messages),
+            "max_new_tokens": settings.CODELLAMA_MAX_NEW_TOKENS,
+            "temperature": 0.7,
+        }
+        if response_format is not None:
+            payload["response_format"] = response_format
+
+        async def post():
+            client = get_http_client(self.config.api_base)
+            response = await client.post("/generate", json=payload, headers=self.headers)
+            response.raise_for_status()
+            return response.json()
+
+        started = time.monotonic()
+        try:
+            data = await call_with_resilience("codellama", post)
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            raise Exception(f"CodeLlama API error: {str(e)}")
+        usage = data.get("usage", {})
+        self._record_usage(
+            usage.get("prompt_tokens", 0),
+            usage.get("cached_prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            started
+        )
+        return data["completion"]
 
 class AnthropicModel(AIModelInterface):
-    def __init__(self, model_config: AIModelConfig):
-        self.config = model_config
-        # Initialize Anthropic client here
+    """
+    Anthropic Messages API. Everything ahead of the final turn (the system
+    prompt and any retrieved project context) is stable between calls, so
+    cache breakpoints go after the system prompt and after the last stable
+    block. The API only caches prefixes of at least 1024 tokens; shorter
+    prompts are sent the same way but are never cached.
+    """
 
-    async def generate_completion(self, messages: List[Dict[str, str]]) -> str:
-        # Implement Anthropic API call
-        pass
+    @property
+    def client(self) -> anthropic.AsyncAnthropic:
+        return get_anthropic_client(self.config.api_key)
+
+    async def generate_completion(
+        self, messages: List[Dict[str, str]], response_format: Optional[str] = None
+    ) -> str:
+        system_blocks = [
+            {"type": "text", "text": message["content"]}
+            for message in messages if message["role"] == "system"
+        ]
+        turns = []
+        blocks = []
+        for message in messages:
+            if message["role"] == "system":
+                continue
+            block = {"type": "text", "text": message["content"]}
+            blocks.append(block)
+            # The API requires alternating roles; merge consecutive user turns
+            if turns and turns[-1]["role"] == message["role"]:
+                turns[-1]["content"].append(block)
+            else:
+                turns.append({"role": message["role"], "content": [block]})
+        for stable in (system_blocks, blocks[:-1]):
+            if stable:
+                stable[-1]["cache_control"] = {"type": "ephemeral"}
+
+        started = time.monotonic()
+        try:
+            response = await call_with_resilience(
+                "anthropic",
+                lambda: self.client.messages.create(
+                    model=settings.ANTHROPIC_MODEL,
+                    max_tokens=settings.ANTHROPIC_MAX_TOKENS,
+                    system=system_blocks,
+                    messages=turns
+                )
+            )
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            raise Exception(f"Anthropic API error: {str(e)}")
+        usage = response.usage
+        cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+        cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+        self._record_usage(
+            usage.input_tokens + cache_read + cache_write,
+            cache_read,
+            usage.output_tokens,
+            started
+        )
+        return "".join(block.text for block in response.content if block.type == "text")
 
 class QwenModel(AIModelInterface):
     def __init__(self, model_config: AIModelConfig):
-        self.config = model_config
+        super().__init__(model_config)
         self.headers = {
             "Authorization": f"Bearer {model_config.api_key}",
             "Content-Type": "application/json"
         }
 
-    async def generate_completion(self, messages: List[Dict[str, str]]) -> str:
-        try:
-            response = requests.post(
-                f"{self.config.api_base}/v1/chat/completions",
+    async def generate_completion(
+        self, messages: List[Dict[str, str]], response_format: Optional[str] = None
+    ) -> str:
+        async def post():
+            client = get_http_client(self.config.api_base)
+            response = await client.post(
+                "/v1/chat/completions",
                 headers=self.headers,
                 json={
                     "model": self.config.model_type.value,
@@ -90,15 +260,34 @@ class QwenModel(AIModelInterface):
                 }
             )
             response.raise_for_status()
-            return response.json()["choices"][0]["message"]["content"]
+            return response.json()
+
+        started = time.monotonic()
+        try:
+            data = await call_with_resilience("qwen", post)
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             raise Exception(f"Qwen API error: {str(e)}")
+        usage = data.get("usage") or {}
+        self._record_usage(
+            usage.get("prompt_tokens", 0),
+            _openai_cached_tokens(usage),
+            usage.get("completion_tokens", 0),
+            started
+        )
+        return data["choices"][0]["message"]["content"]
 
 class AICodeGenerator:
     def __init__(self, model_type: AIModel = AIModel.GPT_4):
         self.model_config = AIModelConfig(model_type)
         self.model = self._initialize_model()
 
+    @property
+    def usage(self) -> Dict[str, Any]:
+        """Token usage of the calls made so far, including provider-cached prompt tokens."""
+        return dict(self.model.usage)
+
     def _initialize_model(self) -> AIModelInterface:
         if self.model_config.model_type in [AIModel.GPT_4, AIModel.GPT_35_TURBO]:
             return OpenAIModel(self.model_config)
@@ -117,37 +306,29 @@ class AICodeGenerator:
         code_blocks = [match.group(1).strip() for match in matches]
         return "\n\n".join(code_blocks) if code_blocks else text
 
+    def _context_message(self, context: Optional[List[Dict[str, Any]]]) -> List[Dict[str, str]]:
+        """A message carrying retrieved project snippets, if there are any."""
+        if not context:
+            return []
+        snippets = "\n\n".join(
+            f"# {snippet['path']} (lines {snippet['start_line']}-{snippet['end_line']})\n{snippet['text']}"
+            for snippet in context
+        )
+        return [{"role": "user", "content": f"Relevant code from the project:\n\n{snippets}"}]
+
     async def generate_project_structure(
         self, prompt: str, language: str
     ) -> Tuple[List[Dict[str, str]], Dict[str, str], List[str]]:
         """Generate project structure including files, dependencies, and setup instructions."""
         
-        system_prompt = f"""You are an expert software architect and developer. Create a complete project structure for a {language} project based on the following description. 
-        Your response must be in JSON format with the following structure:
-        {{
-            "files": [
-                {{"path": "relative/path/to/file", "content": "file content"}},
-                ...
-            ],
-            "dependencies": {{"package_name": "version"}},
-            "setup_instructions": ["instruction1", "instruction2", ...]
-        }}
-        
-        Follow these guidelines:
-        1. Include all necessary configuration files (e.g., package.json, requirements.txt)
-        2. Create a comprehensive README.md
-        3. Follow best practices for {language}
-        4. Include appropriate testing setup
-        5. Add proper documentation
-        6. Set up proper project structure with separate directories for source, tests, etc.
-        7. Include basic CI/CD configuration if relevant"""
-
         try:
             messages = [
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": system_prompt('project_structure', language)},
                 {"role": "user", "content": prompt}
             ]
-            response_text = await self.model.generate_completion(messages)
+            response_text = await self.model.generate_completion(
+                messages, response_format="project_structure"
+            )
             
             try:
                 response_data = json.loads(response_text)
@@ -159,58 +340,65 @@ class AICodeGenerator:
             except json.JSONDecodeError:
                 return [], {}, ["Error: Invalid JSON response from AI model"]
                 
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             return [], {}, [f"Error: {str(e)}"]
 
-    async def generate_code(self, prompt: str, language: str) -> str:
-        """Generate code based on prompt and language."""
-        system_prompt = f"""You are an expert {language} developer. Generate clean, efficient, and well-documented code based on the following prompt.
-        Follow these guidelines:
-        1. Use modern best practices
-        2. Include proper error handling
-        3. Add comprehensive documentation
-        4. Follow {language} style guidelines
-        5. Consider performance and security
-        Your response should be properly formatted code, wrapped in markdown code blocks."""
-
+    async def generate_code(
+        self, prompt: str, language: str, context: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """Generate code based on prompt and language, given optional project snippets."""
         try:
             messages = [
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": system_prompt('code_generation', language)},
+                *self._context_message(context),
                 {"role": "user", "content": prompt}
             ]
             response_text = await self.model.generate_completion(messages)
             return self._clean_code_block(response_text)
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             raise Exception(f"Failed to generate code: {str(e)}")
 
     async def generate_from_template(
-        self, template_code: str, variables: Dict[str, any]
+        self, template_code: str, variables: Dict[str, any], declarations: Any = None
     ) -> str:
-        """Generate code by filling template with variables."""
-        try:
-            validation_prompt = f"""Validate this template code and fill in the variables with appropriate values:
-            Template Code:
-            {template_code}
-            
-            Variables to replace:
-            {json.dumps(variables, indent=2)}
-            
-            Return only the final code with variables replaced."""
+        """
+        Render a template locally. Placeholders are substituted without a model
+        call; only {% ai %} slots go to the LLM, all of them concurrently.
+        """
+        if declarations is None:
+            # Callers without declarations get every supplied value as a string
+            declarations = {name: {"type": "string"} for name in variables}
+        compiled = compile_template(template_code, declarations)
 
+        async def fill(instructions: str, context: str) -> str:
             messages = [
-                {"role": "system", "content": "You are a template processing expert. Fill in template variables and validate the resulting code."},
-                {"role": "user", "content": validation_prompt}
+                {"role": "system", "content": system_prompt('template_fill')},
+                {"role": "user", "content": f"Template:\n{context}\n\nWrite the code for <AI-FILL> slot: {instructions}"}
             ]
             response_text = await self.model.generate_completion(messages)
             return self._clean_code_block(response_text)
+
+        try:
+            # All slots share one deadline, however many retries each needs
+            with deadline_budget(settings.LLM_DEADLINE_SECONDS):
+                return await compiled.render_async(variables, fill)
+        except (TemplateError, LLMUnavailableError):
+            raise
         except Exception as e:
             raise Exception(f"Failed to generate from template: {str(e)}")
 
-    async def analyze_code_quality(self, code: str, language: str) -> Dict[str, any]:
+    async def analyze_code_quality(
+        self, code: str, language: str, context: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, any]:
         """Analyze code quality and provide suggestions."""
         try:
             messages = [
-                {"role": "system", "content": f"You are a code quality expert. Analyze this {language} code and provide detailed feedback."},
+                {"role": "system", "content": system_prompt('code_analysis', language)},
+                *self._context_message(context),
                 {"role": "user", "content": code}
             ]
             response_text = await self.model.generate_completion(messages)
@@ -219,6 +407,8 @@ class AICodeGenerator:
                 "quality_score": 0.8,  # Placeholder - implement actual scoring
                 "suggestions": []  # Placeholder - parse suggestions from analysis
             }
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             raise Exception(f"Failed to analyze code: {str(e)}")
 
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import re
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# {{ name }} or {{ name|filter }}; {% ai %}instructions{% endai %} marks a slot
+# the LLM fills, and may itself reference variables. {% raw %}...{% endraw %}
+# is copied as is, and so is any {{ }} whose body is not a name (JSX style
+# objects, Vue or Go template expressions)
+TOKEN_PATTERN = re.compile(
+    r"\{%\s*raw\s*%\}(.*?)\{%\s*endraw\s*%\}|\{\{\s*(.*?)\s*\}\}|\{%\s*(ai|endai)\s*%\}", re.S
+)
+IDENTIFIER_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+WORD_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+
+class TemplateError(ValueError):
+    """Raised for malformed templates, declarations or variable values."""
+    pass
+
+
+def _words(value: str) -> List[str]:
+    return WORD_PATTERN.findall(str(value))
+
+
+FILTERS: Dict[str, Callable[[Any], str]] = {
+    "upper": lambda v: str(v).upper(),
+    "lower": lambda v: str(v).lower(),
+    "snake": lambda v: "_".join(w.lower() for w in _words(v)),
+    "kebab": lambda v: "-".join(w.lower() for w in _words(v)),
+    "camel": lambda v: "".join(
+        w.lower() if i == 0 else w.capitalize() for i, w in enumerate(_words(v))
+    ),
+    "pascal": lambda v: "".join(w.capitalize() for w in _words(v)),
+    "json": lambda v: json.dumps(v),
+    "repr": repr,
+}
+
+
+def _coerce_string(value: Any, spec: Dict[str, Any]) -> str:
+    return str(value)
+
+
+def _coerce_integer(value: Any, spec: Dict[str, Any]) -> int:
+    if isinstance(value, bool):
+        raise ValueError("expected an integer")
+    return int(value)
+
+
+def _coerce_number(value: Any, spec: Dict[str, Any]) -> float:
+    if isinstance(value, bool):
+        raise ValueError("expected a number")
+    return float(value)
+
+
+def _coerce_boolean(value: Any, spec: Dict[str, Any]) -> bool:
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("true", "1", "yes"):
+        return True
+    if str(value).lower() in ("false", "0", "no"):
+        return False
+    raise ValueError("expected a boolean")
+
+
+def _coerce_identifier(value: Any, spec: Dict[str, Any]) -> str:
+    if not IDENTIFIER_PATTERN.match(str(value)):
+        raise ValueError("expected an identifier")
+    return str(value)
+
+
+def _coerce_choice(value: Any, spec: Dict[str, Any]) -> Any:
+    if value not in spec.get("choices", []):
+        raise ValueError(f"expected one of {spec.get('choices', [])}")
+    return value
+
+
+def _coerce_list(value: Any, spec: Dict[str, Any]) -> str:
+    if not isinstance(value, (list, tuple)):
+        raise ValueError("expected a list")
+    return spec.get("separator", ", ").join(str(item) for item in value)
+
+
+VARIABLE_TYPES: Dict[str, Callable[[Any, Dict[str, Any]], Any]] = {
+    "string": _coerce_string,
+    "integer": _coerce_integer,
+    "number": _coerce_number,
+    "boolean": _coerce_boolean,
+    "identifier": _coerce_identifier,
+    "choice": _coerce_choice,
+    "list": _coerce_list,
+}
+
+
+def normalize_declarations(variables: Any) -> Dict[str, Dict[str, Any]]:
+    """
+    Typed declarations from a CodeTemplate.variables value.
+
+    The canonical form maps names to ``{"type", "required", "default",
+    "description", ...}``. Older templates stored a list of names or a map of
+    names to example values; those become required and optional strings.
+    """
+    if not variables:
+        return {}
+    if isinstance(variables, list):
+        return {str(name): {"type": "string", "required": True} for name in variables}
+    if not isinstance(variables, dict):
+        raise TemplateError("Template variables must be an object or a list of names")
+
+    declarations = {}
+    for name, spec in variables.items():
+        if not IDENTIFIER_PATTERN.match(name):
+            raise TemplateError(f"Invalid variable name: {name}")
+        if not isinstance(spec, dict):
+            spec = {"type": "string", "default": spec}
+        spec = dict(spec)
+        spec.setdefault("type", "string")
+        if spec["type"] not in VARIABLE_TYPES:
+            raise TemplateError(f"Unknown type {spec['type']} for variable {name}")
+        spec.setdefault("required", "default" not in spec)
+        declarations[name] = spec
+    return declarations
+
+
+class CompiledTemplate:
+    """
+    A template parsed once into a format string and the fields feeding it.
+
+    Rendering validates and coerces the values, then is a single
+    ``str.format`` call. AI-fill slots become extra positional fields whose
+    text comes from an async ``fill`` callable; all slots of one render are
+    filled concurrently.
+    """
+
+    def __init__(self, code: str, declarations: Dict[str, Dict[str, Any]]):
+        self.declarations = declarations
+        # (format string, fields) of each slot's instructions, in slot order
+        self.ai_slots: List[Tuple[str, List[Tuple[str, Optional[str]]]]] = []
+        self._format, self._fields = self._compile(code, self.ai_slots)
+
+    def _compile(self, code: str, slots: Optional[list]):
+        """Format string and fields for ``code``; slots are collected into ``slots`` (None forbids them)."""
+        parts = []
+        fields: List[Tuple[str, Optional[str]]] = []
+        position = 0
+        slot_start = None
+        for match in TOKEN_PATTERN.finditer(code):
+            raw, expression, tag = match.groups()
+            if expression is not None and not self._is_placeholder(expression):
+                raw = match.group(0)
+            if slot_start is None:
+                parts.append(self._escape(code[position:match.start()]))
+            if raw is not None:
+                if slot_start is None:
+                    parts.append(self._escape(raw))
+            elif tag == "ai":
+                if slots is None or slot_start is not None:
+                    raise TemplateError("AI-fill slots cannot be nested")
+                slot_start = match.end()
+            elif tag == "endai":
+                if slot_start is None:
+                    raise TemplateError("{% endai %} without a matching {% ai %}")
+                slots.append(self._compile(code[slot_start:match.start()], None))
+                parts.append("{%d}" % len(fields))
+                fields.append(("ai", str(len(slots) - 1)))
+                slot_start = None
+            elif slot_start is None:
+                parts.append("{%d}" % len(fields))
+                fields.append(self._parse_expression(expression))
+            position = match.end()
+        if slot_start is not None:
+            raise TemplateError("{% ai %} slot is never closed")
+        parts.append(self._escape(code[position:]))
+        return "".join(parts), fields
+
+    @staticmethod
+    def _is_placeholder(expression: str) -> bool:
+        return bool(IDENTIFIER_PATTERN.match(expression.partition("|")[0].strip()))
+
+    @staticmethod
+    def _escape(text: str) -> str:
+        return text.replace("{", "{{").replace("}", "}}")
+
+    def _parse_expression(self, expression: str) -> Tuple[str, Optional[str]]:
+        name, _, filter_name = (part.strip() for part in expression.partition("|"))
+        if name not in self.declarations:
+            raise TemplateError(f"Template uses undeclared variable: {name}")
+        if filter_name and filter_name not in FILTERS:
+            raise TemplateError(f"Unknown filter: {filter_name}")
+        return name, filter_name or None
+
+    @property
+    def has_ai_slots(self) -> bool:
+        return bool(self.ai_slots)
+
+    def coerce(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate ``values`` against the declarations, applying defaults."""
+        unknown = set(values) - set(self.declarations)
+        if unknown:
+            raise TemplateError(f"Unknown variables: {', '.join(sorted(unknown))}")
+        coerced = {}
+        for name, spec in self.declarations.items():
+            if name in values:
+                try:
+                    coerced[name] = VARIABLE_TYPES[spec["type"]](values[name], spec)
+                except (TypeError, ValueError) as e:
+                    raise TemplateError(f"Invalid value for {name}: {str(e)}")
+            elif spec.get("required"):
+                raise TemplateError(f"Missing required variable: {name}")
+            else:
+                coerced[name] = spec.get("default", "")
+        return coerced
+
+    @staticmethod
+    def _substitute(format_string: str, fields, values: Dict[str, Any], fills: List[str]) -> str:
+        args = []
+        for name, filter_name in fields:
+            if name == "ai":
+                args.append(fills[int(filter_name)])
+            elif filter_name:
+                args.append(FILTERS[filter_name](values[name]))
+            else:
+                args.append(values[name])
+        return format_string.format(*args)
+
+    def render(self, values: Dict[str, Any]) -> str:
+        """Deterministic render; AI-fill slots must be rendered with ``render_async``."""
+        if self.ai_slots:
+            raise TemplateError("Template has AI-fill slots; use render_async")
+        return self._substitute(self._format, self._fields, self.coerce(values), [])
+
+    async def render_async(
+        self,
+        values: Dict[str, Any],
+        fill: Optional[Callable[[str, str], Awaitable[str]]] = None,
+    ) -> str:
+        """
+        Render, calling ``fill(instructions, context)`` for every AI-fill slot
+        concurrently. ``context`` is the rendered template with that slot
+        marked ``<AI-FILL>`` (and any others elided), so the model sees where
+        its text goes.
+        """
+        coerced = self.coerce(values)
+        if not self.ai_slots:
+            return self._substitute(self._format, self._fields, coerced, [])
+        if fill is None:
+            raise TemplateError("Template has AI-fill slots but no model to fill them")
+
+        instructions = [self._substitute(fmt, fields, coerced, []) for fmt, fields in self.ai_slots]
+        contexts = [
+            self._substitute(
+                self._format, self._fields, coerced,
+                ["<AI-FILL>" if j == i else "..." for j in range(len(self.ai_slots))]
+            )
+            for i in range(len(self.ai_slots))
+        ]
+        fills = await asyncio.gather(*[fill(text, context) for text, context in zip(instructions, contexts)])
+        return self._substitute(self._format, self._fields, coerced, list(fills))
+
+
+@lru_cache(maxsize=256)
+def _compile_cached(code: str, variables_json: str) -> CompiledTemplate:
+    return CompiledTemplate(code, normalize_declarations(json.loads(variables_json)))
+
+
+def compile_template(code: str, variables: Any = None) -> CompiledTemplate:
+    """Compiled template for ``code`` and its declarations, cached by content."""
+    return _compile_cached(code, json.dumps(variables or {}, sort_keys=True))
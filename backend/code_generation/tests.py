@@ -1,3 +1,323 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from .models import CodeGeneration
+from .prompt_cache import MIN_SHINGLES, SimilarPromptCache, normalize_prompt, shingle_count
+from .prompts import system_prompt
+from .services import (
+    AIModel, AIModelConfig, AnthropicModel, CodeLLamaModel, QwenModel, _openai_cached_tokens,
+)
+from .templating import TemplateError, compile_template, normalize_declarations
+from .views import CodeGenerationViewSet
+
+
+class TemplateRenderingTests(SimpleTestCase):
+    def test_filters_and_literal_braces(self):
+        template = compile_template(
+            "class {{ name|pascal }}:\n    table = {{name|snake}}  # {literal}\n",
+            {"name": {"type": "string"}}
+        )
+        self.assertEqual(
+            template.render({"name": "userAccount"}),
+            "class UserAccount:\n    table = user_account  # {literal}\n"
+        )
+
+    def test_typed_values_and_defaults(self):
+        template = compile_template(
+            "{{ port }} {{ debug }} {{ items }} {{ mode }}",
+            {
+                "port": {"type": "integer"},
+                "debug": {"type": "boolean", "default": False},
+                "items": {"type": "list", "separator": "|"},
+                "mode": {"type": "choice", "choices": ["a", "b"], "default": "a"},
+            }
+        )
+        self.assertEqual(template.render({"port": "8000", "items": ["x", "y"]}), "8000 False x|y a")
+        self.assertEqual(template.render({"port": 1, "debug": "yes", "items": [], "mode": "b"}), "1 True  b")
+
+    def test_invalid_values(self):
+        template = compile_template("{{ n }} {{ ident }}", {
+            "n": {"type": "integer"},
+            "ident": {"type": "identifier", "default": "x"},
+        })
+        for values, message in [
+            ({}, "Missing required variable: n"),
+            ({"n": True}, "Invalid value for n"),
+            ({"n": 1, "ident": "not valid"}, "Invalid value for ident"),
+            ({"n": 1, "other": 2}, "Unknown variables: other"),
+        ]:
+            with self.subTest(values=values), self.assertRaisesMessage(TemplateError, message):
+                template.render(values)
+
+    def test_malformed_templates(self):
+        for code, message in [
+            ("{{ missing }}", "undeclared variable: missing"),
+            ("{{ name|shout }}", "Unknown filter: shout"),
+            ("{% ai %}open", "never closed"),
+            ("{% endai %}", "without a matching"),
+            ("{% ai %}{% ai %}{% endai %}{% endai %}", "cannot be nested"),
+        ]:
+            with self.subTest(code=code), self.assertRaisesMessage(TemplateError, message):
+                compile_template(code, {"name": {"type": "string"}})
+
+    def test_literal_braces_that_are_not_placeholders(self):
+        template = compile_template(
+            '<div style={{ color: "red" }}>{{ label }}</div>{{}}{{ .Values.port }}',
+            {"label": {"type": "string"}}
+        )
+        self.assertEqual(
+            template.render({"label": "Hi"}),
+            '<div style={{ color: "red" }}>Hi</div>{{}}{{ .Values.port }}'
+        )
+
+    def test_raw_blocks(self):
+        template = compile_template(
+            "{% raw %}{{ label }} {% ai %}{% endraw %} {{ label }}",
+            {"label": {"type": "string"}}
+        )
+        self.assertFalse(template.has_ai_slots)
+        self.assertEqual(template.render({"label": "x"}), "{{ label }} {% ai %} x")
+
+    def test_legacy_declarations(self):
+        self.assertEqual(normalize_declarations(["a"]), {"a": {"type": "string", "required": True}})
+        self.assertEqual(
+            normalize_declarations({"b": "example"}),
+            {"b": {"type": "string", "default": "example", "required": False}}
+        )
+
+    def test_ai_slots_are_filled_concurrently(self):
+        template = compile_template(
+            "def {{ name }}():\n{% ai %}body of {{ name }}{% endai %}\n{% ai %}tests{% endai %}",
+            {"name": {"type": "identifier"}}
+        )
+        self.assertTrue(template.has_ai_slots)
+        with self.assertRaisesMessage(TemplateError, "use render_async"):
+            template.render({"name": "run"})
+
+        calls = []
+
+        async def fill(instructions, context):
+            calls.append((instructions, context))
+            return instructions.upper()
+
+        rendered = async_to_sync(template.render_async)({"name": "run"}, fill)
+        self.assertEqual(rendered, "def run():\nBODY OF RUN\nTESTS")
+        self.assertEqual(calls, [
+            ("body of run", "def run():\n<AI-FILL>\n..."),
+            ("tests", "def run():\n...\n<AI-FILL>"),
+        ])
+
+
+class SimilarPromptCacheTests(TestCase):
+    PROMPT = "Write a Python function that parses a CSV file and returns the rows as dictionaries"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('cache', password='x')
+
+    def generation(self, prompt, language='python', ai_model='gpt-4', **kwargs):
+        return CodeGeneration.objects.create(user=self.user, prompt=prompt, language=language, ai_model=ai_model,
+                                             **kwargs)
+
+    def test_normalized_duplicate_is_an_exact_match(self):
+        stored = self.generation(self.PROMPT)
+        cache = SimilarPromptCache(threshold=0.85)
+        match = cache.lookup("please write Python function that parses a CSV file, and returns the rows "
+                             "as dictionaries!", 'python', 'gpt-4')
+        self.assertEqual(match, (stored, 1.0))
+
+    def test_threshold(self):
+        stored = self.generation(self.PROMPT)
+        near = self.PROMPT.replace("dictionaries", "dicts")
+        cache = SimilarPromptCache(threshold=0.5)
+        generation, similarity = cache.lookup(near, 'python', 'gpt-4')
+        self.assertEqual(generation, stored)
+        self.assertLess(similarity, 1.0)
+        self.assertIsNone(cache.lookup(near, 'python', 'gpt-4', threshold=1.0))
+        self.assertIsNone(cache.lookup("Build a React component that renders a sortable table of users",
+                                       'python', 'gpt-4'))
+
+    def test_partitioned_by_language_and_model(self):
+        self.generation(self.PROMPT)
+        cache = SimilarPromptCache()
+        self.assertIsNone(cache.lookup(self.PROMPT, 'javascript', 'gpt-4'))
+        self.assertIsNone(cache.lookup(self.PROMPT, 'python', 'qwen-72b'))
+
+    def test_short_prompts_are_never_matched(self):
+        self.assertLess(shingle_count(normalize_prompt("hello world")), MIN_SHINGLES)
+        self.generation("hello world")
+        cache = SimilarPromptCache()
+        self.assertIsNone(cache.lookup("hello world", 'python', 'gpt-4'))
+        self.assertEqual(cache.get_stats()['entries'], 0)
+
+    def test_non_ascii_prompts(self):
+        stored = self.generation("Напиши функцию, которая сортирует список пользователей по имени")
+        cache = SimilarPromptCache()
+        self.assertEqual(
+            cache.lookup("напиши функцию которая сортирует список пользователей по имени", 'python', 'gpt-4'),
+            (stored, 1.0)
+        )
+        self.assertIsNone(cache.lookup("Напиши класс для чтения конфигурации из файла YAML", 'python', 'gpt-4'))
+
+    def test_deleted_generations_are_dropped(self):
+        stored = self.generation(self.PROMPT)
+        cache = SimilarPromptCache()
+        cache.add(stored)
+        stored.delete()
+        self.assertIsNone(cache.lookup(self.PROMPT, 'python', 'gpt-4'))
+        self.assertEqual(cache.get_stats()['entries'], 0)
+
+    def test_grounded_generations_are_not_shared(self):
+        grounded = self.generation(self.PROMPT, grounded=True)
+        cache = SimilarPromptCache()
+        cache.add(grounded)
+        self.assertIsNone(cache.lookup(self.PROMPT, 'python', 'gpt-4'))
+        self.assertEqual(cache.get_stats()['entries'], 0)
+
+
+class GenerateCodeCacheTests(TestCase):
+    URL = '/api/code-generation/generations/generate_code/'
+    PROMPT = SimilarPromptCacheTests.PROMPT
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user('owner', password='x'))
+        generator = mock.Mock(usage={})
+        generator.generate_code = mock.AsyncMock(return_value='def parse(): ...')
+        for patcher in (
+            mock.patch('code_generation.views.prompt_cache', SimilarPromptCache()),
+            mock.patch.object(CodeGenerationViewSet, 'get_code_generator', return_value=generator),
+            mock.patch.object(CodeGenerationViewSet, 'get_project_context', mock.AsyncMock(return_value=[])),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def generate(self, **data):
+        response = self.client.post(self.URL, dict(prompt=self.PROMPT, language='python', **data), format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_grounded_generations_are_not_served_from_the_cache(self):
+        self.generate(projectId=1)
+        self.assertTrue(CodeGeneration.objects.get().grounded)
+        self.assertFalse(self.generate()['cached'])
+        self.assertTrue(self.generate()['cached'])
+
+
+class PromptCachingTests(SimpleTestCase):
+    def test_system_prompts_are_byte_stable(self):
+        self.assertIs(system_prompt('code_generation', 'python'), system_prompt('code_generation', 'python'))
+        for kind in ('project_structure', 'code_generation', 'code_analysis', 'template_fill'):
+            python, go = system_prompt(kind, 'python'), system_prompt(kind, 'go')
+            self.assertEqual(python.rsplit('\n\n', 1)[0], go.rsplit('\n\n', 1)[0])
+            self.assertTrue(python.startswith(system_prompt(kind)))
+
+    def test_anthropic_breakpoints_follow_the_stable_prefix(self):
+        response = mock.Mock(
+            usage=mock.Mock(input_tokens=10, output_tokens=3, cache_read_input_tokens=1200,
+                            cache_creation_input_tokens=0),
+            content=[mock.Mock(type='text', text='done')]
+        )
+        client = mock.Mock()
+        client.messages.create = mock.AsyncMock(return_value=response)
+        model = AnthropicModel(AIModelConfig(AIModel.ANTHROPIC_CLAUDE))
+        with mock.patch('code_generation.services.get_anthropic_client', return_value=client):
+            text = async_to_sync(model.generate_completion)([
+                {'role': 'system', 'content': 'instructions'},
+                {'role': 'user', 'content': 'project snippets'},
+                {'role': 'user', 'content': 'the question'},
+            ])
+        self.assertEqual(text, 'done')
+        request = client.messages.create.call_args.kwargs
+        ephemeral = {'type': 'ephemeral'}
+        self.assertEqual(request['system'], [{'type': 'text', 'text': 'instructions', 'cache_control': ephemeral}])
+        self.assertEqual(request['messages'], [{'role': 'user', 'content': [
+            {'type': 'text', 'text': 'project snippets', 'cache_control': ephemeral},
+            {'type': 'text', 'text': 'the question'},
+        ]}])
+        self.assertEqual(
+            {key: model.usage[key] for key in ('calls', 'prompt_tokens', 'cached_tokens', 'completion_tokens')},
+            {'calls': 1, 'prompt_tokens': 1210, 'cached_tokens': 1200, 'completion_tokens': 3}
+        )
+
+    def test_openai_cached_tokens(self):
+        self.assertEqual(_openai_cached_tokens({'prompt_tokens_details': {'cached_tokens': 1024}}), 1024)
+        self.assertEqual(_openai_cached_tokens({'prompt_tokens': 5}), 0)
+        self.assertEqual(_openai_cached_tokens(mock.Mock(prompt_tokens_details=None)), 0)
+        self.assertEqual(_openai_cached_tokens(None), 0)
+
+
+@override_settings(QWEN_API_KEY='secret', QWEN_API_BASE='http://provider/base',
+                   CODELLAMA_API_KEY='secret', CODELLAMA_API_BASE='http://provider/base')
+class HTTPProviderTests(SimpleTestCase):
+    def setUp(self):
+        self.requests = []
+
+        def handler(request):
+            self.requests.append(request)
+            if request.url.path.endswith('/generate'):
+                return httpx.Response(200, json={'completion': 'code', 'usage': {'prompt_tokens': 4}})
+            return httpx.Response(200, json={
+                'choices': [{'message': {'content': 'code'}}],
+                'usage': {'prompt_tokens': 4, 'completion_tokens': 1},
+            })
+        self.transport = httpx.MockTransport(handler)
+        self.clients = {}
+        patcher = mock.patch('code_generation.services.get_http_client', side_effect=self.shared_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def shared_client(self, base_url):
+        if base_url not in self.clients:
+            self.clients[base_url] = httpx.AsyncClient(base_url=base_url, transport=self.transport)
+        return self.clients[base_url]
+
+    def complete(self, model_class, model_type):
+        model = model_class(AIModelConfig(model_type))
+
+        async def twice():
+            await model.generate_completion([{'role': 'user', 'content': 'hi'}])
+            return await model.generate_completion([{'role': 'user', 'content': 'hi'}])
+        return async_to_sync(twice)()
+
+    def test_qwen_and_codellama_reuse_the_shared_client(self):
+        self.assertEqual(self.complete(QwenModel, AIModel.QWEN), 'code')
+        self.assertEqual(self.complete(CodeLLamaModel, AIModel.CODELLAMA), 'code')
+        self.assertEqual(list(self.clients), ['http://provider/base'])
+        self.assertEqual([request.url.path for request in self.requests], [
+            '/base/v1/chat/completions', '/base/v1/chat/completions', '/base/generate', '/base/generate'
+        ])
+        self.assertEqual({request.headers['Authorization'] for request in self.requests}, {'Bearer secret'})
+
+
+class FeedbackTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user('rater', password='x')
+        self.generation = CodeGeneration.objects.create(user=user, prompt='p', language='python')
+        self.url = f'/api/code-generation/generations/{self.generation.id}/provide_feedback/'
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def test_records_a_valid_rating(self):
+        response = self.client.post(self.url, {'rating': '4', 'comment': 'good'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.generation.refresh_from_db()
+        self.assertEqual((self.generation.rating, self.generation.feedback), (4, 'good'))
+
+    def test_rejects_invalid_ratings(self):
+        for rating in (None, 0, 6, 'five', [3]):
+            with self.subTest(rating=rating):
+                response = self.client.post(self.url, {'rating': rating}, format='json')
+                self.assertEqual(response.status_code, 400)
+        self.generation.refresh_from_db()
+        self.assertIsNone(self.generation.rating)
+
+    def test_async_actions_require_authentication(self):
+        self.assertEqual(APIClient().post(self.url, {'rating': 3}, format='json').status_code, 401)
+        response = self.client.get('/api/code-generation/generations/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([g['id'] for g in response.json()['results']], [self.generation.id])
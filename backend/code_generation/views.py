@@ -1,17 +1,32 @@
 from django.shortcuts import render
-from rest_framework import viewsets, status
+from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.core.exceptions import ValidationError
+from django.conf import settings
+from asgiref.sync import sync_to_async
 from .services import AICodeGenerator, AIModel
+from ai.async_views import AsyncModelViewSet
+from ai.resilience import LLMUnavailableError, retry_after_headers
+from .templating import TemplateError
+from .prompt_cache import prompt_cache
+from project_management.retrieval import project_index
 from .serializers import (
     CodeGenerationSerializer,
     CodeTemplateSerializer,
 )
 from .models import CodeGeneration, CodeTemplate
 
-class CodeGenerationViewSet(viewsets.ModelViewSet):
+def unavailable_response(error: LLMUnavailableError) -> Response:
+    """503 telling the client when the provider is worth trying again."""
+    return Response(
+        {'error': str(error)},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers=retry_after_headers(error)
+    )
+
+class CodeGenerationViewSet(AsyncModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = CodeGenerationSerializer
     queryset = CodeGeneration.objects.all()
@@ -23,6 +38,14 @@ class CodeGenerationViewSet(viewsets.ModelViewSet):
         except KeyError:
             raise ValidationError(f"Invalid AI model: {ai_model}")
 
+    async def get_project_context(self, project_id, query: str):
+        """Snippets of the project most relevant to ``query``, within the token budget."""
+        if not project_id:
+            return None
+        return await sync_to_async(project_index.select_context)(
+            int(project_id), query, max_tokens=settings.RETRIEVAL_MAX_TOKENS
+        )
+
     @action(detail=False, methods=['post'])
     async def generate_code(self, request):
         prompt = request.data.get('prompt')
@@ -35,21 +58,48 @@ class CodeGenerationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        project_id = request.data.get('projectId')
+        # Clients opt out with useCache=false to force a fresh generation; answers
+        # grounded in project code are never shared across requests
+        use_cache = (
+            settings.PROMPT_CACHE_ENABLED and not project_id
+            and request.data.get('useCache', True) not in (False, 'false')
+        )
+
         try:
-            code_generator = self.get_code_generator(ai_model)
-            generated_code = await code_generator.generate_code(prompt, language)
+            similarity = None
+            cached = None
+            if use_cache:
+                cached = await sync_to_async(prompt_cache.lookup)(prompt, language, ai_model)
 
-            generation = CodeGeneration.objects.create(
+            usage = {}
+            if cached is not None:
+                source, similarity = cached
+                # Reading the cached code touches the blob store
+                generated_code = await sync_to_async(lambda: source.generated_code)()
+            else:
+                context = await self.get_project_context(project_id, prompt)
+                code_generator = self.get_code_generator(ai_model)
+                generated_code = await code_generator.generate_code(prompt, language, context)
+                usage = code_generator.usage
+
+            generation = await CodeGeneration.objects.acreate(
                 user=request.user,
                 prompt=prompt,
                 language=language,
                 generated_code=generated_code,
-                ai_model=ai_model
+                ai_model=ai_model,
+                usage=usage,
+                grounded=bool(project_id)
             )
+            if cached is None and settings.PROMPT_CACHE_ENABLED and not project_id:
+                await sync_to_async(prompt_cache.add)(generation)
 
             serializer = self.get_serializer(generation)
-            return Response(serializer.data)
+            return Response(dict(serializer.data, cached=cached is not None, similarity=similarity))
 
+        except LLMUnavailableError as e:
+            return unavailable_response(e)
         except Exception as e:
             return Response(
                 {'error': str(e)},
@@ -81,6 +131,8 @@ class CodeGenerationViewSet(viewsets.ModelViewSet):
                 'setupInstructions': setup_instructions
             }, status=status.HTTP_201_CREATED)
             
+        except LLMUnavailableError as e:
+            return unavailable_response(e)
         except Exception as e:
             return Response(
                 {'error': str(e)},
@@ -89,7 +141,7 @@ class CodeGenerationViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     async def provide_feedback(self, request, pk=None):
-        generation = self.get_object()
+        generation = await sync_to_async(self.get_object)()
         rating = request.data.get('rating')
         comment = request.data.get('comment')
         
@@ -98,10 +150,20 @@ class CodeGenerationViewSet(viewsets.ModelViewSet):
                 {'error': 'Rating is required'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        # asave() does not run the model's validators
+        try:
+            rating = int(rating)
+        except (TypeError, ValueError):
+            rating = None
+        if rating is None or not 1 <= rating <= 5:
+            return Response(
+                {'error': 'Rating must be an integer from 1 to 5'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        generation.feedback_rating = rating
-        generation.feedback_comment = comment
-        generation.save()
+        generation.rating = rating
+        generation.feedback = comment or ''
+        await generation.asave(update_fields=['rating', 'feedback'])
         
         return Response({'status': 'Feedback recorded'})
 
@@ -117,15 +179,18 @@ class CodeGenerationViewSet(viewsets.ModelViewSet):
             )
         
         try:
-            analysis = await AICodeGenerator().analyze_code_quality(code, language)
+            context = await self.get_project_context(request.data.get('projectId'), code)
+            analysis = await AICodeGenerator().analyze_code_quality(code, language, context)
             return Response(analysis, status=status.HTTP_200_OK)
+        except LLMUnavailableError as e:
+            return unavailable_response(e)
         except Exception as e:
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class CodeTemplateViewSet(viewsets.ModelViewSet):
+class CodeTemplateViewSet(AsyncModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = CodeTemplateSerializer
     queryset = CodeTemplate.objects.all()
@@ -137,39 +202,47 @@ class CodeTemplateViewSet(viewsets.ModelViewSet):
         except KeyError:
             raise ValidationError(f"Invalid AI model: {ai_model}")
 
+    def save_generation(self, serializer: CodeGenerationSerializer) -> bool:
+        if not serializer.is_valid():
+            return False
+        serializer.save()
+        # Render now, while we are still off the event loop
+        serializer.data
+        return True
+
     @action(detail=True, methods=['post'])
     async def generate_from_template(self, request, pk=None):
-        template = self.get_object()
+        template = await sync_to_async(self.get_object)()
         variables = request.data.get('variables', {})
         ai_model = request.data.get('aiModel', 'gpt-4')
         
-        if not variables:
-            return Response(
-                {'error': 'Variables are required'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
         try:
-            # Generate code from template using AI service
+            # Placeholders are filled locally; only {% ai %} slots reach the model
             code_generator = self.get_code_generator(ai_model)
             generated_code = await code_generator.generate_from_template(
-                template.template_code, variables
+                template.code, variables, template.variables
             )
             
             # Create generation record
             generation_serializer = CodeGenerationSerializer(data={
+                'user': request.user.id,
+                'template': template.id,
                 'prompt': f"Generated from template: {template.name}",
                 'language': template.language,
                 'generated_code': generated_code,
                 'ai_model': ai_model,
-                'model_used': 'template'
+                'usage': code_generator.usage,
             })
             
-            if generation_serializer.is_valid():
-                generation_serializer.save()
+            # Validation looks up the related rows, so it runs with the save
+            if await sync_to_async(self.save_generation)(generation_serializer):
                 return Response(generation_serializer.data, status=status.HTTP_201_CREATED)
             return Response(generation_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
             
+        except TemplateError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except LLMUnavailableError as e:
+            return unavailable_response(e)
         except Exception as e:
             return Response(
                 {'error': str(e)},
@@ -5,6 +5,7 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 import shutil
+import tempfile
 
 def get_file_stats(path):
     """Get file or directory statistics."""
@@ -147,8 +148,17 @@ def write_file(request):
         # Create parent directories if they don't exist
         target_path.parent.mkdir(parents=True, exist_ok=True)
 
-        with open(target_path, 'w') as f:
-            f.write(content)
+        # Write a new file and rename it into place, so a file hardlinked
+        # into a cloned project is not changed in both
+        fd, tmp_path = tempfile.mkstemp(dir=target_path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.chmod(tmp_path, target_path.stat().st_mode & 0o777 if target_path.exists() else 0o644)
+            os.replace(tmp_path, target_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
 
         return JsonResponse({'success': True})
 
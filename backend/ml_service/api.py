@@ -1,56 +1,136 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from model_service import CodeGenerationService
+from json_constraint import SCHEMAS
+from model_pool import ModelLoadingError, ModelPool
 import logging
+import os
 from typing import Optional
 
 app = FastAPI()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize the model service
-model_service = None
+# Models are loaded on demand by name and shared by all requests for them
+model_pool = ModelPool.from_env()
+# How long /generate waits for a loading model before answering 503
+LOAD_WAIT_SECONDS = float(os.getenv("ML_LOAD_WAIT_SECONDS", "0"))
+RETRY_AFTER_SECONDS = os.getenv("ML_RETRY_AFTER_SECONDS", "5")
+
+# Under `gunicorn --preload` this runs once in the master, so workers forked
+# afterwards share the preloaded weights copy-on-write
+if os.getenv("ML_PRELOAD_MODELS"):
+    model_pool.preload([m.strip() for m in os.getenv("ML_PRELOAD_MODELS").split(",") if m.strip()])
 
 class GenerateCodeRequest(BaseModel):
     prompt: str
+    model: Optional[str] = None
     max_length: Optional[int] = 2048
     temperature: Optional[float] = 0.7
     top_p: Optional[float] = 0.95
     top_k: Optional[int] = 50
     num_return_sequences: Optional[int] = 1
+    max_new_tokens: Optional[int] = None
+    deadline_ms: Optional[int] = None
+    speculative: Optional[bool] = False
+    num_draft_tokens: Optional[int] = None
+    # Name of a JSON schema to constrain the completion to, e.g. "project_structure"
+    response_format: Optional[str] = None
 
 @app.on_event("startup")
 async def startup_event():
-    global model_service
     try:
+        # Weights load in the background (or on first request in lazy mode);
+        # /health/ready reports when this instance can take traffic.
         logger.info("Initializing model service...")
-        model_service = CodeGenerationService()
+        if model_pool.load_mode == "eager":
+            await model_pool.start_loading()
+        else:
+            model_pool.get()
         logger.info("Model service initialized successfully!")
     except Exception as e:
         logger.error(f"Failed to initialize model service: {str(e)}")
         raise
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    model_pool.shutdown()
+
+@app.get("/health/live")
+async def health_live():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    if model_pool.is_ready:
+        return {"status": "ready", **model_pool.status()}
+    if model_pool.error is not None:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "failed", "error": model_pool.error, **model_pool.status()},
+        )
+    return JSONResponse(
+        status_code=503,
+        content={"status": "not_ready", **model_pool.status()},
+    )
+
+@app.get("/models")
+async def list_models():
+    return model_pool.status()
+
+@app.get("/stats")
+async def get_stats():
+    return model_pool.get_stats()
+
 @app.post("/generate")
 async def generate_code(request: GenerateCodeRequest):
     try:
-        if not model_service:
-            raise HTTPException(status_code=500, detail="Model service not initialized")
-        
-        generated_code = model_service.generate_code(
-            prompt=request.prompt,
-            max_length=request.max_length,
-            temperature=request.temperature,
-            top_p=request.top_p,
-            top_k=request.top_k,
-            num_return_sequences=request.num_return_sequences
-        )
+        if not model_pool.is_allowed(request.model):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown model {request.model}; choose one of {model_pool.allowed_models}"
+            )
+        if request.response_format is not None and request.response_format not in SCHEMAS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown response_format {request.response_format}; choose one of {sorted(SCHEMAS)}"
+            )
+
+        async with model_pool.lease(request.model, timeout=LOAD_WAIT_SECONDS) as model_service:
+            result = await model_service.generate_code(
+                prompt=request.prompt,
+                max_length=request.max_length,
+                temperature=request.temperature,
+                top_p=request.top_p,
+                top_k=request.top_k,
+                num_return_sequences=request.num_return_sequences,
+                max_new_tokens=request.max_new_tokens,
+                deadline_s=request.deadline_ms / 1000 if request.deadline_ms else None,
+                speculative=bool(request.speculative),
+                num_draft_tokens=request.num_draft_tokens,
+                response_format=request.response_format,
+            )
         
-        return {"generated_code": generated_code}
+        result["model"] = model_service.model_name
+        return result
     
+    except HTTPException:
+        raise
+    except ModelLoadingError:
+        # Tell the client when to come back instead of holding it while weights load
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": RETRY_AFTER_SECONDS},
+            content={"detail": "Model is still loading", "status": model_pool.get(request.model).status()},
+        )
     except Exception as e:
         logger.error(f"Error generating code: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Django (port 8000) reaches this service over TCP or a Unix socket
+    if os.getenv("ML_SERVICE_UDS"):
+        uvicorn.run(app, uds=os.getenv("ML_SERVICE_UDS"))
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("ML_SERVICE_PORT", "8001")))
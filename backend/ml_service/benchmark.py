@@ -0,0 +1,108 @@
+"""Throughput benchmark for the continuous-batching generation engine.
+
+Runs the same workload at increasing concurrency and reports aggregate
+tokens/s and latency percentiles. Uses a small model by default so it runs
+on a laptop CPU:
+
+    python benchmark.py --model distilgpt2 --concurrency 1 2 4 8 --requests 16
+
+Pass ``--shared-prefix`` to prepend the same system instructions to every
+prompt, which exercises the prefix KV cache (compare with
+``ML_PREFIX_CACHE_MB=0``).
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from model_service import CodeGenerationService
+
+PROMPTS = [
+    "def fibonacci(n):",
+    "class LinkedList:",
+    "def parse_config(path):",
+    "async def fetch_all(urls):",
+    "def quicksort(items):",
+    "def read_csv(filename):",
+]
+
+SYSTEM_PROMPT = (
+    "# You are an expert software engineer. Write clean, efficient and well\n"
+    "# documented code. Use modern best practices, include proper error\n"
+    "# handling, follow the language's style guidelines and consider both\n"
+    "# performance and security. Respond with code only.\n\n"
+)
+
+
+async def run_level(
+    service: CodeGenerationService,
+    concurrency: int,
+    requests: int,
+    max_new_tokens: int,
+    prefix: str = "",
+):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    tokens = 0
+
+    async def one(i: int):
+        nonlocal tokens
+        async with semaphore:
+            started = time.perf_counter()
+            result = await service.generate_code(
+                prefix + PROMPTS[i % len(PROMPTS)],
+                max_new_tokens=max_new_tokens,
+                temperature=0.7,
+            )
+            latencies.append(time.perf_counter() - started)
+            tokens += result["usage"]["completion_tokens"]
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "wall_s": wall,
+        "tokens": tokens,
+        "tokens_per_s": tokens / wall,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+    }
+
+
+async def main(args):
+    service = CodeGenerationService(args.model, max_batch_size=max(args.concurrency))
+    try:
+        # Warm up kernels and allocator before measuring
+        await service.generate_code(PROMPTS[0], max_new_tokens=4)
+
+        print(f"{'conc':>5} {'tokens':>7} {'wall s':>8} {'tok/s':>8} {'p50 ms':>9} {'p95 ms':>9}")
+        baseline = None
+        for concurrency in args.concurrency:
+            row = await run_level(
+                service,
+                concurrency,
+                args.requests,
+                args.max_new_tokens,
+                prefix=SYSTEM_PROMPT if args.shared_prefix else "",
+            )
+            baseline = baseline or row["tokens_per_s"]
+            print(
+                f"{row['concurrency']:>5} {row['tokens']:>7} {row['wall_s']:>8.2f} "
+                f"{row['tokens_per_s']:>8.1f} {row['p50_ms']:>9.0f} {row['p95_ms']:>9.0f}"
+                f"   x{row['tokens_per_s'] / baseline:.2f}"
+            )
+        print(f"engine stats: {service.get_stats()}")
+    finally:
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="distilgpt2")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--shared-prefix", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""Retries and wasted tokens with and without schema-constrained decoding.
+
+Asks for project structures the way AICodeGenerator.generate_project_structure
+does. Unconstrained replies that fail to parse (or miss a required key) are
+retried up to ``--max-attempts`` times, and every token of a failed attempt
+counts as wasted. Constrained replies are decoded under the schema, so each
+prompt takes exactly one attempt:
+
+    python benchmark_json.py --model gpt2-medium --max-new-tokens 256
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+from json_constraint import PROJECT_STRUCTURE_SCHEMA  # noqa: E402
+from model_service import CodeGenerationService  # noqa: E402
+
+PROMPTS = [
+    "A command line todo app",
+    "A REST API for a book library",
+    "A static blog generator",
+    "A CSV to JSON converter",
+]
+
+SYSTEM_PROMPT = (
+    "Create a complete project structure for a python project. Respond in JSON:\n"
+    '{"files": [{"path": "...", "content": "..."}], '
+    '"dependencies": {"package": "version"}, "setup_instructions": ["..."]}\n\n'
+)
+
+
+def is_valid(text: str) -> bool:
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    return isinstance(data, dict) and all(key in data for key in PROJECT_STRUCTURE_SCHEMA["properties"])
+
+
+async def run(service: CodeGenerationService, constrained: bool, args):
+    attempts = failures = tokens = wasted = 0
+    started = time.perf_counter()
+    for prompt in PROMPTS:
+        for _ in range(args.max_attempts):
+            result = await service.generate_code(
+                f"{SYSTEM_PROMPT}{prompt}\n",
+                max_new_tokens=args.max_new_tokens,
+                temperature=args.temperature,
+                response_format="project_structure" if constrained else None,
+            )
+            attempts += 1
+            used = result["usage"]["completion_tokens"]
+            tokens += used
+            if is_valid(result["completion"]):
+                break
+            wasted += used
+        else:
+            failures += 1
+    return {
+        "retries": attempts - len(PROMPTS),
+        "failed": failures,
+        "tokens": tokens,
+        "wasted": wasted,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+async def main(args):
+    service = CodeGenerationService(args.model, prefix_cache_mb=0, draft_model_name="")
+    try:
+        await service.generate_code(PROMPTS[0], max_new_tokens=4)
+        print(f"{'mode':<14} {'retries':>8} {'failed':>7} {'tokens':>8} {'wasted':>8} {'seconds':>8}")
+        for constrained in (False, True):
+            stats = await run(service, constrained, args)
+            mode = "constrained" if constrained else "unconstrained"
+            print(
+                f"{mode:<14} {stats['retries']:>8} {stats['failed']:>7} {stats['tokens']:>8} "
+                f"{stats['wasted']:>8} {stats['seconds']:>8.1f}"
+            )
+    finally:
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="gpt2-medium")
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,68 @@
+"""Tokens/s with and without speculative decoding.
+
+Target and draft must share a tokenizer and be present in the local Hugging
+Face cache (the script runs with ``HF_HUB_OFFLINE=1``). The defaults pair two
+GPT-2 family models so it runs on a laptop CPU; for the production setup use
+CodeLlama-7b with a Llama-tokenizer draft:
+
+    python benchmark_speculative.py --model gpt2-medium --draft-model distilgpt2
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+from model_service import CodeGenerationService  # noqa: E402
+
+PROMPTS = [
+    "def fibonacci(n):",
+    "class LinkedList:\n    def __init__(self):",
+    "def parse_config(path):",
+    "def quicksort(items):",
+]
+
+
+async def run(service: CodeGenerationService, speculative: bool, num_draft_tokens: int, max_new_tokens: int, temperature: float):
+    tokens = proposed = accepted = 0
+    started = time.perf_counter()
+    for prompt in PROMPTS:
+        result = await service.generate_code(
+            prompt,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            speculative=speculative,
+            num_draft_tokens=num_draft_tokens,
+        )
+        tokens += result["usage"]["completion_tokens"]
+        if result["speculative"]:
+            proposed += result["speculative"]["proposed"]
+            accepted += result["speculative"]["accepted"]
+    wall = time.perf_counter() - started
+    return tokens / wall, (accepted / proposed if proposed else None)
+
+
+async def main(args):
+    service = CodeGenerationService(args.model, draft_model_name=args.draft_model, prefix_cache_mb=0)
+    try:
+        await service.generate_code(PROMPTS[0], max_new_tokens=4)
+
+        baseline, _ = await run(service, False, 0, args.max_new_tokens, args.temperature)
+        print(f"{'mode':<16} {'tok/s':>8} {'accept':>8} {'speedup':>8}")
+        print(f"{'baseline':<16} {baseline:>8.2f} {'-':>8} {'x1.00':>8}")
+        for k in args.num_draft_tokens:
+            rate, acceptance = await run(service, True, k, args.max_new_tokens, args.temperature)
+            print(f"{f'speculative k={k}':<16} {rate:>8.2f} {acceptance:>8.2f} {f'x{rate / baseline:.2f}':>8}")
+    finally:
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="gpt2-medium")
+    parser.add_argument("--draft-model", default="distilgpt2")
+    parser.add_argument("--num-draft-tokens", type=int, nargs="+", default=[2, 4, 6])
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    asyncio.run(main(parser.parse_args()))
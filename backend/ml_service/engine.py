@@ -0,0 +1,442 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+
+# The engine slices and re-stacks caches as tuples and converts at the model
+# boundary with DynamicCache.from_legacy_cache/to_legacy_cache, which
+# transformers 5 removed: requirements pin transformers below 5
+try:
+    from transformers import DynamicCache
+except ImportError:  # older transformers pass tuple caches everywhere
+    DynamicCache = None
+
+logger = logging.getLogger(__name__)
+
+# Legacy cache layout: one (key, value) pair per layer, each shaped
+# [batch, num_heads, seq_len, head_dim].
+LegacyCache = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+
+def to_legacy_cache(cache) -> LegacyCache:
+    """Normalise whatever the model returned into the tuple-of-tuples layout."""
+    if hasattr(cache, "to_legacy_cache"):
+        return cache.to_legacy_cache()
+    return cache
+
+
+def to_model_cache(legacy: LegacyCache):
+    """Convert a tuple cache into the object the installed transformers expects."""
+    if DynamicCache is not None:
+        return DynamicCache.from_legacy_cache(legacy)
+    return legacy
+
+
+def crop_cache(past_key_values: LegacyCache, length: int) -> LegacyCache:
+    """Keep only the first ``length`` positions of a tuple cache."""
+    return tuple((k[:, :, :length, :], v[:, :, :length, :]) for k, v in past_key_values)
+
+
+def is_greedy(temperature: Optional[float]) -> bool:
+    return not temperature or temperature <= 0
+
+
+def sampling_probs(logits: torch.Tensor, temperature: float, top_p: float, top_k: int) -> torch.Tensor:
+    """Next-token distribution after temperature, top-k and top-p filtering."""
+    logits = logits.float() / temperature
+    if top_k and top_k > 0:
+        kth = torch.topk(logits, min(top_k, logits.size(-1))).values[-1]
+        logits = logits.masked_fill(logits < kth, float("-inf"))
+    if top_p is not None and top_p < 1.0:
+        sorted_logits, sorted_idx = torch.sort(logits, descending=True)
+        probs = torch.softmax(sorted_logits, dim=-1)
+        remove = torch.cumsum(probs, dim=-1) - probs > top_p
+        sorted_logits = sorted_logits.masked_fill(remove, float("-inf"))
+        logits = torch.full_like(logits, float("-inf")).scatter(0, sorted_idx, sorted_logits)
+    return torch.softmax(logits, dim=-1)
+
+
+class Sequence:
+    """Decoding state for one request, including its own KV cache."""
+
+    def __init__(
+        self,
+        prompt_ids: List[int],
+        max_new_tokens: int,
+        temperature: float = 0.7,
+        top_p: float = 0.95,
+        top_k: int = 50,
+        deadline: Optional[float] = None,
+        on_finish: Optional[Callable[["Sequence"], None]] = None,
+        num_draft_tokens: int = 0,
+        constraint: Optional[Any] = None,
+    ):
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.deadline = deadline
+        self.on_finish = on_finish
+        self.num_draft_tokens = num_draft_tokens
+        # Optional per-sequence token filter (see json_constraint.JsonConstraint)
+        self.constraint = constraint
+
+        self.output_ids: List[int] = []
+        self.cached_prompt_tokens = 0
+        self.past_key_values: Optional[LegacyCache] = None
+        self.finish_reason: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        self.cancelled = False
+
+        # Speculative decoding: the draft model keeps its own cache, which may
+        # lag the target's by a few positions
+        self.draft_past_key_values: Optional[LegacyCache] = None
+        self.draft_cache_length = 0
+        self.draft_tokens_proposed = 0
+        self.draft_tokens_accepted = 0
+
+        self.submitted_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def length(self) -> int:
+        return len(self.prompt_ids) + len(self.output_ids)
+
+    @property
+    def cache_length(self) -> int:
+        # The most recently sampled token has not been fed through the model yet
+        return self.length - 1
+
+    @property
+    def finished(self) -> bool:
+        return self.finish_reason is not None
+
+    def speculative_stats(self) -> Optional[Dict[str, Any]]:
+        if not self.num_draft_tokens:
+            return None
+        return {
+            "num_draft_tokens": self.num_draft_tokens,
+            "proposed": self.draft_tokens_proposed,
+            "accepted": self.draft_tokens_accepted,
+            "acceptance_rate": (
+                round(self.draft_tokens_accepted / self.draft_tokens_proposed, 3)
+                if self.draft_tokens_proposed else None
+            ),
+        }
+
+    def timing(self) -> Dict[str, Any]:
+        end = self.finished_at or time.monotonic()
+        started = self.started_at or end
+        decode_time = end - started
+        return {
+            "queue_ms": round((started - self.submitted_at) * 1000, 1),
+            "time_to_first_token_ms": (
+                round((self.first_token_at - self.submitted_at) * 1000, 1)
+                if self.first_token_at else None
+            ),
+            "elapsed_ms": round((end - self.submitted_at) * 1000, 1),
+            "tokens_per_second": (
+                round(len(self.output_ids) / decode_time, 2) if decode_time > 0 else None
+            ),
+        }
+
+
+class ContinuousBatchingEngine:
+    """Steps every active sequence together in a single generation loop.
+
+    A background thread owns the model. Between decode steps it admits queued
+    requests (prefilling each one into its own KV cache) and retires sequences
+    as soon as they finish, so short requests never wait behind long ones and
+    the model always runs with as large a batch as there is work for.
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        device: str = "cpu",
+        max_batch_size: int = 8,
+        prefix_cache=None,
+        speculator=None,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.prefix_cache = prefix_cache
+        self.speculator = speculator
+        self.eos_token_id = tokenizer.eos_token_id
+
+        self._pending: "queue.Queue[Sequence]" = queue.Queue()
+        self._active: List[Sequence] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.stats = {
+            "steps": 0,
+            "tokens_generated": 0,
+            "sequences_completed": 0,
+            "max_batch_seen": 0,
+            "draft_tokens_proposed": 0,
+            "draft_tokens_accepted": 0,
+        }
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="generation-loop", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    @property
+    def active_count(self) -> int:
+        return len(self._active)
+
+    @property
+    def pending_count(self) -> int:
+        return self._pending.qsize()
+
+    def submit(self, seq: Sequence) -> Sequence:
+        self._pending.put(seq)
+        return seq
+
+    async def generate(
+        self,
+        prompt_ids: List[int],
+        max_new_tokens: int,
+        temperature: float = 0.7,
+        top_p: float = 0.95,
+        top_k: int = 50,
+        deadline_s: Optional[float] = None,
+        num_draft_tokens: int = 0,
+        constraint: Optional[Any] = None,
+    ) -> Sequence:
+        """Queue a sequence and wait for it to finish without blocking the event loop."""
+        if num_draft_tokens and self.speculator is None:
+            raise ValueError("Speculative decoding requested but no draft model is loaded")
+        if num_draft_tokens and constraint is not None:
+            raise ValueError("Constrained decoding cannot be combined with speculative decoding")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(seq: Sequence) -> None:
+            if future.done():
+                return
+            if seq.error is not None:
+                future.set_exception(seq.error)
+            else:
+                future.set_result(seq)
+
+        seq = Sequence(
+            prompt_ids,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            deadline=time.monotonic() + deadline_s if deadline_s is not None else None,
+            on_finish=lambda s: loop.call_soon_threadsafe(resolve, s),
+            num_draft_tokens=num_draft_tokens,
+            constraint=constraint,
+        )
+        self.submit(seq)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # Client went away; free the slot at the next token boundary
+            seq.cancelled = True
+            raise
+
+    # -- generation loop -------------------------------------------------
+
+    def _run(self) -> None:
+        torch.set_grad_enabled(False)
+        while not self._stop.is_set():
+            if not self._active:
+                try:
+                    seq = self._pending.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                self._admit(seq)
+
+            # Admit new work at the token boundary
+            while len(self._active) < self.max_batch_size:
+                try:
+                    seq = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+                self._admit(seq)
+
+            self._retire()
+            if not self._active:
+                continue
+
+            try:
+                with torch.inference_mode():
+                    self._step()
+            except Exception as e:
+                logger.error(f"Generation step failed: {str(e)}")
+                for seq in self._active:
+                    seq.error = e
+                    seq.finish_reason = "error"
+            self._retire()
+
+    def _admit(self, seq: Sequence) -> None:
+        seq.started_at = time.monotonic()
+        if seq.cancelled:
+            self._finish(seq, "cancelled")
+            return
+        try:
+            with torch.inference_mode():
+                self._prefill(seq)
+        except Exception as e:
+            logger.error(f"Prefill failed: {str(e)}")
+            seq.error = e
+            self._finish(seq, "error")
+            return
+        if seq.finished:
+            self._finish(seq, seq.finish_reason)
+            return
+        self._active.append(seq)
+        self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(self._active))
+
+    def _prefill(self, seq: Sequence) -> None:
+        reused, past = 0, None
+        if self.prefix_cache is not None:
+            reused, past = self.prefix_cache.lookup(seq.prompt_ids)
+        seq.cached_prompt_tokens = reused
+
+        if past is None:
+            input_ids = torch.tensor([seq.prompt_ids], dtype=torch.long, device=self.device)
+            outputs = self.model(input_ids=input_ids, use_cache=True)
+        else:
+            # Only the part of the prompt not covered by the cached prefix is encoded
+            total = len(seq.prompt_ids)
+            input_ids = torch.tensor([seq.prompt_ids[reused:]], dtype=torch.long, device=self.device)
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=torch.ones(1, total, dtype=torch.long, device=self.device),
+                position_ids=torch.arange(reused, total, device=self.device).unsqueeze(0),
+                past_key_values=to_model_cache(past),
+                use_cache=True,
+            )
+        seq.past_key_values = to_legacy_cache(outputs.past_key_values)
+        if self.prefix_cache is not None:
+            self.prefix_cache.insert(seq.prompt_ids, seq.past_key_values)
+        self._append_token(seq, self._sample(outputs.logits[0, -1, :], seq))
+
+    def _step(self) -> None:
+        batched = [seq for seq in self._active if not seq.num_draft_tokens]
+        if batched:
+            self._step_batch(batched)
+        # Speculative sequences advance several tokens at a time on their own
+        for seq in self._active:
+            if seq.num_draft_tokens:
+                self.speculator.step(self, seq)
+        self.stats["steps"] += 1
+
+    def _step_batch(self, seqs: List[Sequence]) -> None:
+        cache_lens = [seq.cache_length for seq in seqs]
+        max_len = max(cache_lens)
+
+        input_ids = torch.tensor(
+            [[seq.output_ids[-1]] for seq in seqs], dtype=torch.long, device=self.device
+        )
+        position_ids = torch.tensor([[n] for n in cache_lens], dtype=torch.long, device=self.device)
+        attention_mask = torch.zeros(len(seqs), max_len + 1, dtype=torch.long, device=self.device)
+        for i, n in enumerate(cache_lens):
+            attention_mask[i, max_len - n:] = 1
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=to_model_cache(self._batch_caches(seqs, cache_lens, max_len)),
+            use_cache=True,
+        )
+        new_cache = to_legacy_cache(outputs.past_key_values)
+        logits = outputs.logits[:, -1, :]
+
+        for i, seq in enumerate(seqs):
+            # Strip this sequence's left padding back off its slice of the batch cache
+            pad = max_len - cache_lens[i]
+            seq.past_key_values = tuple(
+                (k[i:i + 1, :, pad:, :], v[i:i + 1, :, pad:, :]) for k, v in new_cache
+            )
+            self._append_token(seq, self._sample(logits[i], seq))
+
+    def _batch_caches(self, seqs: List[Sequence], cache_lens: List[int], max_len: int) -> LegacyCache:
+        """Left-pad each sequence's cache to ``max_len`` and stack along the batch dim."""
+        num_layers = len(seqs[0].past_key_values)
+        batched = []
+        for layer in range(num_layers):
+            keys, values = [], []
+            for seq, n in zip(seqs, cache_lens):
+                k, v = seq.past_key_values[layer]
+                pad = max_len - n
+                if pad:
+                    k = torch.nn.functional.pad(k, (0, 0, pad, 0))
+                    v = torch.nn.functional.pad(v, (0, 0, pad, 0))
+                keys.append(k)
+                values.append(v)
+            batched.append((torch.cat(keys, dim=0), torch.cat(values, dim=0)))
+        return tuple(batched)
+
+    def _sample(self, logits: torch.Tensor, seq: Sequence) -> int:
+        if seq.constraint is not None:
+            probs = None if is_greedy(seq.temperature) else sampling_probs(
+                logits, seq.temperature, seq.top_p, seq.top_k
+            )
+            return seq.constraint.select(logits, probs)
+        if is_greedy(seq.temperature):
+            return int(torch.argmax(logits))
+        probs = sampling_probs(logits, seq.temperature, seq.top_p, seq.top_k)
+        return int(torch.multinomial(probs, 1))
+
+    def _append_token(self, seq: Sequence, token_id: int) -> None:
+        now = time.monotonic()
+        if seq.first_token_at is None:
+            seq.first_token_at = now
+        seq.output_ids.append(token_id)
+        self.stats["tokens_generated"] += 1
+
+        if token_id == self.eos_token_id:
+            seq.finish_reason = "stop"
+        elif seq.constraint is not None and seq.constraint.is_complete:
+            seq.finish_reason = "stop"
+        elif len(seq.output_ids) >= seq.max_new_tokens:
+            seq.finish_reason = "length"
+        elif seq.deadline is not None and now >= seq.deadline:
+            seq.finish_reason = "deadline"
+
+    def _retire(self) -> None:
+        still_active = []
+        for seq in self._active:
+            if seq.cancelled and not seq.finished:
+                seq.finish_reason = "cancelled"
+            if seq.finished:
+                self._finish(seq, seq.finish_reason)
+            else:
+                still_active.append(seq)
+        self._active = still_active
+
+    def _finish(self, seq: Sequence, reason: str) -> None:
+        seq.finish_reason = reason
+        seq.finished_at = time.monotonic()
+        # Release the KV cache as soon as the sequence leaves the batch
+        seq.past_key_values = None
+        seq.draft_past_key_values = None
+        self.stats["sequences_completed"] += 1
+        if seq.on_finish:
+            seq.on_finish(seq)
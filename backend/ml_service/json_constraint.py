@@ -0,0 +1,414 @@
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE = " \t\n\r"
+# Bound whitespace runs so a model cannot pad forever without making progress
+MAX_WHITESPACE_RUN = 32
+# Sampled candidates to try before falling back to scanning by likelihood
+MAX_SAMPLED_REJECTIONS = 32
+
+# Schemas use a small JSON Schema subset: "string", "array" with "items",
+# "object" with "properties" (all required, emitted in the order given) and
+# "object" with "additionalProperties" (a free-form string-keyed map).
+PROJECT_STRUCTURE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "files": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string"},
+                    "content": {"type": "string"},
+                },
+            },
+        },
+        "dependencies": {"type": "object", "additionalProperties": {"type": "string"}},
+        "setup_instructions": {"type": "array", "items": {"type": "string"}},
+    },
+}
+
+SCHEMAS = {
+    "project_structure": PROJECT_STRUCTURE_SCHEMA,
+}
+
+
+class _Node:
+    """Compiled schema node, shared (read-only) by every matcher."""
+
+    __slots__ = ("kind", "properties", "child")
+
+    def __init__(self, schema: Dict[str, Any]):
+        self.properties: List[Tuple[str, "_Node"]] = []
+        self.child: Optional["_Node"] = None
+        kind = schema["type"]
+        if kind == "string":
+            self.kind = "string"
+        elif kind == "array":
+            self.kind = "array"
+            self.child = _Node(schema["items"])
+        elif kind == "object" and "properties" in schema:
+            self.kind = "object"
+            self.properties = [(key, _Node(sub)) for key, sub in schema["properties"].items()]
+        elif kind == "object":
+            self.kind = "map"
+            self.child = _Node(schema.get("additionalProperties", {"type": "string"}))
+        else:
+            raise ValueError(f"Unsupported schema type: {kind}")
+
+    def default(self) -> str:
+        """Smallest valid JSON text for this node."""
+        if self.kind == "string":
+            return '""'
+        if self.kind == "array":
+            return "[]"
+        if self.kind == "map":
+            return "{}"
+        return "{" + ",".join(f'"{key}":{node.default()}' for key, node in self.properties) + "}"
+
+
+class _Frame:
+    __slots__ = ("node", "phase", "index", "pos")
+
+    def __init__(self, node: _Node):
+        self.node = node
+        self.phase = "start"
+        self.index = 0  # object: current property
+        self.pos = 0    # key chars matched, or \uXXXX digits still expected
+
+    def clone(self) -> "_Frame":
+        frame = _Frame(self.node)
+        frame.phase = self.phase
+        frame.index = self.index
+        frame.pos = self.pos
+        return frame
+
+
+# Phases where JSON allows insignificant whitespace, per frame kind
+_WHITESPACE_PHASES = {
+    "string": {"start"},
+    "array": {"start", "first", "after_item"},
+    "object": {"start", "key", "colon", "after_value"},
+    "map": {"start", "first", "key", "colon", "after_value"},
+}
+
+
+class JsonSchemaMatcher:
+    """Character-level pushdown automaton accepting prefixes of schema-valid JSON.
+
+    ``try_feed`` returns the advanced matcher when the text keeps the output a
+    valid prefix, or ``None`` otherwise; the receiver is never modified, so
+    candidates can be tested cheaply. ``closing_suffix`` completes any prefix
+    into a parseable document, filling required fields with empty values.
+    """
+
+    def __init__(self, schema: Dict[str, Any], _root: Optional[_Node] = None):
+        self.root = _root or _Node(schema)
+        self.stack: List[_Frame] = [_Frame(self.root)]
+        self.whitespace_run = 0
+        self.complete = False
+
+    def clone(self) -> "JsonSchemaMatcher":
+        matcher = JsonSchemaMatcher.__new__(JsonSchemaMatcher)
+        matcher.root = self.root
+        matcher.stack = [frame.clone() for frame in self.stack]
+        matcher.whitespace_run = self.whitespace_run
+        matcher.complete = self.complete
+        return matcher
+
+    def try_feed(self, text: str) -> Optional["JsonSchemaMatcher"]:
+        matcher = self.clone()
+        for ch in text:
+            if not matcher._feed(ch):
+                return None
+        return matcher
+
+    def _feed(self, ch: str) -> bool:
+        if ch in WHITESPACE:
+            if self.complete or self.stack[-1].phase in _WHITESPACE_PHASES[self.stack[-1].node.kind]:
+                self.whitespace_run += 1
+                return self.whitespace_run <= MAX_WHITESPACE_RUN
+        if self.complete:
+            return False
+        self.whitespace_run = 0
+        frame = self.stack[-1]
+        return getattr(self, f"_feed_{frame.node.kind}")(frame, ch)
+
+    def _push(self, node: _Node) -> None:
+        self.stack.append(_Frame(node))
+
+    def _pop(self) -> bool:
+        self.stack.pop()
+        if not self.stack:
+            self.complete = True
+            return True
+        parent = self.stack[-1]
+        parent.phase = "after_item" if parent.node.kind == "array" else "after_value"
+        return True
+
+    def _feed_string(self, frame: _Frame, ch: str) -> bool:
+        if frame.phase == "start":
+            if ch != '"':
+                return False
+            frame.phase = "body"
+            return True
+        return self._feed_string_body(frame, ch, "body", self._pop)
+
+    def _feed_string_body(self, frame: _Frame, ch: str, body: str, on_close) -> bool:
+        """Shared by string values and map keys; ``body`` names the frame's body phase."""
+        if frame.phase == body:
+            if ch == '"':
+                return on_close()
+            if ch == "\\":
+                frame.phase = body + "_escape"
+                return True
+            return ord(ch) >= 0x20
+        if frame.phase == body + "_escape":
+            if ch in '"\\/bfnrt':
+                frame.phase = body
+                return True
+            if ch == "u":
+                frame.phase = body + "_unicode"
+                frame.pos = 4
+                return True
+            return False
+        if frame.phase == body + "_unicode":
+            if ch not in "0123456789abcdefABCDEF":
+                return False
+            frame.pos -= 1
+            if frame.pos == 0:
+                frame.phase = body
+            return True
+        return False
+
+    def _feed_array(self, frame: _Frame, ch: str) -> bool:
+        if frame.phase == "start":
+            if ch != "[":
+                return False
+            frame.phase = "first"
+            return True
+        if frame.phase == "first":
+            if ch == "]":
+                return self._pop()
+            frame.phase = "item"
+            self._push(frame.node.child)
+            return self._feed(ch)
+        if frame.phase == "after_item":
+            if ch == "]":
+                return self._pop()
+            if ch == ",":
+                frame.phase = "item"
+                self._push(frame.node.child)
+                return True
+        return False
+
+    def _feed_object(self, frame: _Frame, ch: str) -> bool:
+        properties = frame.node.properties
+        if frame.phase == "start":
+            if ch != "{":
+                return False
+            frame.phase = "key" if properties else "after_value"
+            frame.index = 0 if properties else -1
+            return True
+        if frame.phase == "key":
+            if ch != '"':
+                return False
+            frame.phase = "key_body"
+            frame.pos = 0
+            return True
+        if frame.phase == "key_body":
+            key = properties[frame.index][0]
+            if frame.pos < len(key):
+                if ch != key[frame.pos]:
+                    return False
+                frame.pos += 1
+                return True
+            if ch != '"':
+                return False
+            frame.phase = "colon"
+            return True
+        if frame.phase == "colon":
+            if ch != ":":
+                return False
+            frame.phase = "value"
+            self._push(properties[frame.index][1])
+            return True
+        if frame.phase == "after_value":
+            if frame.index < len(properties) - 1:
+                if ch != ",":
+                    return False
+                frame.index += 1
+                frame.phase = "key"
+                return True
+            return ch == "}" and self._pop()
+        return False
+
+    def _feed_map(self, frame: _Frame, ch: str) -> bool:
+        if frame.phase == "start":
+            if ch != "{":
+                return False
+            frame.phase = "first"
+            return True
+        if frame.phase in ("first", "key"):
+            if ch == "}" and frame.phase == "first":
+                return self._pop()
+            if ch != '"':
+                return False
+            frame.phase = "key_body"
+            return True
+        if frame.phase.startswith("key_body"):
+            def close_key() -> bool:
+                frame.phase = "colon"
+                return True
+            return self._feed_string_body(frame, ch, "key_body", close_key)
+        if frame.phase == "colon":
+            if ch != ":":
+                return False
+            frame.phase = "value"
+            self._push(frame.node.child)
+            return True
+        if frame.phase == "after_value":
+            if ch == "}":
+                return self._pop()
+            if ch == ",":
+                frame.phase = "key"
+                return True
+        return False
+
+    def closing_suffix(self) -> str:
+        """Text that turns the current prefix into a complete, valid document."""
+        suffix = []
+        for frame in reversed(self.stack):
+            node, phase = frame.node, frame.phase
+            if phase == "start":
+                suffix.append(node.default())
+            elif node.kind == "string":
+                suffix.append({"body": '"', "body_escape": 'n"'}.get(phase, "0" * frame.pos + '"'))
+            elif node.kind == "array":
+                suffix.append("]")
+            elif node.kind == "map":
+                value = node.child.default()
+                suffix.append({
+                    "first": "}",
+                    "key": f'"":{value}}}',
+                    "key_body": f'":{value}}}',
+                    "key_body_escape": f'n":{value}}}',
+                    "key_body_unicode": "0" * frame.pos + f'":{value}}}',
+                    "colon": f":{value}}}",
+                }.get(phase, "}"))
+            else:
+                rest = "".join(f',"{key}":{sub.default()}' for key, sub in node.properties[frame.index + 1:])
+                if phase in ("key", "key_body", "colon"):
+                    key, sub = node.properties[frame.index]
+                    head = {
+                        "key": f'"{key}":',
+                        "key_body": key[frame.pos:] + '":',
+                        "colon": ":",
+                    }[phase]
+                    suffix.append(head + sub.default() + rest + "}")
+                else:
+                    suffix.append(rest + "}")
+        return "".join(suffix)
+
+
+class TokenTexts:
+    """Surface text of vocabulary tokens, decoded lazily and cached.
+
+    Single-token ``decode`` drops the leading space of SentencePiece pieces,
+    so pieces are mapped by hand: ``▁`` is a space and ``<0xNN>`` byte-fallback
+    pieces are their ASCII character. Special tokens have no text.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.special_ids = set(tokenizer.all_special_ids)
+        self._cache: Dict[int, Optional[str]] = {}
+
+    def __call__(self, token_id: int) -> Optional[str]:
+        if token_id in self._cache:
+            return self._cache[token_id]
+        text = None
+        if token_id not in self.special_ids:
+            piece = self.tokenizer.convert_ids_to_tokens(token_id)
+            if piece is None:
+                text = None
+            elif len(piece) == 6 and piece.startswith("<0x") and piece.endswith(">"):
+                byte = int(piece[3:5], 16)
+                text = chr(byte) if byte < 0x80 else None
+            elif "▁" in piece:
+                text = piece.replace("▁", " ")
+            else:
+                text = self.tokenizer.convert_tokens_to_string([piece])
+        self._cache[token_id] = text
+        return text
+
+
+class JsonConstraint:
+    """Per-sequence decoding constraint keeping the output valid for a schema.
+
+    Rather than scoring the whole vocabulary each step, candidates are checked
+    in the model's own order (sampled, or by likelihood when greedy) and the
+    first that keeps the output a valid prefix wins. That is equivalent to
+    masking every invalid logit, and usually only the top candidate is tried.
+    """
+
+    def __init__(self, schema: Dict[str, Any], token_texts: TokenTexts, eos_token_id: int):
+        self.matcher = JsonSchemaMatcher(schema)
+        self.token_texts = token_texts
+        self.eos_token_id = eos_token_id
+        self.text = ""
+        self.rejected_tokens = 0
+
+    @property
+    def is_complete(self) -> bool:
+        return self.matcher.complete
+
+    def select(self, logits: torch.Tensor, probs: Optional[torch.Tensor] = None) -> int:
+        """Pick a token from ``probs`` (sampling) or ``logits`` (greedy) that keeps the output valid."""
+        if self.matcher.complete:
+            return self.eos_token_id
+
+        if probs is not None:
+            probs = probs.clone()
+            for _ in range(MAX_SAMPLED_REJECTIONS):
+                if probs.sum() <= 0:
+                    break
+                token_id = int(torch.multinomial(probs, 1))
+                if self._accept(token_id):
+                    return token_id
+                probs[token_id] = 0
+
+        top = torch.topk(logits, min(64, logits.size(-1))).indices.tolist()
+        for token_id in top:
+            if self._accept(token_id):
+                return token_id
+        for token_id in torch.argsort(logits, descending=True).tolist()[len(top):]:
+            if self._accept(token_id):
+                return token_id
+        raise RuntimeError("No vocabulary token can continue the constrained output")
+
+    def _accept(self, token_id: int) -> bool:
+        text = self.token_texts(token_id)
+        if not text:
+            return False
+        matcher = self.matcher.try_feed(text)
+        if matcher is None:
+            self.rejected_tokens += 1
+            return False
+        self.matcher = matcher
+        self.text += text
+        return True
+
+    def closing_suffix(self) -> str:
+        return self.matcher.closing_suffix()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "complete": self.matcher.complete,
+            "rejected_tokens": self.rejected_tokens,
+            "closing_suffix_chars": len(self.matcher.closing_suffix()),
+        }
@@ -0,0 +1,233 @@
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+logger = logging.getLogger(__name__)
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+CHECKPOINT_PATTERNS = ["*.json", "*.safetensors", "*.model", "*.txt", "tokenizer*"]
+
+
+def resolve_checkpoint_dir(model_name: str) -> str:
+    """Local directory holding the model files, downloading only what we need."""
+    if os.path.isdir(model_name):
+        return model_name
+    from huggingface_hub import snapshot_download
+    return snapshot_download(model_name, allow_patterns=CHECKPOINT_PATTERNS)
+
+
+def safetensors_shards(checkpoint_dir: str) -> List[str]:
+    index_path = os.path.join(checkpoint_dir, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            weight_map = json.load(f)["weight_map"]
+        return [os.path.join(checkpoint_dir, name) for name in sorted(set(weight_map.values()))]
+    single = os.path.join(checkpoint_dir, "model.safetensors")
+    return [single] if os.path.exists(single) else []
+
+
+def read_safetensors_header(path: str) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+    header.pop("__metadata__", None)
+    return header
+
+
+class ModelLoader:
+    """Loads a causal LM from memory-mapped safetensors shards.
+
+    The model skeleton is built with parameters on the meta device and each
+    tensor in the checkpoint is then viewed straight out of a private
+    (copy-on-write) mmap of its shard and assigned into the module, so no
+    weight bytes are copied when the checkpoint dtype matches the requested
+    one. Pages are faulted in from the page cache on first use and stay
+    shared with every other process mapping the same file. Checkpoints without
+    safetensors fall back to ``from_pretrained``.
+
+    ``state`` moves idle -> loading -> ready (or failed) and ``progress``
+    tracks the fraction of checkpoint bytes materialised, for readiness probes.
+    """
+
+    def __init__(self, model_name: str, device: str = "cpu", dtype: str = "float32"):
+        self.model_name = model_name
+        self.device = device
+        self.dtype = dtype
+
+        self.state = "idle"
+        self.progress = 0.0
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.zero_copy_tensors = 0
+        self.copied_tensors = 0
+        self._mmaps: List[mmap.mmap] = []
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Blocking load; returns ``(model, tokenizer)``."""
+        with self._lock:
+            self.state = "loading"
+            self.started_at = time.monotonic()
+            self.finished_at = None
+            self.progress = 0.0
+            self.error = None
+        try:
+            checkpoint_dir = resolve_checkpoint_dir(self.model_name)
+            tokenizer = AutoTokenizer.from_pretrained(checkpoint_dir)
+            shards = safetensors_shards(checkpoint_dir)
+            if shards and self.device == "cpu":
+                model = self._load_mmap(checkpoint_dir, shards)
+            else:
+                logger.info(f"No safetensors shards for {self.model_name}; using from_pretrained")
+                model = AutoModelForCausalLM.from_pretrained(
+                    checkpoint_dir,
+                    torch_dtype=self._torch_dtype(None),
+                    low_cpu_mem_usage=True,
+                ).to(self.device)
+            model.eval()
+            self.progress = 1.0
+            self.state = "ready"
+            return model, tokenizer
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            raise
+        finally:
+            self.finished_at = time.monotonic()
+
+    def _torch_dtype(self, config) -> torch.dtype:
+        if self.dtype == "auto":
+            config_dtype = getattr(config, "torch_dtype", None) if config is not None else None
+            if isinstance(config_dtype, torch.dtype):
+                return config_dtype
+            if isinstance(config_dtype, str):
+                return getattr(torch, config_dtype)
+            return torch.float32
+        return getattr(torch, self.dtype)
+
+    def _load_mmap(self, checkpoint_dir: str, shards: List[str]):
+        from accelerate import init_empty_weights
+
+        config = AutoConfig.from_pretrained(checkpoint_dir)
+        dtype = self._torch_dtype(config)
+        # Parameters stay on the meta device; buffers such as rotary inv_freq
+        # are computed normally since they are not stored in the checkpoint.
+        with init_empty_weights(include_buffers=False):
+            model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype)
+
+        headers = [read_safetensors_header(path) for path in shards]
+        total_bytes = sum(
+            info["data_offsets"][1] - info["data_offsets"][0]
+            for header in headers for info in header.values()
+        ) or 1
+        loaded_bytes = 0
+
+        state_dict = {}
+        for path, header in zip(shards, headers):
+            with open(path, "rb") as f:
+                (header_len,) = struct.unpack("<Q", f.read(8))
+                # ACCESS_COPY: writable view whose pages stay shared until written
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            self._mmaps.append(mm)
+            data_start = 8 + header_len
+
+            for name, info in header.items():
+                start, end = info["data_offsets"]
+                file_dtype = SAFETENSORS_DTYPES[info["dtype"]]
+                shape = info["shape"]
+                numel = math.prod(shape)
+                if numel == 0:
+                    tensor = torch.empty(shape, dtype=file_dtype)
+                else:
+                    tensor = torch.frombuffer(
+                        mm, dtype=file_dtype, count=numel, offset=data_start + start
+                    ).view(shape)
+                if tensor.is_floating_point() and file_dtype != dtype:
+                    tensor = tensor.to(dtype)
+                    self.copied_tensors += 1
+                else:
+                    self.zero_copy_tensors += 1
+                state_dict[name] = tensor
+                loaded_bytes += end - start
+                self.progress = min(loaded_bytes / total_bytes, 0.99)
+
+        # Older checkpoints store the base model's weights without its prefix
+        expected = set(model.state_dict().keys())
+        prefix = model.base_model_prefix
+        state_dict = {
+            f"{prefix}.{name}" if name not in expected and f"{prefix}.{name}" in expected else name: tensor
+            for name, tensor in state_dict.items()
+        }
+
+        missing, unexpected = model.load_state_dict(state_dict, strict=False, assign=True)
+        if unexpected:
+            logger.warning(f"Unexpected checkpoint tensors ignored: {unexpected[:5]}")
+        model.tie_weights()
+
+        still_empty = [name for name, param in model.named_parameters() if param.device.type == "meta"]
+        if still_empty:
+            raise RuntimeError(f"Checkpoint is missing weights: {still_empty[:5]}")
+
+        logger.info(
+            f"Mapped {self.model_name}: {self.zero_copy_tensors} tensors zero-copy, "
+            f"{self.copied_tensors} converted to {dtype}"
+        )
+        return model
+
+    def estimate_nbytes(self) -> Optional[int]:
+        """Resident size of the loaded weights, from checkpoint headers alone."""
+        checkpoint_dir = resolve_checkpoint_dir(self.model_name)
+        shards = safetensors_shards(checkpoint_dir)
+        if not shards:
+            return None
+        dtype = self._torch_dtype(AutoConfig.from_pretrained(checkpoint_dir))
+        total = 0
+        for path in shards:
+            for info in read_safetensors_header(path).values():
+                file_dtype = SAFETENSORS_DTYPES[info["dtype"]]
+                size_dtype = dtype if file_dtype.is_floating_point else file_dtype
+                total += math.prod(info["shape"]) * torch.empty(0, dtype=size_dtype).element_size()
+        return total
+
+    def release(self) -> None:
+        """Drop our references to the shard mappings; they unmap once no tensor uses them."""
+        self._mmaps = []
+        self.state = "idle"
+        self.progress = 0.0
+
+    def status(self) -> Dict[str, Any]:
+        load_seconds = None
+        if self.started_at is not None:
+            end = self.finished_at or time.monotonic()
+            load_seconds = round(end - self.started_at, 2)
+        return {
+            "model": self.model_name,
+            "state": self.state,
+            "progress": round(self.progress, 3),
+            "load_seconds": load_seconds,
+            "zero_copy_tensors": self.zero_copy_tensors,
+            "copied_tensors": self.copied_tensors,
+            "error": self.error,
+        }
@@ -0,0 +1,194 @@
+import asyncio
+import gc
+import logging
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from model_service import CodeGenerationService
+
+logger = logging.getLogger(__name__)
+
+
+class ModelLoadingError(Exception):
+    """The requested model is still loading"""
+    pass
+
+
+class ModelPool:
+    """Generation services keyed by model name, resident under a RAM budget.
+
+    Models load on demand the first time a request names them and are shared
+    by every request for that name. Before a new model loads, least recently
+    used models with no requests in flight are released until its estimated
+    size fits in ``max_bytes``; the estimate then counts against the budget
+    until the loaded size replaces it. Pooled services never start loading
+    on their own, so every load goes through that accounting; with
+    ``load_mode="eager"`` the pool starts the default model at startup.
+
+    Models passed to ``preload()`` load synchronously; when that runs at import
+    time under ``gunicorn --preload`` the weights are in memory before the
+    workers fork and every worker shares the same pages copy-on-write (the
+    safetensors mmaps are shared through the page cache regardless).
+    """
+
+    def __init__(
+        self,
+        default_model: str,
+        max_bytes: int,
+        allowed_models: Optional[List[str]] = None,
+        load_mode: Optional[str] = None,
+    ):
+        self.default_model = default_model
+        self.max_bytes = max_bytes
+        self.allowed_models = allowed_models or [default_model]
+        self.load_mode = load_mode or os.getenv("ML_LOAD_MODE", "eager")
+        self._services: "OrderedDict[str, CodeGenerationService]" = OrderedDict()
+        self._leases: Dict[str, int] = {}
+        self._sizes: Dict[str, int] = {}
+        self._lock = asyncio.Lock()
+        self.stats = {"loads": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls) -> "ModelPool":
+        models = [m.strip() for m in os.getenv("ML_MODELS", "").split(",") if m.strip()]
+        default_model = os.getenv("ML_DEFAULT_MODEL") or (models[0] if models else "codellama/CodeLlama-7b-hf")
+        if default_model not in models:
+            models.insert(0, default_model)
+        max_gb = float(os.getenv("ML_POOL_MAX_GB", "32"))
+        return cls(default_model, int(max_gb * 1024 ** 3), allowed_models=models)
+
+    def is_allowed(self, model_name: Optional[str]) -> bool:
+        return model_name is None or model_name in self.allowed_models
+
+    def get(self, model_name: Optional[str] = None) -> CodeGenerationService:
+        """Service for ``model_name``, created (and loading per its load mode) if new."""
+        model_name = model_name or self.default_model
+        if not self.is_allowed(model_name):
+            raise ValueError(f"Model {model_name} is not served here; choose one of {self.allowed_models}")
+        service = self._services.get(model_name)
+        if service is None:
+            service = CodeGenerationService(
+                model_name,
+                # Only the default model is paired with the configured draft
+                draft_model_name=None if model_name == self.default_model else "",
+                # The pool starts loads itself, once it has made room
+                load_mode="lazy",
+            )
+            self._services[model_name] = service
+            self._leases.setdefault(model_name, 0)
+        self._services.move_to_end(model_name)
+        return service
+
+    def preload(self, model_names: List[str]) -> None:
+        """Load models synchronously, e.g. in the master process before forking workers."""
+        for model_name in model_names:
+            service = self.get(model_name)
+            service.load()
+            self._sizes[model_name] = service.nbytes()
+            self.stats["loads"] += 1
+        # Keep the long-lived objects from preloading out of future GC passes so
+        # the collector does not write to (and un-share) their pages after fork
+        gc.freeze()
+
+    async def start_loading(self, model_name: Optional[str] = None) -> CodeGenerationService:
+        """Make room for ``model_name`` and start loading it, unless it is loaded or loading already."""
+        model_name = model_name or self.default_model
+        async with self._lock:
+            service = self.get(model_name)
+            # A model is in _sizes from the moment its load starts, so requests
+            # arriving mid-load (or after timing out on it) do not make room again
+            if model_name not in self._sizes:
+                loop = asyncio.get_running_loop()
+                estimate = await loop.run_in_executor(None, service.estimate_nbytes)
+                self._make_room(model_name, estimate or 0)
+                self._sizes[model_name] = estimate or 0
+                service.start_loading()
+                self.stats["loads"] += 1
+        return service
+
+    async def acquire(self, model_name: Optional[str] = None, timeout: Optional[float] = None) -> CodeGenerationService:
+        """The loaded service for ``model_name``; raises ModelLoadingError if it is still loading after ``timeout``."""
+        model_name = model_name or self.default_model
+        service = await self.start_loading(model_name)
+        try:
+            await service.wait_until_ready(timeout)
+        except TimeoutError as e:
+            raise ModelLoadingError(str(e))
+        except RuntimeError:
+            # The load failed and holds nothing; the next request starts over
+            if self._services.get(model_name) is service:
+                self._sizes.pop(model_name, None)
+            raise
+        self._sizes[model_name] = service.nbytes()
+        return service
+
+    @asynccontextmanager
+    async def lease(self, model_name: Optional[str] = None, timeout: Optional[float] = None):
+        """Hold a model for the duration of a request so it cannot be evicted."""
+        model_name = model_name or self.default_model
+        self._leases[model_name] = self._leases.get(model_name, 0) + 1
+        try:
+            yield await self.acquire(model_name, timeout)
+        finally:
+            self._leases[model_name] = self._leases.get(model_name, 1) - 1
+
+    def _make_room(self, model_name: str, needed: int) -> None:
+        for name in list(self._services):
+            if self.resident_bytes + needed <= self.max_bytes:
+                break
+            if name == model_name or self._leases.get(name, 0) > 0:
+                continue
+            self.evict(name)
+        if self.resident_bytes + needed > self.max_bytes:
+            logger.warning(
+                f"Loading {model_name} exceeds the pool budget; "
+                f"{self.resident_bytes + needed} > {self.max_bytes} bytes"
+            )
+
+    def evict(self, model_name: str) -> None:
+        service = self._services.pop(model_name, None)
+        if service is None:
+            return
+        logger.info(f"Evicting model {model_name} from the pool")
+        service.release()
+        self._sizes.pop(model_name, None)
+        self._leases.pop(model_name, None)
+        self.stats["evictions"] += 1
+        gc.collect()
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(self._sizes.get(name, 0) for name in self._services)
+
+    @property
+    def is_ready(self) -> bool:
+        service = self._services.get(self.default_model)
+        return service is not None and service.is_ready
+
+    @property
+    def error(self) -> Optional[str]:
+        """Why the default model failed to load, if it did"""
+        service = self._services.get(self.default_model)
+        return service.error if service is not None else None
+
+    def shutdown(self) -> None:
+        for service in self._services.values():
+            service.shutdown()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {name: service.get_stats() for name, service in self._services.items()}
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "default_model": self.default_model,
+            "allowed_models": self.allowed_models,
+            "resident_bytes": self.resident_bytes,
+            "max_bytes": self.max_bytes,
+            "models": {
+                name: dict(service.status(), bytes=self._sizes.get(name), in_flight=self._leases.get(name, 0))
+                for name, service in self._services.items()
+            },
+            **self.stats,
+        }
@@ -1,31 +1,207 @@
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from typing import Optional
+import asyncio
+import itertools
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
 import logging
 
+from engine import ContinuousBatchingEngine, Sequence
+from json_constraint import SCHEMAS, JsonConstraint, TokenTexts
+from loader import ModelLoader
+from prefix_cache import PrefixCache
+from speculative import SpeculativeDecoder, tokenizers_compatible
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
 class CodeGenerationService:
-    def __init__(self, model_name: str = "codellama/CodeLlama-7b-hf"):
+    """Serves one model through the continuous-batching engine.
+
+    Weights are loaded off the request path: ``load_mode="eager"`` starts
+    loading in the background at construction, ``"lazy"`` waits for the first
+    request. Until the model is ready ``status()`` reports load progress so
+    readiness probes can keep traffic away from cold instances.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "codellama/CodeLlama-7b-hf",
+        max_batch_size: Optional[int] = None,
+        prefix_cache_mb: Optional[int] = None,
+        draft_model_name: Optional[str] = None,
+        load_mode: Optional[str] = None,
+    ):
         self.model_name = model_name
         self.device = "cpu"  # Using CPU for local development
         logger.info(f"Using device: {self.device}")
-        
-        logger.info("Loading tokenizer...")
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        
-        logger.info("Loading model...")
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            device_map=self.device,
-            torch_dtype=torch.float32,
-            low_cpu_mem_usage=True
+
+        self.max_batch_size = max_batch_size or int(os.getenv("ML_MAX_BATCH_SIZE", "8"))
+        if prefix_cache_mb is None:
+            prefix_cache_mb = int(os.getenv("ML_PREFIX_CACHE_MB", "512"))
+        self.prefix_cache_mb = prefix_cache_mb
+        # Optional small model for speculative decoding; must share the tokenizer
+        if draft_model_name is None:
+            draft_model_name = os.getenv("ML_DRAFT_MODEL")
+        self.draft_model_name = draft_model_name or None
+        self.default_num_draft_tokens = int(os.getenv("ML_NUM_DRAFT_TOKENS", "4"))
+
+        dtype = os.getenv("ML_TORCH_DTYPE", "float32")
+        self.loader = ModelLoader(model_name, device=self.device, dtype=dtype)
+        self.draft_loader = (
+            ModelLoader(self.draft_model_name, device=self.device, dtype=dtype)
+            if self.draft_model_name else None
         )
-        
-        logger.info("Model loaded successfully!")
 
-    def generate_code(
+        self.model = None
+        self.tokenizer = None
+        self.token_texts = None
+        self.prefix_cache = None
+        self.speculator = None
+        self.engine = None
+        # Why the last load failed, whichever step (weights, draft model, engine) it failed in
+        self.error: Optional[str] = None
+        self._ready = threading.Event()
+        self._load_lock = threading.Lock()
+        self._load_thread: Optional[threading.Thread] = None
+
+        self.load_mode = load_mode or os.getenv("ML_LOAD_MODE", "eager")
+        if self.load_mode == "eager":
+            self.start_loading()
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def start_loading(self) -> None:
+        """Begin loading in the background; no-op if loading or already loaded."""
+        with self._load_lock:
+            if self._ready.is_set():
+                return
+            if self._load_thread is not None and self._load_thread.is_alive():
+                return
+            self._load_thread = threading.Thread(
+                target=self._load, name=f"load-{self.model_name}", daemon=True
+            )
+            self._load_thread.start()
+
+    def load(self) -> None:
+        """Blocking load, for scripts and preloading before workers fork."""
+        self.start_loading()
+        self._load_thread.join()
+        if not self.is_ready:
+            raise RuntimeError(f"Model failed to load: {self.error}")
+
+    async def wait_until_ready(self, timeout: Optional[float] = None) -> None:
+        self.start_loading()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not self._ready.is_set():
+            if not self._load_thread.is_alive() and not self._ready.is_set():
+                raise RuntimeError(f"Model failed to load: {self.error}")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Model {self.model_name} is still loading")
+            await asyncio.sleep(0.05)
+
+    def _load(self) -> None:
+        self.error = None
+        try:
+            logger.info(f"Loading model {self.model_name}...")
+            self.model, self.tokenizer = self.loader.load()
+            logger.info("Model loaded successfully!")
+            self.token_texts = TokenTexts(self.tokenizer)
+
+            if self.draft_loader is not None:
+                self.speculator = self._load_speculator()
+
+            # Prompts sharing system instructions reuse the prefix's key/values
+            if self.prefix_cache_mb > 0:
+                self.prefix_cache = PrefixCache(self.prefix_cache_mb * 1024 * 1024)
+
+            # All requests share one generation loop that batches them per token
+            self.engine = ContinuousBatchingEngine(
+                self.model,
+                self.tokenizer,
+                device=self.device,
+                max_batch_size=self.max_batch_size,
+                prefix_cache=self.prefix_cache,
+                speculator=self.speculator,
+            )
+            self.engine.start()
+            self._ready.set()
+        except Exception as e:
+            logger.error(f"Failed to load model {self.model_name}: {str(e)}")
+            self.error = str(e)
+            # Drop whatever did load, so a failed model holds no memory
+            if self.engine is not None:
+                self.engine.stop()
+            self.engine = None
+            self.speculator = None
+            self.prefix_cache = None
+            self.model = None
+            self.tokenizer = None
+            self.loader.release()
+            if self.draft_loader is not None:
+                self.draft_loader.release()
+
+    def _load_speculator(self) -> SpeculativeDecoder:
+        logger.info(f"Loading draft model {self.draft_model_name}...")
+        draft_model, draft_tokenizer = self.draft_loader.load()
+        if not tokenizers_compatible(self.tokenizer, draft_tokenizer):
+            raise ValueError(
+                f"Draft model {self.draft_model_name} does not share the tokenizer of {self.model_name}"
+            )
+        logger.info("Draft model loaded successfully!")
+        return SpeculativeDecoder(draft_model, self.model, device=self.device)
+
+    def status(self) -> Dict[str, Any]:
+        status = dict(self.loader.status(), ready=self.is_ready, load_mode=self.load_mode)
+        if self.error is not None:
+            status.update(state="failed", error=self.error)
+        if self.draft_loader is not None:
+            status["draft"] = self.draft_loader.status()
+        return status
+
+    def shutdown(self) -> None:
+        if self.engine is not None:
+            self.engine.stop()
+
+    def release(self) -> None:
+        """Stop serving and drop the weights so their memory can be reclaimed."""
+        with self._load_lock:
+            self.shutdown()
+            self._ready.clear()
+            self.engine = None
+            self.speculator = None
+            self.prefix_cache = None
+            self.model = None
+            self.tokenizer = None
+            self.loader.release()
+            if self.draft_loader is not None:
+                self.draft_loader.release()
+
+    def nbytes(self) -> int:
+        """Bytes held by the loaded weights and buffers (target and draft)."""
+        models = [self.model]
+        if self.speculator is not None:
+            models.append(self.speculator.draft_model)
+        return sum(
+            tensor.numel() * tensor.element_size()
+            for model in models if model is not None
+            for tensor in itertools.chain(model.parameters(), model.buffers())
+        )
+
+    def estimate_nbytes(self) -> Optional[int]:
+        if self.is_ready:
+            return self.nbytes()
+        estimates = [self.loader.estimate_nbytes()]
+        if self.draft_loader is not None:
+            estimates.append(self.draft_loader.estimate_nbytes())
+        if any(estimate is None for estimate in estimates):
+            return None
+        return sum(estimates)
+
+    async def generate_code(
         self,
         prompt: str,
         max_length: int = 2048,
@@ -33,29 +209,108 @@ class CodeGenerationService:
         top_p: float = 0.95,
         top_k: int = 50,
         num_return_sequences: int = 1,
-    ) -> str:
-        """Generate code based on the given prompt."""
+        max_new_tokens: Optional[int] = None,
+        deadline_s: Optional[float] = None,
+        speculative: bool = False,
+        num_draft_tokens: Optional[int] = None,
+        response_format: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Generate code based on the given prompt.
+
+        ``max_new_tokens`` caps the completion (overriding ``max_length``) and
+        ``deadline_s`` bounds wall-clock time; on expiry the tokens produced so
+        far are returned with ``truncated`` set. Extra return sequences are
+        decoded alongside the first one in the shared batch. ``speculative``
+        drafts ``num_draft_tokens`` tokens per step with the draft model.
+
+        ``response_format`` names a schema in ``json_constraint.SCHEMAS``; the
+        completion is then decoded under that schema and, if cut short, closed
+        so that ``completion`` always parses as JSON.
+        """
+        if response_format is not None and response_format not in SCHEMAS:
+            raise ValueError(f"Unknown response_format {response_format}; choose one of {sorted(SCHEMAS)}")
+        await self.wait_until_ready()
+        # The loop thread does not survive a fork; restart it in each worker
+        self.engine.start()
         try:
             # Prepare the prompt
-            inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
-            
-            # Generate
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_length=max_length,
+            prompt_ids = self.tokenizer(prompt)["input_ids"]
+            if max_new_tokens is None:
+                max_new_tokens = max(max_length - len(prompt_ids), 1)
+
+            sequences = await asyncio.gather(*[
+                self.engine.generate(
+                    prompt_ids,
+                    max_new_tokens=max_new_tokens,
                     temperature=temperature,
                     top_p=top_p,
                     top_k=top_k,
-                    num_return_sequences=num_return_sequences,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    do_sample=True,
+                    deadline_s=deadline_s,
+                    # Drafted tokens bypass the constraint, so JSON mode decodes normally
+                    num_draft_tokens=(
+                        (num_draft_tokens or self.default_num_draft_tokens)
+                        if speculative and response_format is None else 0
+                    ),
+                    constraint=self._constraint(response_format),
                 )
-            
-            # Decode and return the generated code
-            generated_code = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            return generated_code.strip()
-            
+                for _ in range(max(num_return_sequences, 1))
+            ])
+
+            result = self._format_result(sequences[0])
+            if len(sequences) > 1:
+                result["alternatives"] = [self._decode(seq) for seq in sequences[1:]]
+            return result
+
         except Exception as e:
             logger.error(f"Error generating code: {str(e)}")
             raise
+
+    def _constraint(self, response_format: Optional[str]) -> Optional[JsonConstraint]:
+        if response_format is None:
+            return None
+        return JsonConstraint(SCHEMAS[response_format], self.token_texts, self.tokenizer.eos_token_id)
+
+    def _decode(self, seq: Sequence) -> str:
+        # Decode prompt and completion together, as generate() output did
+        text = self.tokenizer.decode(seq.prompt_ids + seq.output_ids, skip_special_tokens=True).strip()
+        if seq.constraint is not None:
+            text += seq.constraint.closing_suffix()
+        return text
+
+    def _completion(self, seq: Sequence) -> str:
+        if seq.constraint is not None:
+            # Exactly the text the constraint validated, closed if cut short
+            return seq.constraint.text + seq.constraint.closing_suffix()
+        return self.tokenizer.decode(seq.output_ids, skip_special_tokens=True)
+
+    def _format_result(self, seq: Sequence) -> Dict[str, Any]:
+        timing = seq.timing()
+        if seq.deadline is not None:
+            timing["deadline_ms"] = round((seq.deadline - seq.submitted_at) * 1000, 1)
+        return {
+            "generated_code": self._decode(seq),
+            "completion": self._completion(seq),
+            "truncated": seq.finish_reason != "stop",
+            "finish_reason": seq.finish_reason,
+            "usage": {
+                "prompt_tokens": len(seq.prompt_ids),
+                "completion_tokens": len(seq.output_ids),
+                "cached_prompt_tokens": seq.cached_prompt_tokens,
+            },
+            "timing": timing,
+            "speculative": seq.speculative_stats(),
+            "constraint": seq.constraint.stats() if seq.constraint is not None else None,
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        if not self.is_ready:
+            return {"model": self.status()}
+        return dict(
+            self.engine.stats,
+            active_sequences=self.engine.active_count,
+            pending_sequences=self.engine.pending_count,
+            max_batch_size=self.engine.max_batch_size,
+            prefix_cache=self.prefix_cache.get_stats() if self.prefix_cache else None,
+            draft_model=self.draft_model_name,
+            model=self.status(),
+        )
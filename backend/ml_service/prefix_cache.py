@@ -0,0 +1,153 @@
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from engine import LegacyCache
+
+logger = logging.getLogger(__name__)
+
+
+class _TrieNode:
+    __slots__ = ("children", "entries")
+
+    def __init__(self):
+        self.children: Dict[int, "_TrieNode"] = {}
+        # Keys of every cached prompt whose token path runs through this node
+        self.entries: set = set()
+
+
+def cache_nbytes(past_key_values: LegacyCache) -> int:
+    return sum(
+        k.numel() * k.element_size() + v.numel() * v.element_size()
+        for k, v in past_key_values
+    )
+
+
+class PrefixCache:
+    """Past key/values for previously seen prompts, reusable by shared prefix.
+
+    Lookups walk a token-id trie to find the cached prompt sharing the longest
+    prefix with the new one. Because attention is causal, the first ``n``
+    positions of any cached prompt are valid for every prompt that starts with
+    the same ``n`` tokens, so the hit is simply sliced to the shared length and
+    only the unique suffix has to be prefilled. Entries are evicted LRU once
+    their combined tensor size exceeds ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes: int, min_prefix_tokens: int = 16):
+        self.max_bytes = max_bytes
+        self.min_prefix_tokens = min_prefix_tokens
+        self._root = _TrieNode()
+        self._entries: "OrderedDict[Tuple[int, ...], LegacyCache]" = OrderedDict()
+        self._sizes: Dict[Tuple[int, ...], int] = {}
+        self.current_bytes = 0
+        self.stats = {
+            "lookups": 0,
+            "hits": 0,
+            "reused_tokens": 0,
+            "inserts": 0,
+            "evictions": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, token_ids: List[int]) -> Tuple[int, Optional[LegacyCache]]:
+        """Return ``(n, past_key_values)`` covering the first ``n`` tokens, or ``(0, None)``."""
+        self.stats["lookups"] += 1
+
+        node, depth = self._root, 0
+        # Leave at least one token to prefill so the model produces next-token logits
+        for token in token_ids[:len(token_ids) - 1]:
+            child = node.children.get(token)
+            if child is None:
+                break
+            node, depth = child, depth + 1
+
+        if depth < self.min_prefix_tokens or not node.entries:
+            return 0, None
+
+        key = next(iter(node.entries))
+        self._entries.move_to_end(key)
+        past = tuple(
+            (k[:, :, :depth, :], v[:, :, :depth, :]) for k, v in self._entries[key]
+        )
+        self.stats["hits"] += 1
+        self.stats["reused_tokens"] += depth
+        return depth, past
+
+    def insert(self, token_ids: List[int], past_key_values: LegacyCache) -> None:
+        """Cache the key/values of a fully prefilled prompt."""
+        if len(token_ids) < self.min_prefix_tokens:
+            return
+        key = tuple(token_ids)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+
+        # Already covered by a longer cached prompt?
+        node = self._root
+        for token in key:
+            node = node.children.get(token)
+            if node is None:
+                break
+        else:
+            if node.entries:
+                return
+
+        size = cache_nbytes(past_key_values)
+        if size > self.max_bytes:
+            return
+
+        # Shorter cached prompts that this one extends are now redundant
+        node = self._root
+        for depth, token in enumerate(key, start=1):
+            node = node.children.get(token)
+            if node is None:
+                break
+            for other in [e for e in node.entries if len(e) == depth]:
+                self._remove(other)
+
+        node = self._root
+        for token in key:
+            node = node.children.setdefault(token, _TrieNode())
+            node.entries.add(key)
+        self._entries[key] = past_key_values
+        self._sizes[key] = size
+        self.current_bytes += size
+        self.stats["inserts"] += 1
+
+        while self.current_bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        self._root = _TrieNode()
+        self._entries.clear()
+        self._sizes.clear()
+        self.current_bytes = 0
+
+    def _remove(self, key: Tuple[int, ...]) -> None:
+        del self._entries[key]
+        self.current_bytes -= self._sizes.pop(key)
+
+        # Drop the key from its path and prune nodes nobody uses any more
+        path = [self._root]
+        for token in key:
+            path.append(path[-1].children[token])
+        for node in path[1:]:
+            node.entries.discard(key)
+        for depth in range(len(key), 0, -1):
+            node = path[depth]
+            if node.entries or node.children:
+                break
+            del path[depth - 1].children[key[depth - 1]]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(
+            self.stats,
+            entries=len(self._entries),
+            bytes=self.current_bytes,
+            max_bytes=self.max_bytes,
+        )
@@ -0,0 +1,141 @@
+import logging
+from typing import List, Optional, Tuple
+
+import torch
+
+from engine import (
+    LegacyCache,
+    Sequence,
+    crop_cache,
+    is_greedy,
+    sampling_probs,
+    to_legacy_cache,
+    to_model_cache,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def tokenizers_compatible(target_tokenizer, draft_tokenizer) -> bool:
+    """Speculation only works when both models index the same vocabulary."""
+    return target_tokenizer.get_vocab() == draft_tokenizer.get_vocab()
+
+
+class SpeculativeDecoder:
+    """Draft-then-verify decoding with a small model sharing the target's tokenizer.
+
+    For each step the draft model proposes ``k`` tokens autoregressively, then
+    the target model scores all of them in a single forward pass. Proposals are
+    accepted with the standard speculative sampling rule (exact match under
+    greedy decoding), so the output distribution is the target model's; the
+    first rejected position is resampled from the target and, if everything was
+    accepted, one bonus token comes for free from the last target position.
+    """
+
+    def __init__(self, draft_model, target_model, device: str = "cpu", max_draft_tokens: int = 8):
+        self.draft_model = draft_model
+        self.device = device
+        self.max_draft_tokens = max_draft_tokens
+        # Embedding matrices are sometimes padded past the tokenizer's size
+        self.vocab_size = min(draft_model.config.vocab_size, target_model.config.vocab_size)
+
+    def step(self, engine, seq: Sequence) -> None:
+        tokens = seq.prompt_ids + seq.output_ids
+        length = len(tokens)
+        greedy = is_greedy(seq.temperature)
+
+        # Never draft past the token budget
+        k = max(0, min(seq.num_draft_tokens, self.max_draft_tokens,
+                       seq.max_new_tokens - len(seq.output_ids) - 1))
+
+        drafts, draft_probs, draft_past, draft_len = self._propose(seq, tokens, k, greedy)
+
+        # Score the pending token plus every proposal with one target pass
+        target_logits, target_past = self._forward(
+            engine.model, [tokens[-1]] + drafts, seq.cache_length, seq.past_key_values
+        )
+        target_logits = target_logits[:, :self.vocab_size]
+
+        accepted = 0
+        new_tokens = []
+        for i, draft in enumerate(drafts):
+            if greedy:
+                target_token = int(torch.argmax(target_logits[i]))
+                if target_token == draft:
+                    accepted += 1
+                    new_tokens.append(draft)
+                    continue
+                new_tokens.append(target_token)
+                break
+
+            p = sampling_probs(target_logits[i], seq.temperature, seq.top_p, seq.top_k)
+            q = draft_probs[i]
+            if torch.rand(()) < torch.clamp(p[draft] / q[draft], max=1.0):
+                accepted += 1
+                new_tokens.append(draft)
+                continue
+            # Rejected: resample from the part of p the draft under-weighted
+            residual = torch.clamp(p - q, min=0)
+            if residual.sum() <= 0:
+                residual = p
+            new_tokens.append(int(torch.multinomial(residual / residual.sum(), 1)))
+            break
+        else:
+            new_tokens.append(engine._sample(target_logits[len(drafts)], seq))
+
+        # Both caches are valid up to the last accepted token
+        valid = length + accepted
+        seq.past_key_values = crop_cache(to_legacy_cache(target_past), valid)
+        if draft_past is not None:
+            seq.draft_cache_length = min(draft_len, valid)
+            seq.draft_past_key_values = crop_cache(draft_past, seq.draft_cache_length)
+
+        seq.draft_tokens_proposed += len(drafts)
+        seq.draft_tokens_accepted += accepted
+        engine.stats["draft_tokens_proposed"] += len(drafts)
+        engine.stats["draft_tokens_accepted"] += accepted
+
+        for token in new_tokens:
+            engine._append_token(seq, token)
+            if seq.finished:
+                break
+
+    def _propose(
+        self, seq: Sequence, tokens: List[int], k: int, greedy: bool
+    ) -> Tuple[List[int], List[torch.Tensor], Optional[LegacyCache], int]:
+        drafts: List[int] = []
+        draft_probs: List[torch.Tensor] = []
+        if k == 0:
+            return drafts, draft_probs, None, seq.draft_cache_length
+
+        past = seq.draft_past_key_values
+        cache_len = seq.draft_cache_length
+        # Catch the draft cache up with everything it has not seen yet
+        feed = tokens[cache_len:]
+        for _ in range(k):
+            logits, past = self._forward(self.draft_model, feed, cache_len, past)
+            cache_len += len(feed)
+            logits = logits[-1, :self.vocab_size]
+            if greedy:
+                token = int(torch.argmax(logits))
+            else:
+                q = sampling_probs(logits, seq.temperature, seq.top_p, seq.top_k)
+                token = int(torch.multinomial(q, 1))
+                draft_probs.append(q)
+            drafts.append(token)
+            feed = [token]
+        return drafts, draft_probs, past, cache_len
+
+    def _forward(
+        self, model, ids: List[int], start: int, past: Optional[LegacyCache]
+    ) -> Tuple[torch.Tensor, LegacyCache]:
+        kwargs = {
+            "input_ids": torch.tensor([ids], dtype=torch.long, device=self.device),
+            "position_ids": torch.arange(start, start + len(ids), device=self.device).unsqueeze(0),
+            "attention_mask": torch.ones(1, start + len(ids), dtype=torch.long, device=self.device),
+            "use_cache": True,
+        }
+        if past is not None:
+            kwargs["past_key_values"] = to_model_cache(past)
+        outputs = model(**kwargs)
+        return outputs.logits[0], to_legacy_cache(outputs.past_key_values)
@@ -0,0 +1,535 @@
+"""Run from this directory with ``python -m unittest tests``."""
+import asyncio
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import torch
+from fastapi.testclient import TestClient
+from tokenizers import Tokenizer as WordTokenizer, models, pre_tokenizers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+import api
+
+from engine import ContinuousBatchingEngine, Sequence
+from json_constraint import MAX_WHITESPACE_RUN, PROJECT_STRUCTURE_SCHEMA, JsonConstraint, JsonSchemaMatcher
+from model_pool import ModelLoadingError, ModelPool
+from model_service import CodeGenerationService
+from prefix_cache import PrefixCache, cache_nbytes
+from speculative import SpeculativeDecoder
+
+VOCAB_SIZE = 64
+
+
+def tiny_model(seed: int = 0, num_layers: int = 2) -> LlamaForCausalLM:
+    """A randomly initialised Llama small enough to run in a unit test."""
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=VOCAB_SIZE,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=128,
+        bos_token_id=None,
+        eos_token_id=None,
+        pad_token_id=0,
+    )
+    # Double precision keeps padded and unpadded attention bit-for-bit close
+    # enough that greedy picks never diverge on a near tie
+    return LlamaForCausalLM(config).double().eval()
+
+
+class Tokenizer:
+    eos_token_id = None
+
+
+def save_checkpoint(test: unittest.TestCase, seed: int = 0, prefix: str = "w") -> str:
+    """A directory holding a tiny model and a word-level tokenizer, as ModelLoader reads them."""
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory)
+    vocab = {"<unk>": 0, "</s>": 1, **{f"{prefix}{i}": i + 2 for i in range(VOCAB_SIZE - 2)}}
+    words = WordTokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    words.pre_tokenizer = pre_tokenizers.Whitespace()
+    PreTrainedTokenizerFast(tokenizer_object=words, unk_token="<unk>", eos_token="</s>").save_pretrained(directory)
+    tiny_model(seed).float().save_pretrained(directory)
+    return directory
+
+
+def greedy_reference(model, prompt_ids, max_new_tokens):
+    """What ``generate`` produces for one prompt on its own."""
+    with torch.inference_mode():
+        output = model.generate(
+            torch.tensor([prompt_ids]),
+            attention_mask=torch.ones(1, len(prompt_ids), dtype=torch.long),
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=0,
+        )
+    return output[0, len(prompt_ids):].tolist()
+
+
+class EngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.model = tiny_model()
+        self.prompts = [
+            [5, 9, 14, 2, 7, 30, 31, 8],
+            [11, 3],
+            [40, 41, 42, 43, 44],
+        ]
+
+    def start(self, **kwargs):
+        engine = ContinuousBatchingEngine(self.model, Tokenizer(), **kwargs)
+        engine.start()
+        self.addCleanup(engine.stop)
+        return engine
+
+    def run_all(self, engine, requests):
+        async def run():
+            return await asyncio.gather(*(engine.generate(**request) for request in requests))
+        return asyncio.run(run())
+
+
+class ContinuousBatchingEngineTests(EngineTestCase):
+    def test_batched_greedy_output_matches_generate(self):
+        engine = self.start(max_batch_size=8)
+        # Different lengths, so every step runs on left-padded caches
+        lengths = [6, 3, 9]
+        results = self.run_all(engine, [
+            {"prompt_ids": prompt, "max_new_tokens": n, "temperature": 0}
+            for prompt, n in zip(self.prompts, lengths)
+        ])
+        for prompt, n, seq in zip(self.prompts, lengths, results):
+            self.assertEqual(seq.output_ids, greedy_reference(self.model, prompt, n))
+            self.assertEqual(seq.finish_reason, "length")
+            self.assertIsNone(seq.past_key_values)
+        self.assertEqual(engine.stats["sequences_completed"], 3)
+        self.assertEqual(engine.stats["tokens_generated"], sum(lengths))
+        self.assertGreater(engine.stats["max_batch_seen"], 1)
+
+    def test_batch_size_limit_queues_the_rest(self):
+        engine = self.start(max_batch_size=1)
+        results = self.run_all(engine, [
+            {"prompt_ids": prompt, "max_new_tokens": 4, "temperature": 0} for prompt in self.prompts
+        ])
+        self.assertEqual([seq.output_ids for seq in results],
+                         [greedy_reference(self.model, prompt, 4) for prompt in self.prompts])
+        self.assertEqual(engine.stats["max_batch_seen"], 1)
+
+    def test_eos_and_deadline_stop_a_sequence(self):
+        first = greedy_reference(self.model, self.prompts[0], 1)[0]
+        engine = ContinuousBatchingEngine(self.model, Tokenizer())
+        engine.eos_token_id = first
+        engine.start()
+        self.addCleanup(engine.stop)
+        stopped, timed_out = self.run_all(engine, [
+            {"prompt_ids": self.prompts[0], "max_new_tokens": 10, "temperature": 0},
+            {"prompt_ids": self.prompts[1], "max_new_tokens": 10, "temperature": 0, "deadline_s": 0},
+        ])
+        self.assertEqual((stopped.output_ids, stopped.finish_reason), ([first], "stop"))
+        self.assertEqual((len(timed_out.output_ids), timed_out.finish_reason), (1, "deadline"))
+
+    def test_sampling_respects_top_k(self):
+        engine = self.start()
+        seq = self.run_all(engine, [
+            {"prompt_ids": self.prompts[1], "max_new_tokens": 1, "temperature": 1.0, "top_k": 1},
+        ])[0]
+        self.assertEqual(seq.output_ids, greedy_reference(self.model, self.prompts[1], 1))
+
+    def test_cancelled_sequences_are_retired(self):
+        engine = self.start()
+        finished = threading.Event()
+        seq = Sequence(self.prompts[0], max_new_tokens=100, temperature=0, on_finish=lambda s: finished.set())
+        seq.cancelled = True
+        engine.submit(seq)
+        self.assertTrue(finished.wait(5))
+        self.assertEqual(seq.finish_reason, "cancelled")
+        self.assertEqual(seq.output_ids, [])
+
+
+def fake_cache(length: int, num_layers: int = 2) -> tuple:
+    """A tuple cache whose positions hold their own index, 8 bytes each per layer."""
+    positions = torch.arange(length, dtype=torch.float32).view(1, 1, length, 1)
+    return tuple((positions.clone(), positions.clone()) for _ in range(num_layers))
+
+
+class PrefixCacheTests(unittest.TestCase):
+    def test_longest_shared_prefix_is_sliced_out(self):
+        cache = PrefixCache(max_bytes=10_000, min_prefix_tokens=2)
+        cache.insert([1, 2, 3, 4, 5], fake_cache(5))
+        cache.insert([1, 2, 9], fake_cache(3))
+
+        reused, past = cache.lookup([1, 2, 3, 4, 7, 8])
+        self.assertEqual(reused, 4)
+        self.assertEqual(past[0][0].flatten().tolist(), [0, 1, 2, 3])
+        # At least one token is always left to prefill
+        self.assertEqual(cache.lookup([1, 2, 3, 4, 5])[0], 4)
+        self.assertEqual(cache.lookup([1, 7, 7]), (0, None))
+        self.assertEqual(cache.get_stats()["hits"], 2)
+        self.assertEqual(cache.get_stats()["reused_tokens"], 8)
+
+    def test_short_prompts_are_neither_cached_nor_matched(self):
+        cache = PrefixCache(max_bytes=10_000, min_prefix_tokens=4)
+        cache.insert([1, 2, 3], fake_cache(3))
+        self.assertEqual(len(cache), 0)
+        cache.insert([1, 2, 3, 4, 5], fake_cache(5))
+        self.assertEqual(cache.lookup([1, 2, 3, 9]), (0, None))
+
+    def test_extended_and_covered_prompts_are_not_kept_twice(self):
+        cache = PrefixCache(max_bytes=10_000, min_prefix_tokens=1)
+        cache.insert([1, 2], fake_cache(2))
+        cache.insert([1, 2, 3], fake_cache(3))
+        self.assertEqual(list(cache._entries), [(1, 2, 3)])
+        cache.insert([1, 2], fake_cache(2))
+        self.assertEqual(list(cache._entries), [(1, 2, 3)])
+        self.assertEqual(cache.current_bytes, cache_nbytes(fake_cache(3)))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        size = cache_nbytes(fake_cache(4))
+        cache = PrefixCache(max_bytes=2 * size, min_prefix_tokens=1)
+        cache.insert([1, 1, 1, 1], fake_cache(4))
+        cache.insert([2, 2, 2, 2], fake_cache(4))
+        cache.lookup([1, 1, 1, 1, 9])
+        cache.insert([3, 3, 3, 3], fake_cache(4))
+        self.assertEqual(set(cache._entries), {(1, 1, 1, 1), (3, 3, 3, 3)})
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+        self.assertEqual(cache.current_bytes, 2 * size)
+        # Evicted paths are pruned from the trie
+        self.assertNotIn(2, cache._root.children)
+
+    def test_entries_larger_than_the_budget_are_skipped(self):
+        cache = PrefixCache(max_bytes=cache_nbytes(fake_cache(4)), min_prefix_tokens=1)
+        cache.insert([1, 2, 3, 4, 5], fake_cache(5))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.current_bytes, 0)
+
+
+class PrefixCachedEngineTests(EngineTestCase):
+    def test_reused_prefix_gives_the_same_output(self):
+        cache = PrefixCache(max_bytes=10 ** 8, min_prefix_tokens=4)
+        engine = self.start(prefix_cache=cache)
+        system = [7, 21, 33, 4, 18, 9, 50, 2]
+        first_prompt, second_prompt = system + [11, 12], system + [40, 41, 42]
+
+        first, = self.run_all(engine, [{"prompt_ids": first_prompt, "max_new_tokens": 5, "temperature": 0}])
+        second, = self.run_all(engine, [{"prompt_ids": second_prompt, "max_new_tokens": 5, "temperature": 0}])
+        self.assertEqual(first.cached_prompt_tokens, 0)
+        self.assertEqual(second.cached_prompt_tokens, len(system))
+        self.assertEqual(second.output_ids, greedy_reference(self.model, second_prompt, 5))
+
+
+class SpeculativeDecodingTests(EngineTestCase):
+    def speculate(self, draft, **request):
+        engine = self.start(speculator=SpeculativeDecoder(draft, self.model, max_draft_tokens=4))
+        return engine, self.run_all(engine, [dict(request, num_draft_tokens=4)])[0]
+
+    def test_greedy_output_is_the_target_models(self):
+        engine, seq = self.speculate(tiny_model(seed=1, num_layers=1),
+                                     prompt_ids=self.prompts[0], max_new_tokens=12, temperature=0)
+        self.assertEqual(seq.output_ids, greedy_reference(self.model, self.prompts[0], 12))
+        stats = seq.speculative_stats()
+        self.assertGreater(stats["proposed"], 0)
+        self.assertLessEqual(stats["accepted"], stats["proposed"])
+        self.assertEqual(engine.stats["draft_tokens_proposed"], stats["proposed"])
+
+    def test_a_draft_that_agrees_is_always_accepted(self):
+        for temperature in (0, 1.0):
+            _, seq = self.speculate(self.model, prompt_ids=self.prompts[2], max_new_tokens=11,
+                                    temperature=temperature)
+            self.assertEqual(len(seq.output_ids), 11)
+            self.assertEqual(seq.finish_reason, "length")
+            # The prefill token, then two steps of four drafts and a bonus token
+            self.assertEqual(seq.speculative_stats()["acceptance_rate"], 1.0)
+            self.assertEqual(seq.draft_tokens_proposed, 8)
+
+    def test_speculation_needs_a_draft_model(self):
+        engine = self.start()
+        with self.assertRaisesRegex(ValueError, "no draft model"):
+            self.run_all(engine, [{"prompt_ids": [1, 2], "max_new_tokens": 2, "num_draft_tokens": 2}])
+
+
+class CodeGenerationServiceTests(unittest.TestCase):
+    def service(self, model_name, **kwargs):
+        service = CodeGenerationService(model_name, load_mode="lazy", prefix_cache_mb=0, **kwargs)
+        self.addCleanup(service.shutdown)
+        return service
+
+    def test_lazy_service_loads_on_first_request(self):
+        service = self.service(save_checkpoint(self), draft_model_name="")
+        self.assertEqual(service.status()["state"], "idle")
+        self.assertFalse(service.is_ready)
+
+        result = asyncio.run(service.generate_code("w1 w2 w3", max_new_tokens=4, temperature=0))
+        self.assertTrue(result["generated_code"].startswith("w1 w2 w3"))
+        self.assertEqual(result["usage"]["prompt_tokens"], 3)
+        status = service.status()
+        self.assertEqual((status["state"], status["ready"], status["error"]), ("ready", True, None))
+        self.assertEqual(service.estimate_nbytes(), service.nbytes())
+
+    def test_failed_load_is_reported(self):
+        empty = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, empty)
+        service = self.service(empty, draft_model_name="")
+        with self.assertRaisesRegex(RuntimeError, "Model failed to load"):
+            service.load()
+        self.assertEqual(service.status()["state"], "failed")
+        self.assertIsNotNone(service.status()["error"])
+
+    def test_failure_after_the_weights_load_is_reported(self):
+        service = self.service(save_checkpoint(self), draft_model_name=save_checkpoint(self, prefix="x"))
+        with self.assertRaisesRegex(RuntimeError, "does not share the tokenizer"):
+            asyncio.run(service.wait_until_ready(5))
+        status = service.status()
+        self.assertEqual((status["state"], status["ready"]), ("failed", False))
+        # Nothing that did load is kept
+        self.assertIsNone(service.model)
+        self.assertIsNone(service.engine)
+        self.assertEqual(service.loader.state, "idle")
+
+    def test_readiness_probe_reports_the_failure(self):
+        empty = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, empty)
+        pool = ModelPool(empty, max_bytes=10 ** 9, load_mode="lazy")
+        with self.assertRaises(RuntimeError):
+            pool.get().load()
+        with mock.patch("api.model_pool", pool):
+            client = TestClient(api.app)
+            self.assertEqual(client.get("/health/live").json(), {"status": "alive"})
+            response = client.get("/health/ready")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["status"], "failed")
+        self.assertEqual(response.json()["models"][empty]["state"], "failed")
+
+
+class ModelPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b = save_checkpoint(self), save_checkpoint(self, seed=1)
+
+    def pool(self, max_bytes=10 ** 9, **kwargs):
+        pool = ModelPool(self.a, max_bytes, allowed_models=[self.a, self.b], **kwargs)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def gate(self, service):
+        """Hold ``service``'s load until the returned event is set."""
+        release = threading.Event()
+        load = service.loader.load
+
+        def gated():
+            release.wait(10)
+            return load()
+        service.loader.load = gated
+        self.addCleanup(release.set)
+        return release
+
+    def test_concurrent_requests_load_a_model_once(self):
+        pool = self.pool(load_mode="lazy")
+        service = pool.get()
+        self.assertEqual(service.load_mode, "lazy")
+        self.assertFalse(service.is_ready)
+
+        async def run():
+            return await asyncio.gather(*(pool.acquire(timeout=10) for _ in range(3)))
+
+        with mock.patch.object(service, "estimate_nbytes", wraps=service.estimate_nbytes) as estimate:
+            services = asyncio.run(run())
+        self.assertEqual(services, [service] * 3)
+        estimate.assert_called_once()
+        self.assertEqual(pool.stats["loads"], 1)
+        self.assertEqual(pool.resident_bytes, service.nbytes())
+
+    def test_requests_during_a_load_do_not_make_room_again(self):
+        pool = self.pool(load_mode="lazy")
+        release = self.gate(pool.get())
+
+        async def run():
+            with mock.patch.object(pool, "_make_room", wraps=pool._make_room) as make_room:
+                for _ in range(2):
+                    with self.assertRaises(ModelLoadingError):
+                        await pool.acquire(timeout=0)
+                # The estimate holds the model's place in the budget meanwhile
+                self.assertEqual(pool.resident_bytes, pool.get().estimate_nbytes())
+                release.set()
+                await pool.acquire(timeout=10)
+            make_room.assert_called_once()
+
+        asyncio.run(run())
+        self.assertEqual(pool.stats["loads"], 1)
+
+    def test_least_recently_used_idle_models_are_evicted(self):
+        size = CodeGenerationService(self.a, load_mode="lazy").estimate_nbytes()
+        pool = self.pool(max_bytes=size * 3 // 2, load_mode="lazy")
+
+        async def run():
+            first = await pool.acquire(self.a, timeout=10)
+            await pool.acquire(self.b, timeout=10)
+            return first
+
+        first = asyncio.run(run())
+        self.assertEqual(list(pool._services), [self.b])
+        self.assertFalse(first.is_ready)
+        self.assertEqual(pool.stats["evictions"], 1)
+        self.assertLessEqual(pool.resident_bytes, pool.max_bytes)
+
+    def test_models_in_use_are_not_evicted(self):
+        size = CodeGenerationService(self.a, load_mode="lazy").estimate_nbytes()
+        pool = self.pool(max_bytes=size * 3 // 2, load_mode="lazy")
+
+        async def run():
+            async with pool.lease(self.a, timeout=10):
+                with self.assertLogs("model_pool", "WARNING") as logs:
+                    await pool.acquire(self.b, timeout=10)
+            return logs.output
+
+        self.assertIn("exceeds the pool budget", asyncio.run(run())[0])
+        self.assertEqual(set(pool._services), {self.a, self.b})
+        self.assertEqual(pool.stats["evictions"], 0)
+
+    def test_failed_load_is_accounted_again_on_retry(self):
+        empty = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, empty)
+        pool = ModelPool(empty, 10 ** 9, load_mode="lazy")
+
+        async def run():
+            for _ in range(2):
+                with self.assertRaises(RuntimeError):
+                    await pool.acquire(timeout=10)
+
+        asyncio.run(run())
+        self.assertEqual(pool.stats["loads"], 2)
+        self.assertEqual(pool.resident_bytes, 0)
+
+    def test_eager_pool_starts_the_default_model_at_startup(self):
+        pool = self.pool(load_mode="eager")
+        with mock.patch("api.model_pool", pool), TestClient(api.app) as client:
+            asyncio.run(pool.get().wait_until_ready(10))
+            response = client.get("/health/ready")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(pool.stats["loads"], 1)
+        self.assertEqual(response.json()["models"][self.a]["bytes"], pool.get().loader.estimate_nbytes())
+
+    def test_generate_answers_503_while_the_model_loads(self):
+        pool = self.pool(load_mode="lazy")
+        release = self.gate(pool.get())
+        client = TestClient(api.app)
+        with mock.patch("api.model_pool", pool), mock.patch("api.LOAD_WAIT_SECONDS", 0):
+            response = client.post("/generate", json={"prompt": "w1 w2", "max_new_tokens": 2, "model": "other"})
+            self.assertEqual(response.status_code, 400)
+
+            response = client.post("/generate", json={"prompt": "w1 w2", "max_new_tokens": 2})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers["Retry-After"], api.RETRY_AFTER_SECONDS)
+            self.assertFalse(response.json()["status"]["ready"])
+
+            release.set()
+            asyncio.run(pool.get().wait_until_ready(10))
+            response = client.post("/generate", json={"prompt": "w1 w2", "max_new_tokens": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["model"], self.a)
+
+
+
+DOCUMENT = json.dumps({
+    "files": [
+        {"path": "app/main.py", "content": "print(\"hi\")\n\tx = '\\u00e9'"},
+        {"path": "README.md", "content": ""},
+    ],
+    "dependencies": {"fastapi": ">=0.100", "uvicorn": ""},
+    "setup_instructions": ["pip install -r requirements.txt", "uvicorn app.main:app"],
+}, indent=2)
+
+
+class JsonSchemaMatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.matcher = JsonSchemaMatcher(PROJECT_STRUCTURE_SCHEMA)
+
+    def test_every_prefix_of_a_valid_document_is_accepted(self):
+        matcher = self.matcher
+        for i, ch in enumerate(DOCUMENT):
+            matcher = matcher.try_feed(ch)
+            self.assertIsNotNone(matcher, f"rejected at {i}: {DOCUMENT[:i + 1]!r}")
+            self.assertEqual(matcher.complete, i == len(DOCUMENT) - 1)
+        self.assertEqual(matcher.closing_suffix(), "")
+        self.assertIsNone(matcher.try_feed("x"))
+        self.assertIsNotNone(matcher.try_feed("\n"))
+
+    def test_try_feed_leaves_the_receiver_unchanged(self):
+        advanced = self.matcher.try_feed('{"files":[')
+        self.assertIsNotNone(advanced)
+        self.assertIsNotNone(self.matcher.try_feed('{'))
+        self.assertIsNone(advanced.try_feed('}'))
+
+    def test_closing_suffix_completes_every_prefix(self):
+        matcher = self.matcher
+        for i, ch in enumerate(DOCUMENT):
+            matcher = matcher.try_feed(ch)
+            text = DOCUMENT[:i + 1] + matcher.closing_suffix()
+            document = json.loads(text)
+            self.assertEqual(list(document), ["files", "dependencies", "setup_instructions"], text)
+            completed = self.matcher.try_feed(text)
+            self.assertTrue(completed is not None and completed.complete, text)
+
+    def test_rejects_invalid_continuations(self):
+        for text in [
+            '[',                                   # wrong root type
+            '{"dependencies"',                     # properties out of order
+            '{"file":',                            # unknown property
+            '{"files":[{"path":1',                 # number where a string belongs
+            '{"files":[{"path":"a\nb',             # raw control character in a string
+            '{"files":[{"path":"\\x',              # invalid escape
+            '{"files":[{"path":"\\u12g',           # invalid unicode escape
+            '{"files":[],}',                       # missing required properties
+            '{"files":[],"dependencies":{"a":[',   # map values are strings
+            '{"files":[,',                         # empty array item
+        ]:
+            with self.subTest(text=text):
+                self.assertIsNone(self.matcher.try_feed(text))
+
+    def test_whitespace_runs_are_bounded(self):
+        self.assertIsNotNone(self.matcher.try_feed(" " * MAX_WHITESPACE_RUN))
+        self.assertIsNone(self.matcher.try_feed(" " * (MAX_WHITESPACE_RUN + 1)))
+        self.assertIsNotNone(self.matcher.try_feed("{" + " " * MAX_WHITESPACE_RUN + '"'))
+        # Whitespace inside a string is content, not padding
+        self.assertIsNotNone(self.matcher.try_feed('{"files":[{"path":"' + " " * 100))
+
+
+class JsonConstraintTests(unittest.TestCase):
+    VOCABULARY = ['{}', '{"files":', '[]', ',"dependencies":', ',"setup_instructions":', '}', 'hello', '']
+    EOS = len(VOCABULARY)
+
+    def constraint(self):
+        return JsonConstraint(PROJECT_STRUCTURE_SCHEMA, lambda token_id: (self.VOCABULARY + [None])[token_id],
+                              self.EOS)
+
+    def test_greedy_selection_skips_invalid_tokens(self):
+        constraint = self.constraint()
+        # The model always prefers "hello", then the tokens in vocabulary order
+        logits = torch.tensor([-float(i) for i in range(len(self.VOCABULARY) + 1)])
+        logits[self.VOCABULARY.index('hello')] = 10.0
+        chosen = []
+        while not constraint.is_complete:
+            chosen.append(constraint.select(logits))
+        self.assertEqual(constraint.text, '{"files":[],"dependencies":{},"setup_instructions":[]}')
+        self.assertEqual(chosen, [1, 2, 3, 0, 4, 2, 5])
+        self.assertEqual(constraint.select(logits), self.EOS)
+        self.assertGreater(constraint.rejected_tokens, 0)
+        self.assertEqual(constraint.stats()["closing_suffix_chars"], 0)
+
+    def test_closing_suffix_of_partial_output(self):
+        constraint = self.constraint()
+        logits = torch.zeros(len(self.VOCABULARY) + 1)
+        logits[1] = 1.0
+        constraint.select(logits)
+        self.assertEqual(
+            json.loads(constraint.text + constraint.closing_suffix()),
+            {"files": [], "dependencies": {}, "setup_instructions": []}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
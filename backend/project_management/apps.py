@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ProjectManagementConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'project_management'
+
+    def ready(self):
+        # Keep the retrieval index in step with file writes
+        from . import signals  # noqa: F401
@@ -0,0 +1,240 @@
+"""
+Project archives: streaming export to tar/tar.gz/zip and import from them.
+
+Export runs tarfile/zipfile on a worker thread that writes into a bounded
+queue, so the response streams while the archive is being built and only
+a few chunks are ever held in memory, whatever the project's size. Import
+reads members one at a time from the uploaded file (which Django has
+already spooled to disk) and copies them in chunks.
+"""
+import os
+import queue
+import tarfile
+import threading
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .storage import safe_relative_path
+
+CHUNK_SIZE = 1024 * 1024
+
+FORMATS = {
+    'tar.gz': ('application/gzip', 'w|gz'),
+    'tar': ('application/x-tar', 'w|'),
+    'zip': ('application/zip', None),
+}
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _QueueWriter:
+    """Write-only, unseekable file object feeding a bounded queue"""
+
+    def __init__(self, chunks: queue.Queue, cancelled: threading.Event):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        if len(self.buffer) >= CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+        chunk, self.buffer = bytes(self.buffer), bytearray()
+        # Blocks while the client is behind, which is the backpressure
+        while True:
+            if self.cancelled.is_set():
+                raise _Cancelled()
+            try:
+                self.chunks.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+
+def _project_entries(root: Path, include_git: bool) -> Iterator[Tuple[Path, str]]:
+    for directory, dirnames, filenames in os.walk(root):
+        if not include_git and Path(directory) == root and '.git' in dirnames:
+            dirnames.remove('.git')
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = Path(directory) / filename
+            if path.is_symlink() or not path.is_file():
+                continue
+            yield path, path.relative_to(root).as_posix()
+
+
+def _write_archive(root: Path, fmt: str, include_git: bool, out: _QueueWriter) -> None:
+    if fmt == 'zip':
+        with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            for path, name in _project_entries(root, include_git):
+                archive.write(path, name)
+    else:
+        with tarfile.open(fileobj=out, mode=FORMATS[fmt][1], bufsize=CHUNK_SIZE) as archive:
+            for path, name in _project_entries(root, include_git):
+                archive.add(path, name, recursive=False)
+    out.flush()
+
+
+async def stream_project_archive(root: Path, fmt: str, include_git: bool = False):
+    """Async chunks of an archive of ``root``, built on a worker thread as they are sent"""
+    chunks = queue.Queue(maxsize=settings.PROJECT_ARCHIVE_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            _write_archive(root, fmt, include_git, _QueueWriter(chunks, cancelled))
+            item = done
+        except _Cancelled:
+            return
+        except Exception as e:
+            item = e
+        while not cancelled.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    threading.Thread(target=produce, name='project-archive', daemon=True).start()
+    get = sync_to_async(chunks.get, thread_sensitive=False)
+    try:
+        while True:
+            item = await get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Client gone or archive finished: release the producer either way,
+        # and any read still waiting on the queue
+        cancelled.set()
+        try:
+            chunks.put_nowait(done)
+        except queue.Full:
+            pass
+
+
+def _copy_member(source: BinaryIO, target: Path, limit: int) -> Tuple[int, Optional[bytes]]:
+    """
+    Copy a member to ``target`` in chunks. Returns its size and, when it is
+    no larger than PROJECT_IMPORT_MAX_TEXT_SIZE, its bytes.
+    """
+    size = 0
+    kept = bytearray()
+    keep = True
+    with open(target, 'wb') as f:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                raise ArchiveError("Archive expands past PROJECT_IMPORT_MAX_BYTES")
+            f.write(chunk)
+            if keep:
+                if size > settings.PROJECT_IMPORT_MAX_TEXT_SIZE:
+                    keep = False
+                    kept = bytearray()
+                else:
+                    kept += chunk
+    return size, bytes(kept) if keep else None
+
+
+def extract_archive(upload: BinaryIO, target: Path, strip_components: int = 0
+                    ) -> Iterator[Tuple[str, int, Optional[bytes]]]:
+    """
+    Extract a tar (any compression) or zip ``upload`` under ``target``, one
+    member at a time. Yields ``(path, size, data)`` per regular file, where
+    ``data`` is the content if it is small enough to be kept as text.
+    Links, devices, paths escaping ``target`` and members that clash with
+    each other on disk (a file ``a`` and a file ``a/b``) are rejected.
+    """
+    budget = settings.PROJECT_IMPORT_MAX_BYTES
+    files = 0
+    created = set()
+
+    def place(name: str) -> Optional[Tuple[str, Path]]:
+        parts = name.replace('\\', '/').split('/')
+        if len(parts) <= strip_components:
+            return None
+        path = safe_relative_path('/'.join(parts[strip_components:]))
+        destination = target / path
+        if destination.parent not in created:
+            try:
+                destination.parent.mkdir(parents=True, exist_ok=True)
+            except OSError as e:
+                raise ArchiveError(f"Cannot extract {name!r}: {e.strerror}")
+            created.add(destination.parent)
+        return path, destination
+
+    def copy(name: str, source: BinaryIO, destination: Path) -> Tuple[int, Optional[bytes]]:
+        try:
+            return _copy_member(source, destination, budget)
+        except OSError as e:
+            raise ArchiveError(f"Cannot extract {name!r}: {e.strerror}")
+
+    def counted(path):
+        nonlocal files
+        files += 1
+        if files > settings.PROJECT_IMPORT_MAX_FILES:
+            raise ArchiveError("Archive has more than PROJECT_IMPORT_MAX_FILES files")
+        return path
+
+    upload.seek(0)
+    if zipfile.is_zipfile(upload):
+        upload.seek(0)
+        with zipfile.ZipFile(upload) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                # Symlinks are stored as regular entries with S_IFLNK in the mode
+                if (info.external_attr >> 16) & 0o170000 not in (0, 0o100000):
+                    raise ArchiveError(f"Unsupported archive member: {info.filename!r}")
+                placed = place(info.filename)
+                if placed is None:
+                    continue
+                path, destination = placed
+                with archive.open(info) as source:
+                    size, data = copy(info.filename, source, destination)
+                budget -= size
+                yield counted(path), size, data
+        return
+
+    upload.seek(0)
+    try:
+        archive = tarfile.open(fileobj=upload, mode='r|*')
+    except tarfile.TarError:
+        raise ArchiveError("Upload is not a tar or zip archive")
+    with archive:
+        try:
+            for member in archive:
+                if member.isdir():
+                    continue
+                if not member.isfile():
+                    raise ArchiveError(f"Unsupported archive member: {member.name!r}")
+                placed = place(member.name)
+                if placed is None:
+                    continue
+                path, destination = placed
+                size, data = copy(member.name, archive.extractfile(member), destination)
+                budget -= size
+                yield counted(path), size, data
+        except tarfile.TarError as e:
+            raise ArchiveError(f"Corrupt archive: {e}")
@@ -0,0 +1,385 @@
+"""
+Write-behind buffer for editor autosaves.
+
+With ``ProjectSetting.auto_save`` on, the editor saves every open file every
+few seconds, and a save through ``update_project_file`` is a row lookup, a
+row write, a revision and a disk rewrite. Autosaves are instead acknowledged
+as soon as they are in the buffer, keyed by (project, path), so a file saved
+ten times between flushes is written once, with its last text. The buffer is
+flushed every AUTOSAVE_FLUSH_INTERVAL seconds, as soon as it holds
+AUTOSAVE_MAX_PENDING_FILES files or AUTOSAVE_MAX_PENDING_BYTES of text, and
+when the process exits. A flush writes each project's files in one
+transaction, each file in its own savepoint, and rewrites the files on disk
+only once that transaction has committed. A save that fails for good (its
+path is blocked by a directory, say) is dropped and logged; one that fails
+because the database is busy is retried by later flushes, up to
+AUTOSAVE_MAX_ATTEMPTS times.
+
+AUTOSAVE_BUFFER picks what an acknowledged autosave survives:
+
+- ``off`` (the default): nothing is buffered; autosaves are written before
+  they are acknowledged, like any other save.
+- ``memory``: held by the worker process that took it. A crash or a killed
+  restart loses up to one interval of autosaves (a clean shutdown flushes
+  them), and other processes cannot see or drop them, so it is refused
+  when WEB_CONCURRENCY runs more than one worker. For a single process
+  serving the whole site only.
+- ``redis``: a hash at REDIS_URL shared by every worker, so autosaves survive
+  a worker crash and are as durable as the Redis server's own persistence.
+  With AUTOSAVE_REDIS_REPLICAS set, an autosave is only acknowledged once
+  that many replicas have it; otherwise it is written through.
+
+Reads of a file see its buffered text. Explicit saves and deletes drop the
+path's buffered autosave first, waiting out a flush in progress, so a flush
+does not land on top of a newer explicit save. That holds only among the
+processes sharing the buffer: every worker with ``redis``, the one process
+with ``memory``.
+"""
+import atexit
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, close_old_connections, transaction
+
+from .models import Project
+from .services import project_service
+from .storage import check_writable, project_dir, safe_relative_path
+
+logger = logging.getLogger(__name__)
+
+AUTOSAVE_MESSAGE = 'Autosave'
+
+
+class PendingSave:
+    """The latest autosaved text of one file, not yet written"""
+
+    __slots__ = ('project_id', 'path', 'content', 'author_id', 'saved_at', 'attempts')
+
+    def __init__(self, project_id: int, path: str, content: str, author_id: int = None,
+                 saved_at: float = None, attempts: int = 0):
+        self.project_id = project_id
+        self.path = path
+        self.content = content
+        self.author_id = author_id
+        self.saved_at = time.time() if saved_at is None else saved_at
+        self.attempts = attempts
+
+    @property
+    def key(self) -> str:
+        return f'{self.project_id}:{self.path}'
+
+    def to_json(self) -> str:
+        return json.dumps({slot: getattr(self, slot) for slot in self.__slots__})
+
+    @classmethod
+    def from_json(cls, data) -> 'PendingSave':
+        return cls(**json.loads(data))
+
+    def to_dict(self) -> Dict:
+        return {
+            'project': self.project_id,
+            'path': self.path,
+            'saved_at': self.saved_at,
+        }
+
+
+class MemoryBuffer:
+    """Pending saves in this process"""
+
+    def __init__(self):
+        self._entries: Dict[str, PendingSave] = {}
+        self._flushing: Dict[str, PendingSave] = {}
+        self._bytes = 0
+        self._guard = threading.Lock()
+        self._flush_lock = threading.RLock()
+
+    def put(self, entry: PendingSave) -> Tuple[int, int]:
+        size = len(entry.content.encode('utf-8'))
+        with self._guard:
+            previous = self._entries.get(entry.key)
+            if previous is not None:
+                self._bytes -= len(previous.content.encode('utf-8'))
+            self._entries[entry.key] = entry
+            self._bytes += size
+            return len(self._entries), self._bytes
+
+    def get(self, key: str) -> Optional[PendingSave]:
+        with self._guard:
+            return self._entries.get(key) or self._flushing.get(key)
+
+    def holds(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def remove(self, key: str) -> None:
+        with self._guard:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= len(entry.content.encode('utf-8'))
+
+    def take(self) -> List[PendingSave]:
+        with self._guard:
+            self._flushing, self._entries = self._entries, {}
+            self._bytes = 0
+            return list(self._flushing.values())
+
+    def done(self) -> None:
+        with self._guard:
+            self._flushing = {}
+
+    def restore(self, entries: List[PendingSave]) -> None:
+        """Put back saves a flush could not write, unless newer ones arrived"""
+        with self._guard:
+            for entry in entries:
+                if entry.key not in self._entries:
+                    self._entries[entry.key] = entry
+                    self._bytes += len(entry.content.encode('utf-8'))
+
+    @contextmanager
+    def lock(self):
+        with self._flush_lock:
+            yield
+
+
+class RedisBuffer:
+    """
+    Pending saves in a Redis hash shared by every worker. A flush renames
+    the hash aside before writing it, so saves arriving meanwhile start a
+    new one; a hash left aside by a worker that died mid-flush is picked
+    up by the next flush.
+    """
+
+    ENTRIES = 'autosave:entries'
+    BYTES = 'autosave:bytes'
+    FLUSHING = 'autosave:flushing'
+    LOCK = 'autosave:lock'
+
+    def __init__(self, url: str):
+        import redis
+
+        self.redis = redis
+        self.client = redis.Redis.from_url(url)
+
+    def put(self, entry: PendingSave) -> Tuple[int, int]:
+        with self.client.pipeline() as pipe:
+            pipe.hset(self.ENTRIES, entry.key, entry.to_json())
+            pipe.hlen(self.ENTRIES)
+            pipe.incrby(self.BYTES, len(entry.content.encode('utf-8')))
+            _, files, size = pipe.execute()
+        replicas = settings.AUTOSAVE_REDIS_REPLICAS
+        if replicas and self.client.wait(replicas, settings.AUTOSAVE_REDIS_WAIT_MS) < replicas:
+            raise self.redis.RedisError(f"Autosave reached fewer than {replicas} replicas")
+        return files, size
+
+    def get(self, key: str) -> Optional[PendingSave]:
+        data = self.client.hget(self.ENTRIES, key) or self.client.hget(self.FLUSHING, key)
+        return PendingSave.from_json(data) if data else None
+
+    def holds(self, key: str) -> bool:
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.hexists(self.ENTRIES, key)
+            pipe.hexists(self.FLUSHING, key)
+            return any(pipe.execute())
+
+    def remove(self, key: str) -> None:
+        self.client.hdel(self.ENTRIES, key)
+
+    def take(self) -> List[PendingSave]:
+        if not self.client.exists(self.FLUSHING):
+            try:
+                with self.client.pipeline() as pipe:
+                    pipe.rename(self.ENTRIES, self.FLUSHING)
+                    pipe.delete(self.BYTES)
+                    pipe.execute()
+            except self.redis.ResponseError:
+                # No such key: nothing pending
+                return []
+        return [PendingSave.from_json(data) for data in self.client.hvals(self.FLUSHING)]
+
+    def done(self) -> None:
+        self.client.delete(self.FLUSHING)
+
+    def restore(self, entries: List[PendingSave]) -> None:
+        with self.client.pipeline() as pipe:
+            for entry in entries:
+                pipe.hsetnx(self.ENTRIES, entry.key, entry.to_json())
+            pipe.execute()
+
+    @contextmanager
+    def lock(self):
+        # Expires on its own if the holder dies mid-flush
+        with self.client.lock(self.LOCK, timeout=settings.AUTOSAVE_REDIS_LOCK_TIMEOUT,
+                              blocking_timeout=settings.AUTOSAVE_REDIS_LOCK_TIMEOUT):
+            yield
+
+
+class AutosaveBuffer:
+    def __init__(self):
+        self._backend = None
+        self._configured = False
+        self._thread: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if not self._configured:
+            mode = settings.AUTOSAVE_BUFFER
+            if mode == 'redis':
+                self._backend = RedisBuffer(settings.REDIS_URL)
+            elif mode == 'memory':
+                # Another worker could neither see these saves nor drop them
+                # before an explicit save, and would be overwritten by them
+                if settings.WEB_CONCURRENCY > 1:
+                    raise ImproperlyConfigured(
+                        "AUTOSAVE_BUFFER=memory needs a single worker process; use redis with WEB_CONCURRENCY > 1"
+                    )
+                self._backend = MemoryBuffer()
+            elif mode != 'off':
+                raise ValueError(f"Unknown AUTOSAVE_BUFFER: {mode!r}")
+            self._configured = True
+        return self._backend
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='autosave-flush', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(settings.AUTOSAVE_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Autosave flush failed: {e}")
+
+    def save(self, project: Project, file_path: str, content: str, author=None) -> Optional[PendingSave]:
+        """
+        Buffer an autosave. Returns the pending save, or None when it was not
+        buffered (buffering off, or the buffer did not take it) and the
+        caller should write it through. Saves that could never be written
+        raise before they are acknowledged: UnsafePathError for the path,
+        OSError for a path blocked on disk, UnicodeEncodeError for the text.
+        """
+        backend = self.backend
+        if backend is None:
+            return None
+        file_path = safe_relative_path(file_path)
+        check_writable(project_dir(project.id) / file_path)
+        # Lone surrogates survive JSON decoding but not a UTF-8 write
+        content.encode('utf-8')
+        entry = PendingSave(
+            project.id, file_path, content,
+            author_id=author.pk if author is not None else None
+        )
+        try:
+            files, size = backend.put(entry)
+        except Exception as e:
+            logger.warning(f"Autosave of {entry.key} not buffered: {e}")
+            return None
+        self._start()
+        if files >= settings.AUTOSAVE_MAX_PENDING_FILES or size >= settings.AUTOSAVE_MAX_PENDING_BYTES:
+            self._wake.set()
+        return entry
+
+    def pending(self, project_id: int, file_path: str) -> Optional[PendingSave]:
+        """The file's buffered autosave, if it has one"""
+        if self.backend is None:
+            return None
+        return self.backend.get(f'{project_id}:{file_path}')
+
+    def discard(self, project_id: int, file_path: str) -> None:
+        """Drop the file's buffered autosave; call before writing it any other way"""
+        backend = self.backend
+        if backend is None:
+            return
+        key = f'{project_id}:{safe_relative_path(file_path)}'
+        if not backend.holds(key):
+            return
+        # Waits for a flush that has already taken it to finish writing
+        with backend.lock():
+            backend.remove(key)
+
+    def flush(self) -> int:
+        """Write every buffered autosave; returns how many files were written"""
+        backend = self.backend
+        if backend is None:
+            return 0
+        written = 0
+        close_old_connections()
+        try:
+            with backend.lock():
+                entries = backend.take()
+                if not entries:
+                    return 0
+                by_project: Dict[int, List[PendingSave]] = {}
+                for entry in entries:
+                    by_project.setdefault(entry.project_id, []).append(entry)
+                authors = get_user_model().objects.in_bulk(
+                    {entry.author_id for entry in entries if entry.author_id is not None}
+                )
+                projects = Project.objects.in_bulk(list(by_project))
+                retry: List[PendingSave] = []
+                for project_id, batch in by_project.items():
+                    project = projects.get(project_id)
+                    if project is None:
+                        # Project deleted since: nothing to write to
+                        continue
+                    written += self._write_batch(project, batch, authors, retry)
+                if retry:
+                    backend.restore(retry)
+                backend.done()
+        finally:
+            close_old_connections()
+        if written:
+            logger.info(f"Flushed {written} autosaved files")
+        return written
+
+    def _write_batch(self, project: Project, batch: List[PendingSave], authors: Dict,
+                     retry: List[PendingSave]) -> int:
+        """Write one project's saves in one transaction; returns how many were written"""
+
+        def failed(entry: PendingSave, error: Exception) -> None:
+            entry.attempts += 1
+            if isinstance(error, OperationalError) and entry.attempts < settings.AUTOSAVE_MAX_ATTEMPTS:
+                retry.append(entry)
+            else:
+                logger.error(f"Dropping autosave of {entry.key} after {entry.attempts} attempt(s): {error}")
+
+        written = []
+        try:
+            with transaction.atomic():
+                for entry in batch:
+                    try:
+                        with transaction.atomic():
+                            project_service.update_project_file(
+                                project, entry.path, entry.content,
+                                author=authors.get(entry.author_id),
+                                message=AUTOSAVE_MESSAGE,
+                                write_on_commit=True
+                            )
+                        written.append(entry)
+                    except Exception as e:
+                        failed(entry, e)
+        except OperationalError as e:
+            # The commit itself failed: none of the batch was written
+            for entry in written:
+                failed(entry, e)
+            return 0
+        return len(written)
+
+
+autosave_buffer = AutosaveBuffer()
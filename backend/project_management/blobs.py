@@ -0,0 +1,232 @@
+"""
+Content-addressed blob storage for file contents and generated code.
+
+Blobs are keyed by the SHA-256 of their uncompressed bytes, so identical
+content (the same README in a hundred scaffolds) is stored once no matter
+how many rows point at it. Rows keep the hash; the text lives here.
+"""
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# First bytes of every zstd frame; anything else was stored uncompressed
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class BlobNotFoundError(KeyError):
+    pass
+
+
+def blob_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore:
+    """
+    Interface for blob backends. ``put`` must be idempotent: storing bytes
+    that are already present is a cheap no-op that returns the same hash,
+    apart from refreshing the blob's last-modified time so ``prune_blobs``
+    sees it as freshly used.
+    """
+
+    def put(self, data: bytes) -> str:
+        raise NotImplementedError
+
+    def open(self, digest: str) -> BinaryIO:
+        """A readable stream of the blob's uncompressed bytes"""
+        raise NotImplementedError
+
+    def exists(self, digest: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, digest: str, older_than: float = None) -> None:
+        """Remove the blob; with ``older_than``, only if it was last modified before that timestamp"""
+        raise NotImplementedError
+
+    def iter_blobs(self):
+        """``(digest, last modified timestamp)`` for every stored blob"""
+        raise NotImplementedError
+
+    def get(self, digest: str) -> bytes:
+        with self.open(digest) as stream:
+            return stream.read()
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Blobs as files under ``root``, fanned out by the first two bytes of the
+    hash (``ab/cd/abcd...``) and zstd-compressed when zstandard is
+    installed. Blobs that would not shrink are kept as they are.
+    """
+
+    def __init__(self, root, level: int = 3, min_compress_size: int = 256):
+        self.root = Path(root)
+        self.level = level
+        self.min_compress_size = min_compress_size
+        self._local = threading.local()
+        if zstandard is None:
+            logger.warning("zstandard is not installed; blobs will be stored uncompressed")
+
+    def _path(self, digest: str) -> Path:
+        if len(digest) != 64 or not all(c in '0123456789abcdef' for c in digest):
+            raise BlobNotFoundError(digest)
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def _compress(self, data: bytes) -> bytes:
+        if zstandard is None or len(data) < self.min_compress_size:
+            return data
+        # Compressor objects are not thread-safe; keep one per thread
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=self.level)
+        compressed = compressor.compress(data)
+        return compressed if len(compressed) < len(data) else data
+
+    def put(self, data: bytes) -> str:
+        digest = blob_hash(data)
+        path = self._path(digest)
+        try:
+            os.utime(path)
+            return digest
+        except FileNotFoundError:
+            pass
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._compress(data))
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        return digest
+
+    def open(self, digest: str) -> BinaryIO:
+        try:
+            f = open(self._path(digest), 'rb')
+        except FileNotFoundError:
+            raise BlobNotFoundError(digest)
+        if f.read(4) != ZSTD_MAGIC:
+            f.seek(0)
+            return f
+        f.seek(0)
+        if zstandard is None:
+            f.close()
+            raise RuntimeError(f"Blob {digest} is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+
+    def exists(self, digest: str) -> bool:
+        try:
+            return self._path(digest).exists()
+        except BlobNotFoundError:
+            return False
+
+    def delete(self, digest: str, older_than: float = None) -> None:
+        try:
+            path = self._path(digest)
+            if older_than is not None and path.stat().st_mtime >= older_than:
+                return
+            path.unlink()
+        except (FileNotFoundError, BlobNotFoundError):
+            pass
+
+    def iter_blobs(self):
+        if not self.root.exists():
+            return
+        for path in self.root.glob('??/??/*'):
+            if path.name.startswith('.tmp-'):
+                continue
+            try:
+                yield path.name, path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """The configured backend (BLOB_STORE_BACKEND), created on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = import_string(settings.BLOB_STORE_BACKEND)
+                _store = backend(**settings.BLOB_STORE_OPTIONS)
+    return _store
+
+
+def blob_text_property(inline_field: str, hash_field: str, doc: Optional[str] = None) -> property:
+    """
+    Model property for text that lives in the blob store.
+
+    Reading returns the row's inline column when it still holds text (rows
+    written before blob storage) and otherwise loads the blob named by
+    ``hash_field``, once per instance. Assigning only records the new text;
+    ``store_blob_text`` puts it in the store when the row is saved.
+    """
+    cache_name = f'_{inline_field}_text'
+
+    def fget(instance):
+        text = instance.__dict__.get(cache_name)
+        if text is None:
+            inline = getattr(instance, inline_field)
+            digest = getattr(instance, hash_field)
+            if inline or not digest:
+                text = inline or ''
+            else:
+                text = get_blob_store().get(digest).decode('utf-8')
+            instance.__dict__[cache_name] = text
+        return text
+
+    def fset(instance, value):
+        instance.__dict__[cache_name] = value or ''
+        instance.__dict__[cache_name + '_dirty'] = True
+
+    return property(fget, fset, doc=doc)
+
+
+def store_blob_text(instance, inline_field: str, hash_field: str) -> Optional[bytes]:
+    """
+    Put text assigned through a ``blob_text_property`` in the blob store,
+    point ``hash_field`` at it and clear the inline column. Returns the
+    encoded bytes, or None if nothing was assigned since the last save.
+    """
+    cache_name = f'_{inline_field}_text'
+    if not instance.__dict__.pop(cache_name + '_dirty', False):
+        return None
+    data = instance.__dict__[cache_name].encode('utf-8')
+    setattr(instance, hash_field, get_blob_store().put(data))
+    setattr(instance, inline_field, '')
+    return data
+
+
+def open_blob_text(instance, inline_field: str, hash_field: str) -> BinaryIO:
+    """A byte stream of the text, read from the blob without loading it all"""
+    cache_name = f'_{inline_field}_text'
+    text = instance.__dict__.get(cache_name)
+    if text is None:
+        text = getattr(instance, inline_field)
+        if not text and getattr(instance, hash_field):
+            return get_blob_store().open(getattr(instance, hash_field))
+    return io.BytesIO((text or '').encode('utf-8'))
@@ -0,0 +1,255 @@
+"""
+Read-only git queries for project repositories: status, diff and log.
+
+Everything shells out to git, whose index already records the stat data of
+every tracked file, so ``git status`` only re-hashes files whose mtime or
+size moved. On top of that:
+
+- repositories get ``core.untrackedCache``, so looking for untracked files
+  re-reads only directories whose mtime changed;
+- status results are cached per project until HEAD, the index or a file
+  written through the app changes, or GIT_STATUS_CACHE_TTL passes (for
+  edits made behind the app's back);
+- log pages are cached by the commit they start from: history reachable
+  from a commit never changes, so a page for a given HEAD stays valid;
+- diffs are streamed from git's stdout rather than collected.
+"""
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.conf import settings
+
+from .storage import project_dir, safe_relative_path
+
+GIT = os.getenv('GIT_PYTHON_GIT_EXECUTABLE', 'git')
+
+# Commit-ish arguments: no leading dash, so they can never be read as options
+REF_PATTERN = re.compile(r'^[A-Za-z0-9_.][A-Za-z0-9_./~^@{}-]*$')
+
+
+class RepositoryNotFound(Exception):
+    pass
+
+
+class GitQueryError(ValueError):
+    pass
+
+
+class _LRU:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_status_cache = _LRU(1000)
+_log_cache = _LRU(1000)
+_generations: Dict[int, int] = {}
+_configured = set()
+_lock = threading.Lock()
+
+
+def invalidate_status(project_id: int) -> None:
+    """Call after writing project files to disk, so the next status sees them"""
+    with _lock:
+        _generations[project_id] = _generations.get(project_id, 0) + 1
+
+
+def _repo_dir(project_id: int):
+    path = project_dir(project_id)
+    if not (path / '.git').is_dir():
+        raise RepositoryNotFound("Git repository not initialized")
+    return path
+
+
+def _run(path, *args: str) -> str:
+    result = subprocess.run(
+        [GIT, '-c', 'core.quotePath=false', *args],
+        cwd=path, capture_output=True
+    )
+    if result.returncode != 0:
+        raise GitQueryError(result.stderr.decode('utf-8', 'replace').strip() or f"git {args[0]} failed")
+    return result.stdout.decode('utf-8', 'replace')
+
+
+def _prepare(project_id: int):
+    path = _repo_dir(project_id)
+    if project_id not in _configured:
+        _run(path, 'config', 'core.untrackedCache', 'true')
+        _configured.add(project_id)
+    return path
+
+
+def _stat_key(path) -> tuple:
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+def _head_key(git_dir) -> tuple:
+    # HEAD itself, plus the branch ref it points at (loose or packed)
+    key = [_stat_key(git_dir / 'HEAD'), _stat_key(git_dir / 'packed-refs')]
+    try:
+        head = (git_dir / 'HEAD').read_text().strip()
+    except FileNotFoundError:
+        head = ''
+    if head.startswith('ref: '):
+        key.append(_stat_key(git_dir / head[5:]))
+    return tuple(key)
+
+
+def resolve(project_id: int, ref: str) -> Optional[str]:
+    """The commit ``ref`` names, or None if it names nothing"""
+    if not REF_PATTERN.match(ref):
+        raise GitQueryError(f"Invalid revision: {ref!r}")
+    try:
+        return _run(_repo_dir(project_id), 'rev-parse', '--verify', '--quiet', f'{ref}^{{commit}}').strip()
+    except GitQueryError:
+        return None
+
+
+def status(project_id: int) -> Dict[str, Any]:
+    path = _prepare(project_id)
+    git_dir = path / '.git'
+    fingerprint = (_head_key(git_dir), _stat_key(git_dir / 'index'), _generations.get(project_id, 0))
+    cached = _status_cache.get(project_id)
+    if cached is not None:
+        cached_fingerprint, cached_at, result = cached
+        if cached_fingerprint == fingerprint and time.monotonic() - cached_at < settings.GIT_STATUS_CACHE_TTL:
+            return result
+
+    output = _run(path, 'status', '--porcelain=v2', '--branch', '-z', '--untracked-files=all')
+    result = {
+        'branch': None, 'head': None,
+        'staged': [], 'modified': [], 'deleted': [], 'untracked': [], 'conflicted': [],
+    }
+    entries = iter(output.split('\0'))
+    for entry in entries:
+        if entry.startswith('# branch.oid '):
+            oid = entry[len('# branch.oid '):]
+            result['head'] = None if oid == '(initial)' else oid
+        elif entry.startswith('# branch.head '):
+            head = entry[len('# branch.head '):]
+            result['branch'] = None if head == '(detached)' else head
+        elif entry.startswith('? '):
+            result['untracked'].append(entry[2:])
+        elif entry.startswith('u '):
+            result['conflicted'].append(entry.split(' ', 10)[10])
+        elif entry.startswith(('1 ', '2 ')):
+            fields = entry.split(' ', 8 if entry[0] == '1' else 9)
+            file_path = fields[-1]
+            if entry[0] == '2':
+                next(entries, None)  # the rename's original path
+            index_state, tree_state = fields[1]
+            if index_state != '.':
+                result['staged'].append(file_path)
+            if tree_state == 'D':
+                result['deleted'].append(file_path)
+            elif tree_state != '.':
+                result['modified'].append(file_path)
+
+    # git status may have refreshed the index's stat data; key on what it left
+    fingerprint = (_head_key(git_dir), _stat_key(git_dir / 'index'), fingerprint[2])
+    _status_cache.put(project_id, (fingerprint, time.monotonic(), result))
+    return result
+
+
+class DiffStream:
+    """``git diff`` output as a readable stream; closing it stops git"""
+
+    def __init__(self, process: subprocess.Popen):
+        self.process = process
+
+    def read(self, size: int = -1) -> bytes:
+        return self.process.stdout.read(size)
+
+    def close(self) -> None:
+        self.process.stdout.close()
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+def open_diff(project_id: int, old: str = None, new: str = None, staged: bool = False,
+              paths: Iterable[str] = (), context: int = 3) -> DiffStream:
+    """
+    Like ``git diff``: with no revisions, the working tree against the index
+    (or the index against HEAD when ``staged``); with ``old``, the working
+    tree against it; with both, one commit against another.
+    """
+    path = _prepare(project_id)
+    args = ['diff', '--no-color', '--no-ext-diff', f'-U{int(context)}']
+    if staged:
+        args.append('--cached')
+    for ref in (old, new):
+        if ref is None:
+            continue
+        commit = resolve(project_id, ref)
+        if commit is None:
+            raise GitQueryError(f"Unknown revision: {ref!r}")
+        args.append(commit)
+    args.append('--')
+    args.extend(safe_relative_path(p) for p in paths)
+    process = subprocess.Popen(
+        [GIT, '-c', 'core.quotePath=false', *args],
+        cwd=path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    return DiffStream(process)
+
+
+def log(project_id: int, head: str = None, offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+    """
+    A page of history from ``head`` (default: HEAD), newest first. Pass
+    the returned ``head`` back with later offsets to page through the same
+    history even after new commits land.
+    """
+    path = _prepare(project_id)
+    commit = resolve(project_id, head or 'HEAD')
+    if commit is None:
+        if head:
+            raise GitQueryError(f"Unknown revision: {head!r}")
+        return {'head': None, 'commits': [], 'has_more': False}
+
+    key = (project_id, commit, offset, limit)
+    page = _log_cache.get(key)
+    if page is None:
+        output = _run(
+            path, 'log', '--name-only', '--no-renames',
+            '--format=%x1e%H%x1f%an%x1f%ae%x1f%aI%x1f%B%x1f',
+            f'--skip={int(offset)}', f'--max-count={int(limit) + 1}', commit, '--'
+        )
+        commits: List[Dict[str, Any]] = []
+        for record in output.split('\x1e')[1:]:
+            sha, author, email, date, message, files = record.split('\x1f', 5)
+            commits.append({
+                'hash': sha,
+                'author': author,
+                'email': email,
+                'date': date,
+                'message': message.strip(),
+                'files': [name for name in files.splitlines() if name],
+            })
+        page = {'head': commit, 'commits': commits[:limit], 'has_more': len(commits) > limit}
+        _log_cache.put(key, page)
+    return page
@@ -0,0 +1,264 @@
+"""
+Background git work for project repositories.
+
+Every repository gets one worker thread that owns its ``git.Repo`` handle,
+so operations on a repository never race each other for the index lock and
+the handle is opened once rather than per request. Commit requests that
+arrive while one is still waiting out GIT_COMMIT_DEBOUNCE are folded into
+it, so a burst of saves becomes a single commit. Workers close their repo
+and exit after GIT_WORKER_IDLE_TIMEOUT seconds without work.
+
+Job status lives in this process, for the last GIT_JOB_HISTORY jobs.
+"""
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import git
+from django.conf import settings
+
+from .storage import project_dir, safe_relative_path
+
+logger = logging.getLogger(__name__)
+
+
+class GitJob:
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    INIT = 'init'
+    COMMIT = 'commit'
+
+    def __init__(self, project_id: int, kind: str, remote_url: str = None):
+        self.id = uuid.uuid4().hex
+        self.project_id = project_id
+        self.kind = kind
+        self.remote_url = remote_url
+        self.paths: List[str] = []
+        self.messages: List[str] = []
+        self.author: Optional[git.Actor] = None
+        self.requests = 0
+        self.status = self.QUEUED
+        self.commit: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.last_requested_at = self.created_at
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._done = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    def add(self, paths: Iterable[str], message: str, author: Optional[git.Actor]) -> None:
+        for path in paths:
+            if path not in self.paths:
+                self.paths.append(path)
+        if message and message not in self.messages:
+            self.messages.append(message)
+        if author is not None:
+            self.author = author
+        self.requests += 1
+        self.last_requested_at = time.time()
+
+    def commit_message(self) -> str:
+        if len(self.messages) == 1:
+            return self.messages[0]
+        summary = f"Update {len(self.paths)} file{'s' if len(self.paths) != 1 else ''}"
+        if not self.messages:
+            return summary
+        return summary + "\n\n" + "\n".join(f"- {message}" for message in self.messages)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'project': self.project_id,
+            'kind': self.kind,
+            'status': self.status,
+            'paths': self.paths,
+            'requests': self.requests,
+            'commit': self.commit,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class RepoWorker:
+    """Runs one repository's jobs in order on its own thread"""
+
+    def __init__(self, manager: 'GitJobQueue', project_id: int):
+        self.manager = manager
+        self.project_id = project_id
+        self.path = project_dir(project_id)
+        self.jobs: 'queue.Queue[GitJob]' = queue.Queue()
+        # The commit job still inside its debounce window, if any
+        self.pending_commit: Optional[GitJob] = None
+        self._repo: Optional[git.Repo] = None
+        self.thread = threading.Thread(target=self._run, name=f'git-project-{project_id}', daemon=True)
+
+    def repo(self) -> git.Repo:
+        if self._repo is None:
+            self._repo = git.Repo(self.path)
+        return self._repo
+
+    def _close(self) -> None:
+        if self._repo is not None:
+            self._repo.close()
+            self._repo = None
+
+    def _run(self) -> None:
+        while True:
+            try:
+                job = self.jobs.get(timeout=settings.GIT_WORKER_IDLE_TIMEOUT)
+            except queue.Empty:
+                if self.manager._retire(self):
+                    self._close()
+                    return
+                continue
+
+            if job.kind == GitJob.COMMIT:
+                self._debounce(job)
+            with self.manager.slots:
+                self._execute(job)
+
+    def _debounce(self, job: GitJob) -> None:
+        # Wait for the saves to stop, but never hold a commit back longer
+        # than GIT_COMMIT_MAX_DELAY
+        while True:
+            with self.manager.lock:
+                now = time.time()
+                quiet_until = job.last_requested_at + settings.GIT_COMMIT_DEBOUNCE
+                deadline = job.created_at + settings.GIT_COMMIT_MAX_DELAY
+                wake = min(quiet_until, deadline)
+                if now >= wake:
+                    if self.pending_commit is job:
+                        self.pending_commit = None
+                    return
+            time.sleep(wake - now)
+
+    def _execute(self, job: GitJob) -> None:
+        job.status = GitJob.RUNNING
+        job.started_at = time.time()
+        try:
+            if job.kind == GitJob.INIT:
+                self._init(job)
+            else:
+                self._commit(job)
+            job.status = GitJob.SUCCEEDED
+        except Exception as e:
+            job.status = GitJob.FAILED
+            job.error = str(e)
+            logger.error(f"Git {job.kind} job {job.id} for project {self.project_id} failed: {e}")
+            # A handle that saw an error may hold stale state; reopen next time
+            self._close()
+        finally:
+            job.finished_at = time.time()
+            job._done.set()
+
+    def _init(self, job: GitJob) -> None:
+        self._close()
+        self.path.mkdir(parents=True, exist_ok=True)
+        repo = self._repo = git.Repo.init(self.path)
+        if job.remote_url:
+            if 'origin' in [remote.name for remote in repo.remotes]:
+                repo.remote('origin').set_url(job.remote_url)
+            else:
+                repo.create_remote('origin', job.remote_url)
+
+    def _commit(self, job: GitJob) -> None:
+        try:
+            repo = self.repo()
+        except (git.InvalidGitRepositoryError, git.NoSuchPathError):
+            raise ValueError("Git repository not initialized")
+        # One git call per kind of change for the whole batch
+        present = [path for path in job.paths if (self.path / path).exists()]
+        removed = [path for path in job.paths if path not in present]
+        if present:
+            repo.git.add('-A', '--', *present)
+        if removed:
+            repo.git.rm('--cached', '--ignore-unmatch', '-r', '-q', '--', *removed)
+        if not repo.is_dirty(index=True, working_tree=False, untracked_files=False):
+            return
+        commit = repo.index.commit(job.commit_message(), author=job.author, committer=job.author)
+        job.commit = commit.hexsha
+
+
+class GitJobQueue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(settings.GIT_MAX_CONCURRENT_JOBS)
+        self._workers: Dict[int, RepoWorker] = {}
+        self._jobs: 'OrderedDict[str, GitJob]' = OrderedDict()
+
+    def _worker(self, project_id: int) -> RepoWorker:
+        worker = self._workers.get(project_id)
+        if worker is None:
+            worker = self._workers[project_id] = RepoWorker(self, project_id)
+            worker.thread.start()
+        return worker
+
+    def _retire(self, worker: RepoWorker) -> bool:
+        """Drop an idle worker, unless a job arrived while it was deciding to exit"""
+        with self.lock:
+            if not worker.jobs.empty():
+                return False
+            if self._workers.get(worker.project_id) is worker:
+                del self._workers[worker.project_id]
+            return True
+
+    def _track(self, job: GitJob) -> None:
+        self._jobs[job.id] = job
+        while len(self._jobs) > settings.GIT_JOB_HISTORY:
+            self._jobs.popitem(last=False)
+
+    def submit_init(self, project_id: int, remote_url: str = None) -> GitJob:
+        job = GitJob(project_id, GitJob.INIT, remote_url=remote_url)
+        job.requests = 1
+        with self.lock:
+            self._track(job)
+            self._worker(project_id).jobs.put(job)
+        return job
+
+    def submit_commit(self, project_id: int, paths: Iterable[str], message: str = '', author=None) -> GitJob:
+        """
+        Queue a commit of ``paths``. Returns the job that will make it, which
+        is shared with any other requests landing in the same debounce window.
+        """
+        paths = [safe_relative_path(path) for path in paths]
+        actor = None
+        if author is not None:
+            # Actor(name, None) would be written as 'Name <None>'
+            actor = git.Actor(author.get_full_name() or author.username, author.email or '')
+        with self.lock:
+            worker = self._worker(project_id)
+            job = worker.pending_commit
+            if job is None:
+                job = worker.pending_commit = GitJob(project_id, GitJob.COMMIT)
+                self._track(job)
+                worker.jobs.put(job)
+            job.add(paths, message, actor)
+        return job
+
+    def get(self, job_id: str) -> Optional[GitJob]:
+        with self.lock:
+            return self._jobs.get(job_id)
+
+    def jobs_for(self, project_id: int) -> List[GitJob]:
+        """The project's known jobs, newest first"""
+        with self.lock:
+            return [job for job in reversed(self._jobs.values()) if job.project_id == project_id]
+
+
+git_jobs = GitJobQueue()
@@ -0,0 +1,216 @@
+"""
+Revision log for project files.
+
+Deltas are line based. A delta is a list of operations that rebuild a
+revision from the one before it: ``[start, end]`` copies that slice of the
+previous revision's lines, and a string inserts new text. Lines keep their
+line endings, so joining the result reproduces the text exactly.
+"""
+import difflib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Union
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from .blobs import blob_hash, get_blob_store
+from .models import FileRevision, ProjectFile
+
+Op = Union[List[int], str]
+
+
+def line_ops(old_lines: List[str], new_lines: List[str]) -> List[Op]:
+    """Operations that turn ``old_lines`` into ``new_lines``."""
+    ops: List[Op] = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif tag in ('replace', 'insert'):
+            ops.append(''.join(new_lines[j1:j2]))
+    return ops
+
+
+def apply_ops(old_lines: List[str], ops: List[Op]) -> List[str]:
+    new_lines: List[str] = []
+    for op in ops:
+        if isinstance(op, str):
+            new_lines.extend(op.splitlines(keepends=True))
+        else:
+            new_lines.extend(old_lines[op[0]:op[1]])
+    return new_lines
+
+
+def ops_size(ops: List[Op]) -> int:
+    """Rough stored size of a delta, for deciding when a snapshot is cheaper"""
+    return sum(len(op.encode('utf-8')) if isinstance(op, str) else 8 for op in ops)
+
+
+class RevisionCache:
+    """Recently rebuilt revisions, so undo and diff after an edit skip the delta chain"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def put(self, key, text: str) -> None:
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+revision_cache = RevisionCache()
+
+
+def record_revision(project_file: ProjectFile, previous_hash: str = '', author=None,
+                    message: str = '') -> Optional[FileRevision]:
+    """
+    Append the file's current content to its history. A file that predates
+    the log gets its previous content recorded first, as revision 1.
+    Returns None when the content did not change.
+    """
+    with transaction.atomic():
+        # Serializes concurrent saves of one file on databases with row locks
+        list(ProjectFile.objects.select_for_update().filter(pk=project_file.pk).values_list('pk'))
+        latest = project_file.revisions.order_by('-number').only(
+            'number', 'kind', 'content_hash'
+        ).first()
+
+        if latest is None and previous_hash and previous_hash != project_file.content_hash:
+            store = get_blob_store()
+            if store.exists(previous_hash):
+                latest = FileRevision.objects.create(
+                    project_file=project_file,
+                    number=1,
+                    kind=FileRevision.SNAPSHOT,
+                    content_hash=previous_hash,
+                    size=len(store.get(previous_hash)),
+                    message='Before revision history'
+                )
+
+        if latest is not None and latest.content_hash == project_file.content_hash:
+            return None
+
+        number = latest.number + 1 if latest else 1
+        text = project_file.content
+        kind = FileRevision.SNAPSHOT
+        delta = None
+        if latest is not None:
+            last_snapshot = project_file.revisions.filter(kind=FileRevision.SNAPSHOT).aggregate(
+                number=Max('number')
+            )['number'] or 0
+            if number - last_snapshot < settings.REVISION_SNAPSHOT_INTERVAL:
+                previous = revision_text(project_file, latest.number)
+                ops = line_ops(previous.splitlines(keepends=True), text.splitlines(keepends=True))
+                # A delta that rewrites most of the file costs more than a snapshot
+                if ops_size(ops) <= settings.REVISION_DELTA_MAX_RATIO * max(project_file.size, 1):
+                    kind = FileRevision.DELTA
+                    delta = ops
+
+        revision = FileRevision.objects.create(
+            project_file=project_file,
+            number=number,
+            kind=kind,
+            content_hash=project_file.content_hash,
+            size=project_file.size,
+            delta=delta,
+            author=author,
+            message=message
+        )
+    revision_cache.put((project_file.pk, number), text)
+    return revision
+
+
+def revision_text(project_file: ProjectFile, number: int) -> str:
+    """
+    The file's text at revision ``number``: the nearest snapshot at or
+    before it, plus at most REVISION_SNAPSHOT_INTERVAL - 1 deltas.
+    """
+    key = (project_file.pk, number)
+    text = revision_cache.get(key)
+    if text is not None:
+        return text
+
+    revisions = project_file.revisions
+    snapshot = revisions.filter(kind=FileRevision.SNAPSHOT, number__lte=number).aggregate(
+        number=Max('number')
+    )['number']
+    if snapshot is None:
+        raise FileRevision.DoesNotExist(f"No revision {number} for file {project_file.pk}")
+    chain = list(revisions.filter(number__gte=snapshot, number__lte=number).order_by('number'))
+    if not chain or chain[-1].number != number:
+        raise FileRevision.DoesNotExist(f"No revision {number} for file {project_file.pk}")
+
+    store = get_blob_store()
+    lines = store.get(chain[0].content_hash).decode('utf-8').splitlines(keepends=True)
+    for revision in chain[1:]:
+        lines = apply_ops(lines, revision.delta)
+    text = ''.join(lines)
+    if blob_hash(text.encode('utf-8')) != chain[-1].content_hash:
+        raise ValueError(f"Revision {number} of file {project_file.pk} does not match its hash")
+    revision_cache.put(key, text)
+    return text
+
+
+def diff_revisions(project_file: ProjectFile, old: int, new: int, context: int = 3) -> str:
+    """Unified diff between two revisions"""
+    old_lines = revision_text(project_file, old).splitlines(keepends=True)
+    new_lines = revision_text(project_file, new).splitlines(keepends=True)
+    return ''.join(difflib.unified_diff(
+        old_lines, new_lines,
+        fromfile=f"{project_file.file_path}@{old}",
+        tofile=f"{project_file.file_path}@{new}",
+        n=context
+    ))
+
+
+def blame(project_file: ProjectFile, number: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    For every line of revision ``number`` (default: latest), the revision
+    that last changed it. Deltas already say which lines were copied, so
+    only snapshots need diffing against their predecessor.
+    """
+    revisions = project_file.revisions.select_related('author').order_by('number')
+    if number is not None:
+        revisions = revisions.filter(number__lte=number)
+
+    store = get_blob_store()
+    lines: List[str] = []
+    origins: List[FileRevision] = []
+    for revision in revisions.iterator():
+        if revision.kind == FileRevision.SNAPSHOT:
+            new_lines = store.get(revision.content_hash).decode('utf-8').splitlines(keepends=True)
+            ops = line_ops(lines, new_lines)
+        else:
+            ops = revision.delta
+        new_origins: List[FileRevision] = []
+        for op in ops:
+            if isinstance(op, str):
+                new_origins.extend([revision] * len(op.splitlines()))
+            else:
+                new_origins.extend(origins[op[0]:op[1]])
+        lines = apply_ops(lines, ops)
+        origins = new_origins
+
+    return [
+        {
+            'line': i + 1,
+            'revision': origin.number,
+            'author': origin.author.username if origin.author else None,
+            'created_at': origin.created_at,
+            'text': text.rstrip('\r\n'),
+        }
+        for i, (text, origin) in enumerate(zip(lines, origins))
+    ]
@@ -0,0 +1,88 @@
+"""Time project ingestion: per-file writes and INSERTs vs the bulk path.
+
+The per-file baseline mirrors the old create_project_with_ai loop (one
+``open().write()`` and one ``ProjectFile.objects.create`` per file, in
+autocommit mode); the bulk path is ``ProjectService.ingest_project``.
+Everything runs against a temporary PROJECTS_ROOT and the rows are deleted
+afterwards:
+
+    python manage.py benchmark_ingest --sizes 10 100 1000
+"""
+import os
+import tempfile
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from project_management.models import Project, ProjectFile
+from project_management.services import ProjectService
+from project_management.storage import project_dir
+
+
+def synthetic_files(count, size):
+    body = ("x = 1\n" * (size // 6 + 1))[:size]
+    return [
+        {'path': f"src/pkg{i % 20}/module_{i}.py", 'content': f"# module {i}\n{body}"}
+        for i in range(count)
+    ]
+
+
+def ingest_per_file(owner, files):
+    project = Project.objects.create(
+        name='benchmark', description='', programming_language='python', owner=owner
+    )
+    root = project_dir(project.id)
+    for file_info in files:
+        file_path = os.path.join(root, file_info['path'])
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as f:
+            f.write(file_info['content'])
+        ProjectFile.objects.create(
+            project=project,
+            file_path=file_info['path'],
+            content=file_info['content'],
+            language='python'
+        )
+    return project
+
+
+def ingest_bulk(owner, files):
+    return ProjectService.ingest_project(
+        name='benchmark', description='', language='python', files=files, owner=owner
+    )
+
+
+class Command(BaseCommand):
+    help = __doc__.splitlines()[0]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+        parser.add_argument('--file-size', type=int, default=2048, help='bytes per file')
+        parser.add_argument('--repeat', type=int, default=3, help='best of N runs')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        owner, _ = User.objects.get_or_create(
+            username='benchmark-ingest', defaults={'email': 'benchmark-ingest@localhost'}
+        )
+        self.stdout.write(f"{'files':>6} {'per-file ms':>12} {'bulk ms':>10} {'speedup':>8}")
+        try:
+            with tempfile.TemporaryDirectory() as root, override_settings(PROJECTS_ROOT=root):
+                for count in options['sizes']:
+                    files = synthetic_files(count, options['file_size'])
+                    best = {}
+                    for name, ingest in (('per_file', ingest_per_file), ('bulk', ingest_bulk)):
+                        for _ in range(options['repeat']):
+                            started = time.perf_counter()
+                            project = ingest(owner, files)
+                            elapsed = time.perf_counter() - started
+                            best[name] = min(best.get(name, elapsed), elapsed)
+                            project.delete()
+                    self.stdout.write(
+                        f"{count:>6} {best['per_file'] * 1000:>12.1f} {best['bulk'] * 1000:>10.1f} "
+                        f"{best['per_file'] / best['bulk']:>7.1f}x"
+                    )
+        finally:
+            owner.delete()
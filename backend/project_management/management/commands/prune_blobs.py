@@ -0,0 +1,48 @@
+"""Delete blobs that no file, revision snapshot or generation points at.
+
+Blobs are shared by hash and never removed when a row changes, so old
+file contents accumulate until this runs. Blobs younger than the grace
+period are kept, since a save may have stored its blob but not yet
+committed the row that references it. Storing a blob that already exists
+refreshes its mtime, so that holds for old blobs a save reuses as well:
+
+    python manage.py prune_blobs --grace-hours 24 --dry-run
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from code_generation.models import CodeGeneration
+from project_management.blobs import get_blob_store
+from project_management.models import FileRevision, ProjectFile
+
+
+class Command(BaseCommand):
+    help = "Delete unreferenced blobs from the blob store"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        # Listed before the referenced set is read, and re-checked against
+        # the cutoff at deletion: a blob stored or reused (put refreshes
+        # its mtime) after the listing is never deleted
+        cutoff = time.time() - options['grace_hours'] * 3600
+        candidates = [digest for digest, mtime in get_blob_store().iter_blobs() if mtime < cutoff]
+
+        referenced = set(ProjectFile.objects.exclude(content_hash='').values_list('content_hash', flat=True))
+        # Delta revisions are rebuilt from their snapshot, not their own hash
+        referenced.update(
+            FileRevision.objects.filter(kind=FileRevision.SNAPSHOT).values_list('content_hash', flat=True)
+        )
+        referenced.update(CodeGeneration.objects.exclude(code_hash='').values_list('code_hash', flat=True))
+
+        store = get_blob_store()
+        unreferenced = [digest for digest in candidates if digest not in referenced]
+        if not options['dry_run']:
+            for digest in unreferenced:
+                store.delete(digest, older_than=cutoff)
+
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(f"{verb} {len(unreferenced)} of {len(candidates)} blobs older than the grace period")
@@ -0,0 +1,82 @@
+"""Bring ProjectFile rows in line with the project directories on disk.
+
+One pass over every project (or the ``--project`` ids given) by default.
+With ``--loop`` it keeps running: a full pass every RECONCILE_INTERVAL
+seconds and, when watchfiles is available (uvicorn[standard] installs
+it) and RECONCILE_WATCH is on, a pass over any project whose directory
+reports a change in between:
+
+    python manage.py reconcile_projects --loop
+"""
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from project_management.models import Project
+from project_management.reconcile import project_id_for_path, reconcile_project
+
+try:
+    from watchfiles import watch
+except ImportError:
+    watch = None
+
+# How long a burst of changes (a checkout, a build) is gathered before
+# the projects it touched are rescanned
+SETTLE_MILLISECONDS = 1000
+
+
+class Command(BaseCommand):
+    help = "Reconcile project file rows with the files on disk"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, action='append', dest='projects')
+        parser.add_argument('--loop', action='store_true')
+        parser.add_argument('--interval', type=float, default=None)
+        parser.add_argument('--max-files-per-second', type=float, default=None)
+
+    def handle(self, *args, **options):
+        self.rate = options['max_files_per_second']
+        projects = options['projects']
+        if not options['loop']:
+            self.sweep(projects)
+            return
+
+        interval = options['interval'] or settings.RECONCILE_INTERVAL
+        self.sweep(projects)
+        next_sweep = time.monotonic() + interval
+
+        if not settings.RECONCILE_WATCH or watch is None:
+            while True:
+                time.sleep(max(next_sweep - time.monotonic(), 0))
+                self.sweep(projects)
+                next_sweep = time.monotonic() + interval
+
+        root = Path(settings.PROJECTS_ROOT)
+        root.mkdir(parents=True, exist_ok=True)
+        self.stdout.write(f"Watching {root}")
+        # Wakes at least every few seconds, changes or not, to keep the schedule
+        for changes in watch(root, debounce=SETTLE_MILLISECONDS, rust_timeout=5000, yield_on_timeout=True):
+            if time.monotonic() >= next_sweep:
+                self.sweep(projects)
+                next_sweep = time.monotonic() + interval
+                continue
+            ids = {project_id_for_path(path) for _, path in changes} - {None}
+            if projects:
+                ids &= set(projects)
+            if ids:
+                self.sweep(sorted(ids))
+
+    def sweep(self, project_ids=None):
+        queryset = Project.objects.order_by('id')
+        if project_ids:
+            queryset = queryset.filter(id__in=project_ids)
+        for project in queryset.iterator():
+            try:
+                counts = reconcile_project(project, self.rate)
+            except Exception as e:
+                self.stderr.write(f"Project {project.id}: {e}")
+                continue
+            if any(counts[key] for key in ('changed', 'added', 'deleted', 'restored')):
+                self.stdout.write(f"Project {project.id}: {counts}")
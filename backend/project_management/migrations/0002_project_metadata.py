@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project_management', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='metadata',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.0.2 on 2026-10-19 19:25
+
+import hashlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_digests(apps, schema_editor):
+    ProjectFile = apps.get_model('project_management', 'ProjectFile')
+    batch = []
+    for project_file in ProjectFile.objects.only('id', 'content').iterator(chunk_size=500):
+        data = (project_file.content or '').encode('utf-8')
+        project_file.size = len(data)
+        project_file.content_hash = hashlib.sha256(data).hexdigest()
+        batch.append(project_file)
+        if len(batch) >= 500:
+            ProjectFile.objects.bulk_update(batch, ['size', 'content_hash'])
+            batch = []
+    if batch:
+        ProjectFile.objects.bulk_update(batch, ['size', 'content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project_management', '0002_project_metadata'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectfile',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='projectfile',
+            name='size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='projectfile',
+            index=models.Index(fields=['project', 'file_path'], name='project_man_project_828b16_idx'),
+        ),
+        migrations.RunPython(backfill_digests, migrations.RunPython.noop),
+    ]
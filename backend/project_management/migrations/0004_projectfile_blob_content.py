@@ -0,0 +1,66 @@
+# Generated by Django 5.0.2 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+def move_content_to_blobs(apps, schema_editor):
+    from project_management.blobs import get_blob_store
+
+    ProjectFile = apps.get_model('project_management', 'ProjectFile')
+    store = get_blob_store()
+    batch = []
+    queryset = ProjectFile.objects.exclude(inline_content='').only('id', 'inline_content')
+    for project_file in queryset.iterator(chunk_size=500):
+        data = project_file.inline_content.encode('utf-8')
+        project_file.content_hash = store.put(data)
+        project_file.size = len(data)
+        project_file.inline_content = ''
+        batch.append(project_file)
+        if len(batch) >= 500:
+            ProjectFile.objects.bulk_update(batch, ['inline_content', 'content_hash', 'size'])
+            batch = []
+    if batch:
+        ProjectFile.objects.bulk_update(batch, ['inline_content', 'content_hash', 'size'])
+
+
+def restore_inline_content(apps, schema_editor):
+    from project_management.blobs import get_blob_store
+
+    ProjectFile = apps.get_model('project_management', 'ProjectFile')
+    store = get_blob_store()
+    batch = []
+    queryset = ProjectFile.objects.filter(inline_content='').exclude(content_hash='').only('id', 'content_hash')
+    for project_file in queryset.iterator(chunk_size=500):
+        project_file.inline_content = store.get(project_file.content_hash).decode('utf-8')
+        batch.append(project_file)
+        if len(batch) >= 500:
+            ProjectFile.objects.bulk_update(batch, ['inline_content'])
+            batch = []
+    if batch:
+        ProjectFile.objects.bulk_update(batch, ['inline_content'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project_management', '0003_projectfile_digest'),
+    ]
+
+    operations = [
+        # Same column, new attribute name: ``content`` is now a property
+        # backed by the blob store
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveField(
+                    model_name='projectfile',
+                    name='content',
+                ),
+                migrations.AddField(
+                    model_name='projectfile',
+                    name='inline_content',
+                    field=models.TextField(blank=True, db_column='content', default=''),
+                ),
+            ],
+        ),
+        migrations.RunPython(move_content_to_blobs, restore_inline_content),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.2 on 2026-10-19 19:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project_management', '0004_projectfile_blob_content'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('kind', models.CharField(choices=[('snapshot', 'Snapshot'), ('delta', 'Delta')], max_length=8)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('delta', models.JSONField(blank=True, null=True)),
+                ('message', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('project_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='project_management.projectfile')),
+            ],
+            options={
+                'ordering': ['project_file', 'number'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='filerevision',
+            constraint=models.UniqueConstraint(fields=('project_file', 'number'), name='unique_file_revision_number'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-19 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project_management', '0005_filerevision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectfile',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='projectfile',
+            name='disk_mtime_ns',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
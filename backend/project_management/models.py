@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from .blobs import blob_text_property, open_blob_text, store_blob_text
 
 # Create your models here.
 
@@ -11,6 +12,8 @@ class Project(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     git_repo_url = models.URLField(blank=True, null=True)
     programming_language = models.CharField(max_length=50)
+    # Dependencies and setup instructions from AI-generated scaffolds
+    metadata = models.JSONField(default=dict, blank=True)
     
     def __str__(self):
         return self.name
@@ -18,14 +21,87 @@ class Project(models.Model):
 class ProjectFile(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
     file_path = models.CharField(max_length=500)
-    content = models.TextField()
+    # Only rows written before blob storage still hold their text here
+    inline_content = models.TextField(db_column='content', blank=True, default='')
+    # Size of the UTF-8 content and its sha256, which is also its blob key
+    size = models.PositiveIntegerField(default=0)
+    content_hash = models.CharField(max_length=64, blank=True)
     language = models.CharField(max_length=50)
     last_modified = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
+    # mtime of the file on disk when the row last matched it; the reconciler
+    # only re-reads files whose mtime or size moved
+    disk_mtime_ns = models.BigIntegerField(null=True, blank=True)
+    # Set by the reconciler when the file disappears from disk
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    content = blob_text_property('inline_content', 'content_hash', doc="The file's text, loaded from the blob store")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'file_path']),
+        ]
 
     def __str__(self):
         return f"{self.project.name} - {self.file_path}"
 
+    def store_content(self):
+        """Put newly assigned content in the blob store; safe to call from worker threads"""
+        data = store_blob_text(self, 'inline_content', 'content_hash')
+        if data is not None:
+            self.size = len(data)
+        return data
+
+    def open_content(self):
+        """The content as a byte stream, read from the blob in pieces"""
+        return open_blob_text(self, 'inline_content', 'content_hash')
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'inline_content', 'size', 'content_hash'} - {'content'}
+        # Read by the post_save handler that appends to the revision log
+        self._previous_content_hash = self.content_hash
+        self._content_changed = self.store_content() is not None
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+class FileRevision(models.Model):
+    """
+    One entry in a file's append-only history.
+
+    Snapshots point at the blob holding the full text; deltas hold line
+    operations against the previous revision. A snapshot is taken at least
+    every REVISION_SNAPSHOT_INTERVAL revisions, which bounds how many deltas
+    rebuilding any revision has to apply.
+    """
+    SNAPSHOT = 'snapshot'
+    DELTA = 'delta'
+    KIND_CHOICES = [
+        (SNAPSHOT, 'Snapshot'),
+        (DELTA, 'Delta'),
+    ]
+
+    project_file = models.ForeignKey(ProjectFile, on_delete=models.CASCADE, related_name='revisions')
+    number = models.PositiveIntegerField()
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    # sha256 of the full text at this revision; the blob key for snapshots
+    content_hash = models.CharField(max_length=64)
+    size = models.PositiveIntegerField(default=0)
+    delta = models.JSONField(null=True, blank=True)
+    author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    message = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['project_file', 'number']
+        constraints = [
+            models.UniqueConstraint(fields=['project_file', 'number'], name='unique_file_revision_number'),
+        ]
+
+    def __str__(self):
+        return f"{self.project_file_id} r{self.number} ({self.kind})"
+
 class ProjectSetting(models.Model):
     project = models.OneToOneField(Project, on_delete=models.CASCADE)
     theme = models.CharField(max_length=50, default='default')
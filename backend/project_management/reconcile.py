@@ -0,0 +1,290 @@
+"""
+Keeps ProjectFile rows in step with the files under PROJECTS_ROOT.
+
+Files change behind the rows' backs: through ``filesystem.views.write_file``,
+git checkouts, or editors outside the app. A pass over a project stats
+every file and compares mtime and size with what the row last saw; only
+files where those moved are read and hashed, and only rows whose content
+actually differs are written, a batch at a time. Files that disappeared
+are marked deleted rather than dropped, and come back if the file does.
+
+Passes are rate-limited to RECONCILE_MAX_FILES_PER_SECOND stats. The
+``reconcile_projects`` command runs them on a schedule, and when watchfiles
+is installed, as soon as a project's directory reports a change.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .blobs import blob_hash, get_blob_store
+from .gitinfo import invalidate_status
+from .models import FileRevision, Project, ProjectFile
+from .retrieval import project_index
+from .storage import STAGING_DIR, project_dir
+from filesystem.views import get_file_language
+
+logger = logging.getLogger(__name__)
+
+# Never tracked as project files
+IGNORED_DIRS = {'.git', STAGING_DIR}
+
+# project id -> {path: (mtime_ns, size)} of files seen but not tracked
+# (binary or oversized), so they are not re-read on every pass. Each pass
+# replaces its project's entry with what it saw, so files that were
+# adopted or deleted drop out; deleted projects are forgotten outright.
+_untracked: Dict[int, Dict[str, tuple]] = {}
+
+
+class RateLimiter:
+    """Sleeps just enough to keep calls to ``tick`` under ``rate`` per second"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.started = time.monotonic()
+        self.count = 0
+
+    def tick(self) -> None:
+        if not self.rate:
+            return
+        self.count += 1
+        ahead = self.count / self.rate - (time.monotonic() - self.started)
+        if ahead > 0.01:
+            time.sleep(ahead)
+
+
+def _scan(root: Path, limiter: RateLimiter):
+    """``(relative path, mtime_ns, size)`` for every regular file under ``root``"""
+    for directory, dirnames, filenames in os.walk(root):
+        if directory == str(root):
+            dirnames[:] = [d for d in dirnames if d not in IGNORED_DIRS]
+        for filename in filenames:
+            if filename.startswith('.tmp-'):
+                continue
+            path = os.path.join(directory, filename)
+            limiter.tick()
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            if not (st.st_mode & 0o170000) == 0o100000:
+                continue
+            yield os.path.relpath(path, root).replace(os.sep, '/'), st.st_mtime_ns, st.st_size
+
+
+def _read_text(path: Path, size: int) -> Optional[bytes]:
+    """The file's bytes if it is tracked-size UTF-8 text, else None"""
+    if size > settings.PROJECT_IMPORT_MAX_TEXT_SIZE:
+        return None
+    try:
+        data = path.read_bytes()
+        data.decode('utf-8')
+    except (FileNotFoundError, UnicodeDecodeError):
+        return None
+    return data
+
+
+def _remember_untracked(project_id: int, untracked: Dict[str, tuple]) -> None:
+    if untracked:
+        _untracked[project_id] = untracked
+    else:
+        _untracked.pop(project_id, None)
+
+
+def forget_project(project_id: int) -> None:
+    """Drop what passes over a project remembered, once the project is gone"""
+    _untracked.pop(project_id, None)
+
+
+def reconcile_project(project: Project, max_files_per_second: float = None) -> Dict[str, int]:
+    """One pass over ``project``'s directory; returns what it found"""
+    root = project_dir(project.id)
+    counts = {'scanned': 0, 'hashed': 0, 'changed': 0, 'added': 0, 'deleted': 0, 'restored': 0}
+    if not root.is_dir():
+        forget_project(project.id)
+        return counts
+
+    rows = {
+        row.file_path: row
+        for row in ProjectFile.objects.filter(project=project).only(
+            'id', 'project_id', 'file_path', 'size', 'content_hash', 'disk_mtime_ns', 'deleted_at'
+        )
+    }
+    limiter = RateLimiter(settings.RECONCILE_MAX_FILES_PER_SECOND if max_files_per_second is None
+                          else max_files_per_second)
+
+    suspects = []
+    new_files = []
+    known = _untracked.get(project.id, {})
+    untracked = {}
+    for file_path, mtime_ns, size in _scan(root, limiter):
+        counts['scanned'] += 1
+        row = rows.pop(file_path, None)
+        if row is None:
+            if known.get(file_path) == (mtime_ns, size):
+                untracked[file_path] = (mtime_ns, size)
+            else:
+                new_files.append((file_path, mtime_ns, size))
+        elif row.deleted_at is not None or row.disk_mtime_ns != mtime_ns or row.size != size:
+            suspects.append((row, mtime_ns, size))
+    missing = [row for row in rows.values() if row.deleted_at is None]
+
+    if not (suspects or new_files or missing):
+        _remember_untracked(project.id, untracked)
+        return counts
+
+    store = get_blob_store()
+
+    def examine(item):
+        row, mtime_ns, size = item
+        data = _read_text(root / row.file_path, size)
+        if data is None:
+            return row, mtime_ns, None, None
+        digest = blob_hash(data)
+        if digest != row.content_hash:
+            store.put(data)
+        return row, mtime_ns, digest, len(data)
+
+    def examine_new(item):
+        file_path, mtime_ns, size = item
+        data = _read_text(root / file_path, size)
+        if data is None:
+            untracked[file_path] = (mtime_ns, size)
+            return None
+        return file_path, mtime_ns, store.put(data), len(data)
+
+    with ThreadPoolExecutor(max_workers=settings.PROJECT_WRITE_WORKERS) as pool:
+        examined = list(pool.map(examine, suspects))
+        found = [item for item in pool.map(examine_new, new_files) if item is not None]
+    _remember_untracked(project.id, untracked)
+    counts['hashed'] = len(examined) + len(new_files)
+
+    now = timezone.now()
+    changed: List[ProjectFile] = []
+    touched: List[ProjectFile] = []
+    scanned_hashes = {}
+    for row, mtime_ns, digest, size in examined:
+        scanned_hashes[row.pk] = row.content_hash
+        if digest is None:
+            # Binary or oversized now: keep the last text, stop re-reading it
+            row.disk_mtime_ns = mtime_ns
+            touched.append(row)
+            continue
+        if row.deleted_at is not None:
+            counts['restored'] += 1
+        row.disk_mtime_ns = mtime_ns
+        row.deleted_at = None
+        if digest == row.content_hash:
+            touched.append(row)
+        else:
+            row.content_hash = digest
+            row.size = size
+            row.inline_content = ''
+            row.last_modified = now
+            changed.append(row)
+
+    batch_size = settings.PROJECT_BULK_BATCH_SIZE
+    with transaction.atomic():
+        # Rows the app rewrote since the scan read them are left alone; the
+        # app's write already matches the disk or the next pass will see it
+        ids = list(scanned_hashes) + [row.pk for row in missing]
+        current = {}
+        # In batches: databases cap the number of query parameters
+        for start in range(0, len(ids), batch_size):
+            current.update(
+                ProjectFile.objects.select_for_update()
+                .filter(pk__in=ids[start:start + batch_size])
+                .values_list('pk', 'content_hash')
+            )
+        changed = [row for row in changed if current.get(row.pk) == scanned_hashes[row.pk]]
+        touched = [row for row in touched if current.get(row.pk) == scanned_hashes[row.pk]]
+        ProjectFile.objects.bulk_update(
+            changed, ['content_hash', 'size', 'inline_content', 'last_modified', 'disk_mtime_ns', 'deleted_at'],
+            batch_size=batch_size
+        )
+        ProjectFile.objects.bulk_update(touched, ['disk_mtime_ns', 'deleted_at'], batch_size=batch_size)
+
+        missing = [row for row in missing if row.pk in current]
+        for start in range(0, len(missing), batch_size):
+            ProjectFile.objects.filter(
+                pk__in=[row.pk for row in missing[start:start + batch_size]]
+            ).update(deleted_at=now)
+
+        # Files the app created since the scan already have rows
+        existing = set(ProjectFile.objects.filter(project=project).values_list('file_path', flat=True)) if found else set()
+        added = [
+            ProjectFile(
+                project=project,
+                file_path=file_path,
+                size=size,
+                content_hash=digest,
+                language=get_file_language(Path(file_path)),
+                disk_mtime_ns=mtime_ns
+            )
+            for file_path, mtime_ns, digest, size in found
+            if file_path not in existing
+        ]
+        ProjectFile.objects.bulk_create(added, batch_size=batch_size)
+
+        # Outside edits become snapshots in each file's history
+        latest = {}
+        for start in range(0, len(changed), batch_size):
+            latest.update(
+                FileRevision.objects.filter(project_file__in=[row.pk for row in changed[start:start + batch_size]])
+                .values('project_file').annotate(number=Max('number')).values_list('project_file', 'number')
+            )
+        FileRevision.objects.bulk_create(
+            [
+                FileRevision(
+                    project_file=row,
+                    number=latest.get(row.pk, 0) + 1,
+                    kind=FileRevision.SNAPSHOT,
+                    content_hash=row.content_hash,
+                    size=row.size,
+                    message='Changed on disk'
+                )
+                for row in changed
+            ] + [
+                FileRevision(
+                    project_file=row,
+                    number=1,
+                    kind=FileRevision.SNAPSHOT,
+                    content_hash=row.content_hash,
+                    size=row.size,
+                    message='Found on disk'
+                )
+                for row in added
+            ],
+            batch_size=batch_size
+        )
+
+    for row in changed + added:
+        project_index.update_file(row)
+    for row in missing:
+        project_index.remove_file(row)
+
+    counts.update(changed=len(changed), added=len(added), deleted=len(missing))
+    if changed or added or missing:
+        invalidate_status(project.id)
+        logger.info(f"Reconciled project {project.id}: {counts}")
+    return counts
+
+
+def project_id_for_path(path: str) -> Optional[int]:
+    """The project a path under PROJECTS_ROOT belongs to, if any"""
+    try:
+        relative = Path(path).resolve().relative_to(Path(settings.PROJECTS_ROOT).resolve())
+    except ValueError:
+        return None
+    if not relative.parts or not relative.parts[0].isdigit():
+        return None
+    if len(relative.parts) > 1 and relative.parts[1] in IGNORED_DIRS:
+        return None
+    return int(relative.parts[0])
@@ -0,0 +1,286 @@
+import logging
+import math
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHUNK_LINES = 40
+CHUNK_OVERLAP = 8
+# Rough chars-per-token for code, used to fit snippets into a token budget
+CHARS_PER_TOKEN = 4
+BM25_K1 = 1.2
+BM25_B = 0.75
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+SUBWORD_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased identifiers plus their snake/camel-case parts."""
+    tokens = []
+    for identifier in IDENTIFIER_PATTERN.findall(text):
+        tokens.append(identifier.lower())
+        parts = SUBWORD_PATTERN.findall(identifier)
+        if len(parts) > 1:
+            tokens.extend(part.lower() for part in parts)
+    return tokens
+
+
+def chunk_file(file_path: str, content: str) -> List[Dict[str, Any]]:
+    """Overlapping line windows of a file, with their 1-based line ranges."""
+    lines = content.splitlines()
+    chunks = []
+    step = CHUNK_LINES - CHUNK_OVERLAP
+    for start in range(0, max(len(lines), 1), step):
+        window = lines[start:start + CHUNK_LINES]
+        text = "\n".join(window)
+        if not text.strip():
+            continue
+        chunks.append({
+            'path': file_path,
+            'start_line': start + 1,
+            'end_line': start + len(window),
+            'text': text,
+        })
+        if start + CHUNK_LINES >= len(lines):
+            break
+    return chunks
+
+
+class ProjectIndex:
+    """
+    Chunk index over one project's files, updated a file at a time.
+
+    Scoring is BM25 over an inverted index by default. When an embedding
+    model is given, chunks are also embedded into a row-normalized NumPy
+    matrix and ranked by cosine similarity instead; rows of replaced files
+    are dropped and the matrix is re-stacked lazily on the next query.
+    """
+
+    def __init__(self, embedder=None):
+        self.embedder = embedder
+        self.chunks: Dict[int, Dict[str, Any]] = {}
+        self.file_chunks: Dict[int, List[int]] = defaultdict(list)
+        # (file_path, content_hash) each file was indexed at
+        self.versions: Dict[int, Tuple[str, str]] = {}
+        self._next_id = 0
+        # BM25 state
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.lengths: Dict[int, int] = {}
+        self.chunk_terms: Dict[int, List[str]] = {}
+        self.total_length = 0
+        # Embedding state
+        self.vectors: Dict[int, np.ndarray] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def update_file(self, file_id: int, file_path: str, content: str, content_hash: str = '') -> None:
+        self.remove_file(file_id)
+        self.versions[file_id] = (file_path, content_hash)
+        chunks = chunk_file(file_path, content)
+        if self.embedder is not None and chunks:
+            vectors = self.embedder.encode(
+                [f"{c['path']}\n{c['text']}" for c in chunks], normalize_embeddings=True
+            )
+        for i, chunk in enumerate(chunks):
+            chunk_id = self._next_id
+            self._next_id += 1
+            chunk['file_id'] = file_id
+            self.chunks[chunk_id] = chunk
+            self.file_chunks[file_id].append(chunk_id)
+
+            terms = Counter(tokenize(f"{chunk['path']}\n{chunk['text']}"))
+            for term, count in terms.items():
+                self.postings[term][chunk_id] = count
+            self.chunk_terms[chunk_id] = list(terms)
+            length = sum(terms.values())
+            self.lengths[chunk_id] = length
+            self.total_length += length
+
+            if self.embedder is not None:
+                self.vectors[chunk_id] = np.asarray(vectors[i], dtype=np.float32)
+        self._matrix = None
+
+    def remove_file(self, file_id: int) -> None:
+        self.versions.pop(file_id, None)
+        for chunk_id in self.file_chunks.pop(file_id, []):
+            self.chunks.pop(chunk_id)
+            for term in self.chunk_terms.pop(chunk_id, []):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self.postings[term]
+            self.total_length -= self.lengths.pop(chunk_id, 0)
+            self.vectors.pop(chunk_id, None)
+        self._matrix = None
+
+    def search(self, query: str, k: int = 8) -> List[Dict[str, Any]]:
+        """Top ``k`` chunks for ``query`` as dicts with a ``score``."""
+        if not self.chunks:
+            return []
+        if self.embedder is not None and self.vectors:
+            scores = self._embedding_scores(query)
+        else:
+            scores = self._bm25_scores(query)
+        if not scores:
+            return []
+        ids = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+        values = np.fromiter(scores.values(), dtype=np.float64, count=len(scores))
+        if len(ids) > k:
+            top = np.argpartition(-values, k)[:k]
+            ids, values = ids[top], values[top]
+        order = np.argsort(-values)
+        return [dict(self.chunks[int(ids[i])], score=round(float(values[i]), 4)) for i in order]
+
+    def _bm25_scores(self, query: str) -> Dict[int, float]:
+        n = len(self.chunks)
+        average_length = self.total_length / n if n else 0.0
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[chunk_id] / (average_length or 1))
+                scores[chunk_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def _embedding_scores(self, query: str) -> Dict[int, float]:
+        if self._matrix is None:
+            self._matrix_ids = list(self.vectors)
+            self._matrix = np.stack([self.vectors[i] for i in self._matrix_ids])
+        vector = np.asarray(self.embedder.encode([query], normalize_embeddings=True)[0], dtype=np.float32)
+        similarities = self._matrix @ vector
+        return dict(zip(self._matrix_ids, similarities.tolist()))
+
+
+class ProjectIndexRegistry:
+    """
+    Per-project indexes kept for the most recently queried projects.
+
+    An index is built from the database the first time a project is searched
+    and then patched by ``update_file``/``remove_file`` as files are written;
+    writes to projects that are not resident are ignored, since they will be
+    read fresh on the next build.
+
+    Those hooks only see saves made by this process, so every lookup also
+    compares the indexed (path, content hash) of each file with the database
+    and re-reads the files that differ. That catches writes from other
+    workers, bulk updates that skip the signals and rolled-back saves.
+    """
+
+    def __init__(self, max_projects: int = 32, embedding_model: str = ''):
+        self.max_projects = max_projects
+        self.embedding_model = embedding_model
+        self._embedder = None
+        self._indexes: "OrderedDict[int, ProjectIndex]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _get_embedder(self):
+        if not self.embedding_model:
+            return None
+        if self._embedder is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError:
+                logger.warning("sentence-transformers is not installed; falling back to BM25 retrieval")
+                self.embedding_model = ''
+                return None
+            self._embedder = SentenceTransformer(self.embedding_model, device='cpu')
+        return self._embedder
+
+    def get(self, project_id: int) -> ProjectIndex:
+        with self._lock:
+            index = self._indexes.get(project_id)
+            if index is None:
+                index = self._build(project_id)
+                self._indexes[project_id] = index
+                while len(self._indexes) > self.max_projects:
+                    self._indexes.popitem(last=False)
+            else:
+                self._refresh(project_id, index)
+            self._indexes.move_to_end(project_id)
+            return index
+
+    def _build(self, project_id: int) -> ProjectIndex:
+        from .models import ProjectFile
+        index = ProjectIndex(self._get_embedder())
+        files = ProjectFile.objects.filter(project_id=project_id, deleted_at__isnull=True).only(
+            'id', 'project_id', 'file_path', 'inline_content', 'content_hash'
+        )
+        for project_file in files.iterator():
+            index.update_file(project_file.id, project_file.file_path, project_file.content,
+                              project_file.content_hash)
+        return index
+
+    def _refresh(self, project_id: int, index: ProjectIndex) -> None:
+        """Re-read the files whose path or content changed since they were indexed."""
+        from .models import ProjectFile
+        live = ProjectFile.objects.filter(project_id=project_id, deleted_at__isnull=True)
+        current = {
+            file_id: (file_path, content_hash)
+            for file_id, file_path, content_hash in live.values_list('id', 'file_path', 'content_hash')
+        }
+        for file_id in set(index.versions) - set(current):
+            index.remove_file(file_id)
+        stale = [file_id for file_id, version in current.items() if index.versions.get(file_id) != version]
+        if not stale:
+            return
+        files = live.filter(id__in=stale).only('id', 'project_id', 'file_path', 'inline_content', 'content_hash')
+        for project_file in files.iterator():
+            index.update_file(project_file.id, project_file.file_path, project_file.content,
+                              project_file.content_hash)
+
+    def update_file(self, project_file) -> None:
+        with self._lock:
+            index = self._indexes.get(project_file.project_id)
+            if index is not None:
+                index.update_file(project_file.id, project_file.file_path, project_file.content or '',
+                                  project_file.content_hash)
+
+    def remove_file(self, project_file) -> None:
+        with self._lock:
+            index = self._indexes.get(project_file.project_id)
+            if index is not None:
+                index.remove_file(project_file.id)
+
+    def forget(self, project_id: int) -> None:
+        with self._lock:
+            self._indexes.pop(project_id, None)
+
+    def select_context(self, project_id: int, query: str, max_tokens: int = 1500,
+                       k: int = 8) -> List[Dict[str, Any]]:
+        """Best-scoring snippets for ``query`` that fit within ``max_tokens``."""
+        with self._lock:
+            results = self.get(project_id).search(query, k)
+        selected = []
+        budget = max_tokens * CHARS_PER_TOKEN
+        for chunk in results:
+            size = len(chunk['text']) + len(chunk['path'])
+            if size > budget:
+                continue
+            budget -= size
+            selected.append({
+                'path': chunk['path'],
+                'start_line': chunk['start_line'],
+                'end_line': chunk['end_line'],
+                'text': chunk['text'],
+                'score': chunk['score'],
+            })
+        return selected
+
+
+project_index = ProjectIndexRegistry(
+    max_projects=settings.RETRIEVAL_MAX_PROJECTS,
+    embedding_model=settings.RETRIEVAL_EMBEDDING_MODEL,
+)
@@ -1,6 +1,8 @@
 from rest_framework import serializers
-from .models import Project, ProjectFile, ProjectSetting
-from django.contrib.auth.models import User
+from .models import FileRevision, Project, ProjectFile, ProjectSetting
+from django.contrib.auth import get_user_model
+
+User = get_user_model()
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -14,18 +16,42 @@ class ProjectSettingSerializer(serializers.ModelSerializer):
 
 class ProjectFileSerializer(serializers.ModelSerializer):
     created_by = UserSerializer(read_only=True)
+    content = serializers.CharField(allow_blank=True, trim_whitespace=False)
     
     class Meta:
         model = ProjectFile
-        fields = '__all__'
-        read_only_fields = ('last_modified',)
+        exclude = ('inline_content',)
+        read_only_fields = ('last_modified', 'size', 'content_hash', 'disk_mtime_ns', 'deleted_at')
+
+class ProjectFileMetadataSerializer(serializers.ModelSerializer):
+    """Listing view of a file: everything but its content"""
+
+    class Meta:
+        model = ProjectFile
+        fields = ('id', 'project', 'file_path', 'size', 'content_hash', 'language', 'last_modified')
+        read_only_fields = fields
+
+class FileRevisionSerializer(serializers.ModelSerializer):
+    """A revision's metadata; its text comes from the file's revision endpoints"""
+    author = UserSerializer(read_only=True)
+
+    class Meta:
+        model = FileRevision
+        fields = ('id', 'number', 'kind', 'content_hash', 'size', 'author', 'message', 'created_at')
+        read_only_fields = fields
 
 class ProjectSerializer(serializers.ModelSerializer):
     owner = UserSerializer(read_only=True)
-    files = ProjectFileSerializer(many=True, read_only=True, source='projectfile_set')
-    settings = ProjectSettingSerializer(read_only=True)
+    # Files are listed separately (metadata only); see ProjectViewSet.files
+    file_count = serializers.SerializerMethodField()
+    settings = ProjectSettingSerializer(read_only=True, source='projectsetting')
     
     class Meta:
         model = Project
         fields = '__all__'
         read_only_fields = ('created_at', 'updated_at')
+
+    def get_file_count(self, obj):
+        if hasattr(obj, 'file_count'):
+            return obj.file_count
+        return obj.projectfile_set.filter(deleted_at__isnull=True).count()
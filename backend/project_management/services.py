@@ -1,12 +1,31 @@
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Dict, List
 from django.conf import settings
-from .models import Project, ProjectFile
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from .archives import extract_archive
+from .blobs import get_blob_store
+from .gitinfo import invalidate_status
+from .models import FileRevision, Project, ProjectFile, ProjectSetting
+from .storage import (
+    check_writable, clone_tree, make_staging_dir, move_into_place, project_dir, remove_tree, replace_file,
+    safe_relative_path, write_files
+)
 from code_generation.services import code_generator
-from asgiref.sync import async_to_sync
+from filesystem.views import get_file_language
+from asgiref.sync import sync_to_async
 import git
 import json
 
+logger = logging.getLogger(__name__)
+
+FILE_LISTING_FIELDS = ('id', 'project', 'file_path', 'size', 'content_hash', 'language', 'last_modified')
+
 class ProjectService:
     @staticmethod
     async def create_project_with_ai(
@@ -14,109 +33,405 @@ class ProjectService:
         description: str,
         language: str,
         ai_prompt: str,
-        git_repo_url: str = None
+        git_repo_url: str = None,
+        owner=None
     ) -> Project:
         """Create a new project with AI-generated structure."""
         
-        # Create project record
-        project = Project.objects.create(
+        # Generate project structure using AI before anything is persisted
+        files, dependencies, setup_instructions = await code_generator.generate_project_structure(
+            ai_prompt, language
+        )
+        
+        return await sync_to_async(ProjectService.ingest_project)(
             name=name,
             description=description,
             language=language,
-            git_repo_url=git_repo_url
+            files=files,
+            git_repo_url=git_repo_url,
+            owner=owner,
+            metadata={
+                'dependencies': dependencies,
+                'setup_instructions': setup_instructions
+            }
         )
-        
+
+    @staticmethod
+    def ingest_project(
+        name: str,
+        description: str,
+        language: str,
+        files: List[Dict[str, str]],
+        git_repo_url: str = None,
+        owner=None,
+        metadata: Dict = None
+    ) -> Project:
+        """
+        Persist a project and all of its files in one go.
+
+        Files are written to a staging directory and their contents to the
+        blob store by thread pools, then the project row and every
+        ProjectFile row go in with a single ``bulk_create`` inside a
+        transaction, and the staging directory is renamed into place before
+        that transaction commits. Any failure removes whichever directory
+        exists and rolls the rows back, so the database and the disk end up
+        either both populated or both empty. Blobs already written are left
+        for later reuse; they are immutable and shared by hash.
+        """
+        timings = {}
+        started = time.perf_counter()
+
+        # Later entries win, as they would have when written one by one
+        by_path = {}
+        for file_info in files:
+            by_path[safe_relative_path(file_info['path'])] = file_info.get('content') or ''
+        files = [{'path': path, 'content': content} for path, content in by_path.items()]
+
+        staging = make_staging_dir()
+        target = None
         try:
-            # Generate project structure using AI
-            files, dependencies, setup_instructions = await code_generator.generate_project_structure(
-                ai_prompt, language
-            )
-            
-            # Create project directory
-            project_dir = os.path.join(settings.PROJECTS_ROOT, str(project.id))
-            os.makedirs(project_dir, exist_ok=True)
-            
+            written = write_files(staging, files)
+            timings['disk'] = time.perf_counter() - started
+
             # Initialize git repository if URL provided
             if git_repo_url:
-                repo = git.Repo.init(project_dir)
-                if git_repo_url:
-                    repo.create_remote('origin', git_repo_url)
-            
-            # Save project files
-            for file_info in files:
-                file_path = os.path.join(project_dir, file_info['path'])
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                
-                with open(file_path, 'w') as f:
-                    f.write(file_info['content'])
-                
-                ProjectFile.objects.create(
-                    project=project,
-                    path=file_info['path'],
-                    content=file_info['content']
+                repo = git.Repo.init(staging)
+                repo.create_remote('origin', git_repo_url)
+
+            mark = time.perf_counter()
+            rows = [
+                ProjectFile(
+                    file_path=file_info['path'],
+                    content=file_info['content'],
+                    language=get_file_language(Path(file_info['path'])),
+                    created_by=owner
                 )
-            
-            # Save dependencies and setup instructions
-            project.metadata = {
-                'dependencies': dependencies,
-                'setup_instructions': setup_instructions
-            }
-            project.save()
-            
-            return project
-            
-        except Exception as e:
-            # Cleanup on failure
-            project.delete()
-            if os.path.exists(project_dir):
-                import shutil
-                shutil.rmtree(project_dir)
-            raise e
+                for file_info in files
+            ]
+            # Compression and blob writes run in parallel; files repeated
+            # across scaffolds land on blobs that already exist
+            with ThreadPoolExecutor(max_workers=settings.PROJECT_WRITE_WORKERS) as pool:
+                list(pool.map(ProjectFile.store_content, rows))
+            # The rename into place keeps mtimes, so the reconciler can trust these
+            for row in rows:
+                row.disk_mtime_ns = os.stat(staging / row.file_path).st_mtime_ns
+            timings['blobs'] = time.perf_counter() - mark
+
+            mark = time.perf_counter()
+            with transaction.atomic():
+                project = Project.objects.create(
+                    name=name,
+                    description=description,
+                    programming_language=language,
+                    git_repo_url=git_repo_url,
+                    owner=owner,
+                    metadata=metadata or {}
+                )
+                # bulk_create skips post_save, but a brand-new project has
+                # no retrieval index to keep current yet
+                for row in rows:
+                    row.project = project
+                ProjectFile.objects.bulk_create(rows, batch_size=settings.PROJECT_BULK_BATCH_SIZE)
+                # Nor does it record history, so each file starts with a snapshot
+                FileRevision.objects.bulk_create(
+                    [
+                        FileRevision(
+                            project_file=row,
+                            number=1,
+                            kind=FileRevision.SNAPSHOT,
+                            content_hash=row.content_hash,
+                            size=row.size,
+                            author=owner,
+                            message='Initial version'
+                        )
+                        for row in rows
+                    ],
+                    batch_size=settings.PROJECT_BULK_BATCH_SIZE
+                )
+                timings['db'] = time.perf_counter() - mark
+
+                target = project_dir(project.id)
+                move_into_place(staging, target)
+        except Exception:
+            remove_tree(staging)
+            if target is not None:
+                remove_tree(target)
+            raise
+
+        timings['total'] = time.perf_counter() - started
+        logger.info(
+            f"Ingested project {project.id}: {len(files)} files, {written} bytes in "
+            + ", ".join(f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in timings.items())
+        )
+        return project
 
     @staticmethod
-    def get_project_files(project: Project) -> List[Dict[str, str]]:
-        """Get all files in a project."""
-        return [
-            {
-                'path': file.path,
-                'content': file.content
-            }
-            for file in project.files.all()
-        ]
+    def import_archive(
+        name: str,
+        description: str,
+        language: str,
+        archive,
+        owner=None,
+        strip_components: int = 0
+    ) -> Project:
+        """
+        Create a project from an uploaded tar or zip archive.
+
+        Members are extracted one at a time into a staging directory and
+        their contents stored as blobs, so memory stays flat however large
+        the archive is; a path repeated in the archive keeps its last
+        member, as tar would. Only then does a transaction insert the rows,
+        a batch at a time, so the database is not held locked for the
+        length of the upload. Files that are not UTF-8 text, or are larger
+        than PROJECT_IMPORT_MAX_TEXT_SIZE, go to disk without a ProjectFile
+        row, as does anything under ``.git/``. Failure leaves nothing
+        behind, as in ``ingest_project``.
+        """
+        started = time.perf_counter()
+        store = get_blob_store()
+        staging = make_staging_dir()
+        target = None
+        counts = {'files': 0, 'rows': 0, 'bytes': 0}
+        try:
+            # path -> (size, content hash, mtime) of each tracked file
+            tracked = {}
+            for path, size, data in extract_archive(archive, staging, strip_components):
+                counts['files'] += 1
+                counts['bytes'] += size
+                # A later member replaces an earlier one of the same path
+                tracked.pop(path, None)
+                if data is None or path == '.git' or path.startswith('.git/'):
+                    continue
+                try:
+                    data.decode('utf-8')
+                except UnicodeDecodeError:
+                    continue
+                tracked[path] = (size, store.put(data), os.stat(staging / path).st_mtime_ns)
+
+            with transaction.atomic():
+                project = Project.objects.create(
+                    name=name,
+                    description=description,
+                    programming_language=language,
+                    owner=owner
+                )
+                paths = list(tracked)
+                batch_size = settings.PROJECT_BULK_BATCH_SIZE
+                for start in range(0, len(paths), batch_size):
+                    batch = [
+                        ProjectFile(
+                            project=project,
+                            file_path=path,
+                            size=tracked[path][0],
+                            content_hash=tracked[path][1],
+                            language=get_file_language(Path(path)),
+                            created_by=owner,
+                            disk_mtime_ns=tracked[path][2]
+                        )
+                        for path in paths[start:start + batch_size]
+                    ]
+                    ProjectFile.objects.bulk_create(batch)
+                    FileRevision.objects.bulk_create([
+                        FileRevision(
+                            project_file=row,
+                            number=1,
+                            kind=FileRevision.SNAPSHOT,
+                            content_hash=row.content_hash,
+                            size=row.size,
+                            author=owner,
+                            message='Imported'
+                        )
+                        for row in batch
+                    ])
+                    counts['rows'] += len(batch)
+
+                target = project_dir(project.id)
+                move_into_place(staging, target)
+        except Exception:
+            remove_tree(staging)
+            if target is not None:
+                remove_tree(target)
+            raise
+
+        logger.info(
+            f"Imported project {project.id}: {counts['files']} files ({counts['rows']} tracked), "
+            f"{counts['bytes']} bytes in {(time.perf_counter() - started) * 1000:.1f}ms"
+        )
+        return project
+
+    @staticmethod
+    def clone_project(source: Project, owner, name: str = None, description: str = None) -> Project:
+        """
+        Fork ``source`` into a new project owned by ``owner``, without
+        regenerating or rewriting anything.
+
+        The directory is duplicated by ``clone_tree`` (reflinks, hardlinks or
+        a parallel copy, whichever the filesystem allows) and the file rows
+        are copied inside the database. Content is shared by reference: the
+        new rows point at the same blobs, and each file's history starts from
+        a snapshot of the blob it was cloned at.
+        """
+        started = time.perf_counter()
+        staging = make_staging_dir()
+        target = None
+        try:
+            source_dir = project_dir(source.id)
+            method = clone_tree(source_dir, staging) if source_dir.is_dir() else 'empty'
+            disk_time = time.perf_counter() - started
+
+            with transaction.atomic():
+                project = Project.objects.create(
+                    name=name or f"{source.name} (copy)",
+                    description=source.description if description is None else description,
+                    programming_language=source.programming_language,
+                    git_repo_url=source.git_repo_url,
+                    owner=owner,
+                    metadata={**source.metadata, 'cloned_from': source.id}
+                )
+                project_setting = ProjectSetting.objects.filter(project=source).first()
+                if project_setting is not None:
+                    project_setting.pk = None
+                    project_setting.project = project
+                    project_setting.save()
+
+                # Hardlinks share the source's inodes, mtimes included
+                count = ProjectService._copy_file_rows(source, project, owner, keep_mtimes=method == 'hardlink')
+
+                target = project_dir(project.id)
+                move_into_place(staging, target)
+        except Exception:
+            remove_tree(staging)
+            if target is not None:
+                remove_tree(target)
+            raise
+
+        logger.info(
+            f"Cloned project {source.id} to {project.id}: {count} files, disk by {method} in "
+            f"{disk_time * 1000:.1f}ms, {(time.perf_counter() - started) * 1000:.1f}ms total"
+        )
+        return project
+
+    @staticmethod
+    def _copy_file_rows(source: Project, project: Project, owner, keep_mtimes: bool = False) -> int:
+        """
+        Copy ``source``'s file rows to ``project`` with INSERT ... SELECT, so
+        the database duplicates them without any passing through Python, and
+        give every copy a first revision the same way. Rows the reconciler
+        marked deleted have no file to clone and are left behind.
+        """
+        qn = connection.ops.quote_name
+
+        def column(model, name):
+            return qn(model._meta.get_field(name).column)
+
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        owner_id = owner.pk if owner is not None else None
+        copied = ('file_path', 'inline_content', 'size', 'content_hash', 'language')
+        if keep_mtimes:
+            copied += ('disk_mtime_ns',)
+        copied = ', '.join(column(ProjectFile, f) for f in copied)
+        files = qn(ProjectFile._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {files} ({column(ProjectFile, 'project')}, {column(ProjectFile, 'created_by')}, "
+                f"{column(ProjectFile, 'last_modified')}, {copied}) "
+                f"SELECT %s, %s, %s, {copied} FROM {files} WHERE {column(ProjectFile, 'project')} = %s "
+                f"AND {column(ProjectFile, 'deleted_at')} IS NULL",
+                [project.id, owner_id, now, source.id]
+            )
+            count = cursor.rowcount
+            # Rows from before blob storage have no blob to snapshot
+            cursor.execute(
+                f"INSERT INTO {qn(FileRevision._meta.db_table)} ("
+                + ', '.join(column(FileRevision, f) for f in (
+                    'project_file', 'number', 'kind', 'content_hash', 'size', 'author', 'message', 'created_at'
+                ))
+                + f") SELECT {qn(ProjectFile._meta.pk.column)}, 1, %s, {column(ProjectFile, 'content_hash')}, "
+                f"{column(ProjectFile, 'size')}, %s, %s, %s FROM {files} "
+                f"WHERE {column(ProjectFile, 'project')} = %s AND {column(ProjectFile, 'content_hash')} <> '' "
+                f"AND {column(ProjectFile, 'deleted_at')} IS NULL",
+                [FileRevision.SNAPSHOT, owner_id, f'Cloned from project {source.id}', now, project.id]
+            )
+        return count
+
+    @staticmethod
+    def list_project_files(project: Project):
+        """A project's files ordered by path, with only the listing columns loaded."""
+        return ProjectFile.objects.filter(project=project, deleted_at__isnull=True).order_by('file_path', 'id').only(*FILE_LISTING_FIELDS)
+
+    @staticmethod
+    async def stream_project_files(project: Project, include_content: bool = False):
+        """NDJSON lines, one per file, read from the database in chunks."""
+        fields = FILE_LISTING_FIELDS + (('inline_content',) if include_content else ())
+        queryset = ProjectService.list_project_files(project).values(*fields)
+        read_blob = sync_to_async(lambda digest: get_blob_store().get(digest).decode('utf-8'), thread_sensitive=False)
+        async for row in queryset.aiterator(chunk_size=settings.PROJECT_STREAM_CHUNK_SIZE):
+            if include_content:
+                inline = row.pop('inline_content')
+                row['content'] = inline if inline or not row['content_hash'] else await read_blob(row['content_hash'])
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
 
     @staticmethod
     def update_project_file(
         project: Project,
         file_path: str,
-        content: str
+        content: str,
+        author=None,
+        message: str = '',
+        write_on_commit: bool = False
     ) -> ProjectFile:
-        """Update or create a project file."""
-        file_obj, created = ProjectFile.objects.get_or_create(
-            project=project,
-            path=file_path,
-            defaults={'content': content}
-        )
-        
-        if not created:
-            file_obj.content = content
-            file_obj.save()
-        
-        # Update file on disk
-        full_path = os.path.join(settings.PROJECTS_ROOT, str(project.id), file_path)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        with open(full_path, 'w') as f:
-            f.write(content)
-        
+        """
+        Update or create a project file. Each change is added to the file's
+        revision history. With ``write_on_commit`` the file on disk is only
+        rewritten once the surrounding transaction commits, so a rolled-back
+        row never leaves its text on disk.
+        """
+        file_path = safe_relative_path(file_path)
+        file_obj = ProjectFile.objects.filter(project=project, file_path=file_path).first()
+        if file_obj is None:
+            file_obj = ProjectFile(
+                project=project,
+                file_path=file_path,
+                language=get_file_language(Path(file_path)),
+                created_by=author
+            )
+        full_path = project_dir(project.id) / file_path
+        if write_on_commit:
+            # Fail now, inside the transaction, for paths the write would fail on
+            check_writable(full_path)
+        else:
+            # Disk first, so the row can record the mtime the reconciler will see
+            replace_file(full_path, content)
+            invalidate_status(project.id)
+            file_obj.disk_mtime_ns = full_path.stat().st_mtime_ns
+
+        file_obj.content = content
+        file_obj.deleted_at = None
+        # Picked up by the post_save signal that records the revision
+        file_obj.revision_author = author
+        file_obj.revision_message = message
+        file_obj.save()
+
+        if write_on_commit:
+            def write():
+                replace_file(full_path, content)
+                invalidate_status(project.id)
+                ProjectFile.objects.filter(pk=file_obj.pk).update(disk_mtime_ns=full_path.stat().st_mtime_ns)
+
+            transaction.on_commit(write, robust=True)
         return file_obj
 
     @staticmethod
     def delete_project_file(project: Project, file_path: str) -> None:
         """Delete a project file."""
-        ProjectFile.objects.filter(project=project, path=file_path).delete()
+        file_path = safe_relative_path(file_path)
+        # The blob stays: other rows may share it
+        ProjectFile.objects.filter(project=project, file_path=file_path).delete()
         
         # Delete file from disk
-        full_path = os.path.join(settings.PROJECTS_ROOT, str(project.id), file_path)
-        if os.path.exists(full_path):
-            os.remove(full_path)
+        full_path = project_dir(project.id) / file_path
+        if full_path.exists():
+            full_path.unlink()
+        invalidate_status(project.id)
 
 project_service = ProjectService()
@@ -0,0 +1,39 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .history import record_revision
+from .models import Project, ProjectFile
+from .reconcile import forget_project
+from .retrieval import project_index
+
+
+@receiver(post_save, sender=ProjectFile)
+def index_project_file(sender, instance, **kwargs):
+    project_index.update_file(instance)
+
+
+@receiver(post_save, sender=ProjectFile)
+def record_file_revision(sender, instance, **kwargs):
+    # Set by ProjectFile.save(); bulk_create and queryset updates bypass it
+    if getattr(instance, '_content_changed', False):
+        record_revision(
+            instance,
+            instance._previous_content_hash,
+            author=getattr(instance, 'revision_author', None),
+            message=getattr(instance, 'revision_message', '')
+        )
+
+
+@receiver(post_delete, sender=ProjectFile)
+def unindex_project_file(sender, instance, **kwargs):
+    project_index.remove_file(instance)
+
+
+@receiver(post_delete, sender=Project)
+def forget_project_index(sender, instance, **kwargs):
+    project_index.forget(instance.id)
+
+
+@receiver(post_delete, sender=Project)
+def forget_reconcile_state(sender, instance, **kwargs):
+    forget_project(instance.id)
@@ -0,0 +1,221 @@
+import errno
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+STAGING_DIR = '.staging'
+
+# ioctl that shares a file's extents with another (btrfs, XFS, bcachefs)
+FICLONE = 0x40049409
+# What a filesystem without reflinks (or a non-Linux kernel) answers with
+NO_REFLINK = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EBADF}
+
+
+class UnsafePathError(ValueError):
+    """A file path that would land outside its project directory"""
+    pass
+
+
+def project_dir(project_id: int) -> Path:
+    return Path(settings.PROJECTS_ROOT) / str(project_id)
+
+
+def safe_relative_path(path: str) -> str:
+    """Normalized POSIX form of a project-relative ``path``; rejects absolute and escaping paths."""
+    parts = []
+    for part in PurePosixPath(path.replace('\\', '/')).parts:
+        if part in ('', '.'):
+            continue
+        if part == '..' or part == '/' or ':' in part or '\0' in part:
+            raise UnsafePathError(f"Invalid file path: {path!r}")
+        parts.append(part)
+    if not parts:
+        raise UnsafePathError(f"Invalid file path: {path!r}")
+    return '/'.join(parts)
+
+
+def make_staging_dir() -> Path:
+    """An empty directory on the same filesystem as the projects, so it can be renamed into place"""
+    staging = Path(settings.PROJECTS_ROOT) / STAGING_DIR / uuid.uuid4().hex
+    staging.mkdir(parents=True)
+    return staging
+
+
+def _write(target: Path, content: str) -> None:
+    with open(target, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def write_files(root: Path, files: Iterable[Dict[str, str]], max_workers: int = None) -> int:
+    """
+    Write ``files`` (dicts with ``path`` and ``content``) under ``root``.
+
+    Every parent directory is created once up front, shallowest first, so
+    the writes themselves can fan out across a thread pool without racing
+    on ``makedirs``. Returns the number of bytes written.
+    """
+    files = list(files)
+    directories = sorted({(root / f['path']).parent for f in files}, key=lambda d: len(d.parts))
+    for directory in directories:
+        directory.mkdir(parents=True, exist_ok=True)
+
+    max_workers = max_workers or settings.PROJECT_WRITE_WORKERS
+    if len(files) <= 1 or max_workers <= 1:
+        for f in files:
+            _write(root / f['path'], f['content'])
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(files))) as pool:
+            # list() surfaces the first write error, if any
+            list(pool.map(lambda f: _write(root / f['path'], f['content']), files))
+    return sum(len(f['content'].encode('utf-8')) for f in files)
+
+
+def replace_file(target: Path, content: str) -> None:
+    """
+    Write ``content`` to a new inode and rename it over ``target``. Readers
+    never see a half-written file, and a file hardlinked into a cloned
+    project is split from its twin rather than changed under it.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        # mkstemp creates 0600; keep the mode a plain write would have left
+        os.chmod(tmp, stat.S_IMODE(os.stat(target).st_mode) if target.exists() else 0o644)
+        os.replace(tmp, target)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def check_writable(target: Path) -> None:
+    """Raise the OSError ``replace_file`` would, for a path blocked by a file or directory"""
+    if target.is_dir():
+        raise IsADirectoryError(errno.EISDIR, "Is a directory", str(target))
+    for parent in target.parents:
+        if parent.exists():
+            if not parent.is_dir():
+                raise NotADirectoryError(errno.ENOTDIR, "Not a directory", str(parent))
+            return
+
+
+def _reflink(source: Path, target: Path) -> None:
+    import fcntl
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def _supports_reflink(directory: Path) -> bool:
+    try:
+        import fcntl  # noqa: F401
+    except ImportError:
+        return False
+    probe = directory / '.reflink-probe'
+    clone = directory / '.reflink-probe-clone'
+    try:
+        probe.write_bytes(b'x')
+        _reflink(probe, clone)
+        return True
+    except OSError as e:
+        if e.errno in NO_REFLINK:
+            return False
+        raise
+    finally:
+        for path in (probe, clone):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _supports_hardlink(source: Path, target: Path) -> bool:
+    return settings.PROJECT_CLONE_HARDLINKS and os.stat(source).st_dev == os.stat(target).st_dev
+
+
+def clone_tree(source: Path, target: Path, max_workers: int = None) -> str:
+    """
+    Duplicate the directory ``source`` as ``target`` (which must exist and
+    be empty) as cheaply as the filesystem allows: reflinks share extents
+    copy-on-write; failing that, files are copied in parallel. Hardlinks,
+    which share inodes, are used instead of copies only when
+    PROJECT_CLONE_HARDLINKS is on, since a write that does not go through
+    ``replace_file`` changes the file in every project sharing it. Returns
+    the method used.
+    """
+    if _supports_reflink(target):
+        method, link = 'reflink', _reflink
+    elif _supports_hardlink(source, target):
+        method, link = 'hardlink', os.link
+    else:
+        method, link = 'copy', shutil.copyfile
+
+    files = []
+    for directory, dirnames, filenames in os.walk(source):
+        destination = os.path.join(target, os.path.relpath(directory, source))
+        for dirname in dirnames:
+            # os.walk lists directory symlinks here but does not follow them
+            path = os.path.join(directory, dirname)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(destination, dirname))
+            else:
+                os.mkdir(os.path.join(destination, dirname))
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(destination, filename))
+            else:
+                files.append((path, os.path.join(destination, filename)))
+
+    def place(pair):
+        src, dst = pair
+        try:
+            link(src, dst)
+        except OSError as e:
+            # Too many links to one inode, or a file on another mount
+            if method != 'hardlink' or e.errno not in (errno.EMLINK, errno.EXDEV, errno.EPERM):
+                raise
+            shutil.copyfile(src, dst)
+
+    max_workers = max_workers or settings.PROJECT_WRITE_WORKERS
+    # Links are metadata-only and contend on directory locks; only copies
+    # gain from threads
+    if method != 'copy' or len(files) <= 1 or max_workers <= 1:
+        for pair in files:
+            place(pair)
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(files))) as pool:
+            list(pool.map(place, files))
+    return method
+
+
+def remove_tree(path: Path) -> None:
+    """Best-effort removal, used when rolling back"""
+    try:
+        shutil.rmtree(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Could not remove {path}: {e}")
+
+
+def move_into_place(staging: Path, target: Path) -> None:
+    """Atomically rename a fully written staging directory to ``target``"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if target.exists():
+        # Left over from a project id that was rolled back; nothing references it
+        remove_tree(target)
+    os.rename(staging, target)
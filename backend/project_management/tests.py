@@ -1,3 +1,848 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+import zipfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import gitinfo, reconcile
+from .archives import ArchiveError, extract_archive
+from .autosave import AutosaveBuffer
+from .blobs import ZSTD_MAGIC, BlobNotFoundError, LocalBlobStore, blob_hash, get_blob_store
+from .gitjobs import GitJob, GitJobQueue
+from .history import apply_ops, blame, line_ops, revision_cache, revision_text
+from .models import FileRevision, Project, ProjectFile, ProjectSetting
+from .reconcile import reconcile_project
+from .retrieval import ProjectIndex, ProjectIndexRegistry, chunk_file, tokenize
+from .services import ProjectService
+from .storage import UnsafePathError, project_dir
+
+
+def streamed_content(response):
+    """The body of a response streamed from an async iterator"""
+    async def read():
+        return b''.join([chunk async for chunk in response.streaming_content])
+    return async_to_sync(read)()
+
+
+class StorageTestCase(TestCase):
+    """Runs against a temporary PROJECTS_ROOT and blob store."""
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.projects_root = f'{root}/projects'
+        settings_override = override_settings(PROJECTS_ROOT=self.projects_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch('project_management.blobs._store', LocalBlobStore(f'{root}/blobs'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = get_user_model().objects.create_user('owner', password='x')
+
+    def ingest(self, files, **kwargs):
+        return ProjectService.ingest_project(
+            'project', '', 'python', [{'path': path, 'content': content} for path, content in files.items()],
+            owner=self.user, **kwargs
+        )
+
+
+class ProjectIndexTests(SimpleTestCase):
+    def test_tokenize_splits_identifiers(self):
+        self.assertEqual(tokenize('parseHTTPResponse snake_case'), [
+            'parsehttpresponse', 'parse', 'http', 'response', 'snake_case', 'snake', 'case'
+        ])
+
+    def test_chunks_overlap(self):
+        content = ''.join(f'line {i}\n' for i in range(100))
+        chunks = chunk_file('a.py', content)
+        self.assertEqual([(c['start_line'], c['end_line']) for c in chunks], [(1, 40), (33, 72), (65, 100)])
+
+    def test_bm25_ranks_matching_files_and_forgets_removed_ones(self):
+        index = ProjectIndex()
+        index.update_file(1, 'auth.py', 'def check_password(user, password):\n    return verify(password)\n')
+        index.update_file(2, 'views.py', 'def render_page(request):\n    return template\n')
+        self.assertEqual([r['path'] for r in index.search('password check')], ['auth.py'])
+        index.update_file(1, 'auth.py', 'def logout(user):\n    pass\n')
+        self.assertEqual(index.search('password'), [])
+        index.remove_file(2)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.search('render'), [])
+
+
+class ProjectIndexRegistryTests(StorageTestCase):
+    def test_select_context_fits_the_budget(self):
+        project = self.ingest({'a.py': 'alpha_widget = 1\n' * 50, 'b.py': 'alpha_widget = 2\n'})
+        registry = ProjectIndexRegistry()
+        self.assertEqual([s['path'] for s in registry.select_context(project.id, 'alpha widget', max_tokens=20)],
+                         ['b.py'])
+
+    def test_lookups_pick_up_writes_made_elsewhere(self):
+        project = self.ingest({
+            'a.py': 'def alpha_widget():\n    pass\n',
+            'b.py': 'def beta_gadget():\n    pass\n',
+        })
+        # Stands in for another worker's index: the writes below reach it
+        # only through the database
+        registry = ProjectIndexRegistry()
+        self.assertEqual([s['path'] for s in registry.select_context(project.id, 'alpha widget')], ['a.py'])
+
+        row = ProjectFile.objects.get(project=project, file_path='a.py')
+        row.content = 'def gamma_thing():\n    pass\n'
+        row.save()
+        ProjectFile.objects.filter(project=project, file_path='b.py').update(file_path='c.py')
+        self.assertEqual(registry.select_context(project.id, 'alpha widget'), [])
+        self.assertEqual([s['path'] for s in registry.select_context(project.id, 'gamma thing')], ['a.py'])
+        self.assertEqual([s['path'] for s in registry.select_context(project.id, 'beta gadget')], ['c.py'])
+
+        ProjectFile.objects.filter(project=project, file_path='c.py').delete()
+        self.assertEqual(registry.select_context(project.id, 'beta gadget'), [])
+
+
+class IngestProjectTests(StorageTestCase):
+    def test_writes_files_rows_and_initial_revisions(self):
+        project = self.ingest({'src/app.py': 'print(1)\n', 'README.md': '# hi\n'})
+        root = project_dir(project.id)
+        with open(root / 'src/app.py', encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'print(1)\n')
+        rows = {row.file_path: row for row in ProjectFile.objects.filter(project=project)}
+        self.assertEqual(set(rows), {'src/app.py', 'README.md'})
+        self.assertEqual(rows['README.md'].content, '# hi\n')
+        self.assertEqual(rows['src/app.py'].disk_mtime_ns, os.stat(root / 'src/app.py').st_mtime_ns)
+        revisions = FileRevision.objects.filter(project_file__project=project)
+        self.assertEqual(sorted((r.number, r.kind) for r in revisions), [(1, FileRevision.SNAPSHOT)] * 2)
+        self.assertEqual(os.listdir(f'{self.projects_root}/.staging'), [])
+
+    def test_later_duplicates_win(self):
+        project = ProjectService.ingest_project(
+            'project', '', 'python',
+            [{'path': 'a.py', 'content': 'old'}, {'path': './a.py', 'content': 'new'}],
+            owner=self.user
+        )
+        self.assertEqual([row.content for row in ProjectFile.objects.filter(project=project)], ['new'])
+
+    def test_unsafe_paths_are_rejected(self):
+        for path in ('../escape.py', '/etc/passwd', 'C:/boot.ini'):
+            with self.assertRaises(UnsafePathError):
+                self.ingest({'ok.py': '', path: 'x'})
+        self.assertFalse(Project.objects.exists())
+
+    def test_failure_leaves_neither_rows_nor_directories(self):
+        with mock.patch('project_management.services.move_into_place', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self.ingest({'a.py': 'x = 1\n'})
+        self.assertFalse(Project.objects.exists())
+        self.assertFalse(ProjectFile.objects.exists())
+        self.assertEqual(os.listdir(self.projects_root), ['.staging'])
+        self.assertEqual(os.listdir(f'{self.projects_root}/.staging'), [])
+
+
+class FileListingTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = self.ingest({f'f{i}.py': f'x = {i}\n' for i in range(5)})
+        self.url = f'/api/project-management/projects/{self.project.id}'
+
+    def test_listing_pages_metadata_by_cursor(self):
+        seen = []
+        url = f'{self.url}/files/?page_size=2'
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 2)
+            for row in page['results']:
+                self.assertNotIn('content', row)
+            seen += [row['file_path'] for row in page['results']]
+            url = page['next']
+        self.assertEqual(seen, [f'f{i}.py' for i in range(5)])
+
+    def test_file_list_filters_by_project(self):
+        other = self.ingest({'other.py': ''})
+        response = self.client.get(f'/api/project-management/files/?project={other.id}')
+        self.assertEqual([row['file_path'] for row in response.json()['results']], ['other.py'])
+
+    def lines(self, response):
+        return [json.loads(line) for line in streamed_content(response).decode().splitlines()]
+
+    def test_stream_is_ndjson_with_optional_content(self):
+        response = self.client.get(f'{self.url}/files/stream/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = self.lines(response)
+        self.assertEqual([row['file_path'] for row in rows], [f'f{i}.py' for i in range(5)])
+        self.assertNotIn('content', rows[0])
+
+        rows = self.lines(self.client.get(f'{self.url}/files/stream/?content=true'))
+        self.assertEqual(rows[3]['content'], 'x = 3\n')
+
+
+class LocalBlobStoreTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.store = LocalBlobStore(root)
+
+    def test_round_trip(self):
+        for data in (b'', b'short', b'compressible line\n' * 1000, os.urandom(4096)):
+            digest = self.store.put(data)
+            self.assertEqual(digest, blob_hash(data))
+            self.assertTrue(self.store.exists(digest))
+            self.assertEqual(self.store.get(digest), data)
+
+    def test_compresses_only_what_shrinks(self):
+        text = self.store.put(b'compressible line\n' * 1000)
+        noise = self.store.put(os.urandom(4096))
+        with open(self.store._path(text), 'rb') as f:
+            self.assertEqual(f.read(4), ZSTD_MAGIC)
+        self.assertEqual(os.path.getsize(self.store._path(noise)), 4096)
+
+    def test_identical_content_is_stored_once(self):
+        first = self.store.put(b'same bytes')
+        path = self.store._path(first)
+        os.utime(path, (0, 0))
+        self.assertEqual(self.store.put(b'same bytes'), first)
+        self.assertEqual([digest for digest, _ in self.store.iter_blobs()], [first])
+        # Reuse counts as fresh use for prune_blobs
+        self.assertGreater(os.path.getmtime(path), 0)
+
+    def test_delete_respects_older_than(self):
+        digest = self.store.put(b'data')
+        self.store.delete(digest, older_than=time.time() - 3600)
+        self.assertTrue(self.store.exists(digest))
+        self.store.delete(digest)
+        self.assertFalse(self.store.exists(digest))
+        with self.assertRaises(BlobNotFoundError):
+            self.store.get(digest)
+
+    def test_malformed_digests_are_not_found(self):
+        self.assertFalse(self.store.exists('../../etc/passwd'))
+        with self.assertRaises(BlobNotFoundError):
+            self.store.get('../../etc/passwd')
+
+
+class PruneBlobsTests(StorageTestCase):
+    def age(self, digest):
+        os.utime(get_blob_store()._path(digest), (0, 0))
+
+    def test_deletes_only_old_unreferenced_blobs(self):
+        project = self.ingest({'a.py': 'kept = 1\n'})
+        row = ProjectFile.objects.get(project=project)
+        store = get_blob_store()
+        orphan = store.put(b'orphan')
+        recent = store.put(b'recent orphan')
+        for digest in (row.content_hash, orphan):
+            self.age(digest)
+
+        out = StringIO()
+        call_command('prune_blobs', '--dry-run', stdout=out)
+        self.assertIn('Would delete 1 of 2', out.getvalue())
+        self.assertTrue(store.exists(orphan))
+
+        call_command('prune_blobs', stdout=StringIO())
+        self.assertFalse(store.exists(orphan))
+        self.assertTrue(store.exists(recent))
+        self.assertEqual(ProjectFile.objects.get(pk=row.pk).content, 'kept = 1\n')
+
+    def test_old_content_kept_by_a_revision_snapshot_survives(self):
+        project = self.ingest({'a.py': 'first\n'})
+        row = ProjectFile.objects.get(project=project)
+        first = row.content_hash
+        row.content = 'second\n'
+        row.save()
+        self.age(first)
+        call_command('prune_blobs', stdout=StringIO())
+        self.assertTrue(get_blob_store().exists(first))
+
+
+class LineOpsTests(SimpleTestCase):
+    def round_trip(self, old, new):
+        old_lines = old.splitlines(keepends=True)
+        new_lines = new.splitlines(keepends=True)
+        self.assertEqual(''.join(apply_ops(old_lines, line_ops(old_lines, new_lines))), new)
+
+    def test_round_trip(self):
+        self.round_trip('', 'a\nb\n')
+        self.round_trip('a\nb\nc\n', 'a\nc\n')
+        self.round_trip('a\nb\nc\n', 'a\nB\nc\nd')
+        self.round_trip('a\r\nb\r\n', 'a\r\nb\r\nc\r\n')
+        self.round_trip('a\nb\n', '')
+
+    def test_unchanged_lines_are_copied(self):
+        old_lines = ['a\n', 'b\n', 'c\n']
+        ops = line_ops(old_lines, ['a\n', 'x\n', 'c\n'])
+        self.assertEqual(ops, [[0, 1], 'x\n', [2, 3]])
+
+
+class RevisionHistoryTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        revision_cache._entries.clear()
+        project = Project.objects.create(name='p', owner=self.user, programming_language='python')
+        self.file = ProjectFile(project=project, file_path='main.py', language='python')
+
+    def save(self, text):
+        self.file.content = text
+        self.file.revision_author = self.user
+        self.file.save()
+
+    def versions(self, count):
+        lines = [f'line {i}\n' for i in range(20)]
+        texts = []
+        for i in range(count):
+            lines[i % len(lines)] = f'changed {i}\n'
+            texts.append(''.join(lines))
+        return texts
+
+    @override_settings(REVISION_SNAPSHOT_INTERVAL=3)
+    def test_revisions_rebuild_from_nearest_snapshot(self):
+        texts = self.versions(7)
+        for text in texts:
+            self.save(text)
+        revisions = list(self.file.revisions.order_by('number'))
+        self.assertEqual([r.number for r in revisions], list(range(1, 8)))
+        self.assertEqual(
+            [r.kind for r in revisions],
+            ['snapshot', 'delta', 'delta', 'snapshot', 'delta', 'delta', 'snapshot']
+        )
+
+        revision_cache._entries.clear()
+        for number, text in enumerate(texts, start=1):
+            self.assertEqual(revision_text(self.file, number), text)
+
+    def test_unchanged_save_adds_no_revision(self):
+        self.save('a\n')
+        self.save('a\n')
+        self.assertEqual(self.file.revisions.count(), 1)
+
+    def test_large_rewrite_is_stored_as_snapshot(self):
+        self.save('a\nb\nc\nd\n')
+        self.save('w\nx\ny\nz\n')
+        self.assertEqual(self.file.revisions.get(number=2).kind, FileRevision.SNAPSHOT)
+
+    def test_missing_revision(self):
+        self.save('a\n')
+        with self.assertRaises(FileRevision.DoesNotExist):
+            revision_text(self.file, 2)
+
+    def test_blame(self):
+        body = ''.join(f'line {i}\n' for i in range(10))
+        self.save('first\n' + body)
+        self.save('first\n' + body + 'third\n')
+        self.save('second\n' + body + 'third\n')
+        lines = blame(self.file)
+        self.assertEqual([line['revision'] for line in lines], [3] + [1] * 10 + [2])
+        self.assertEqual(lines[0]['text'], 'second')
+        self.assertEqual(lines[0]['author'], 'owner')
+        self.assertEqual([line['revision'] for line in blame(self.file, 2)], [1] * 11 + [2])
+
+
+@override_settings(GIT_COMMIT_DEBOUNCE=0.2, GIT_COMMIT_MAX_DELAY=5, GIT_WORKER_IDLE_TIMEOUT=0.5)
+class GitJobQueueTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings_override = override_settings(PROJECTS_ROOT=root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.jobs = GitJobQueue()
+        self.path = project_dir(1)
+        init = self.jobs.submit_init(1, remote_url='https://example.com/repo.git')
+        self.assertTrue(init.wait(10))
+        self.assertEqual(init.status, GitJob.SUCCEEDED)
+
+    def write(self, path, text):
+        (self.path / path).parent.mkdir(parents=True, exist_ok=True)
+        (self.path / path).write_text(text)
+
+    def log(self, *args):
+        return subprocess.run(['git', 'log', *args], cwd=self.path, capture_output=True, text=True).stdout
+
+    def test_burst_of_saves_becomes_one_commit(self):
+        author = get_user_model()(username='ann', first_name='Ann', last_name='Lee')
+        self.write('a.py', 'a')
+        first = self.jobs.submit_commit(1, ['a.py'], 'Edit a', author=author)
+        self.write('src/b.py', 'b')
+        second = self.jobs.submit_commit(1, ['./src/b.py'], 'Edit b')
+        self.assertIs(first, second)
+        self.assertTrue(first.wait(10))
+        self.assertEqual(first.status, GitJob.SUCCEEDED)
+        self.assertEqual(first.requests, 2)
+        self.assertEqual(first.paths, ['a.py', 'src/b.py'])
+        self.assertEqual(self.log('--format=%an <%ae>%n%B'), 'Ann Lee <>\nUpdate 2 files\n\n- Edit a\n- Edit b\n')
+        self.assertEqual(self.log('--format=%H'), f'{first.commit}\n')
+
+        # The window has closed, so the next save starts a new job
+        os.remove(self.path / 'a.py')
+        third = self.jobs.submit_commit(1, ['a.py'], 'Remove a')
+        self.assertIsNot(third, first)
+        self.assertTrue(third.wait(10))
+        self.assertEqual(self.log('-1', '--name-status', '--format=%s'), 'Remove a\n\nD\ta.py\n')
+        self.assertEqual([job.id for job in self.jobs.jobs_for(1)][:2], [third.id, first.id])
+
+    def test_nothing_to_commit(self):
+        job = self.jobs.submit_commit(1, ['missing.py'])
+        self.assertTrue(job.wait(10))
+        self.assertEqual(job.status, GitJob.SUCCEEDED)
+        self.assertIsNone(job.commit)
+
+    def test_commit_without_repository_fails(self):
+        job = self.jobs.submit_commit(2, ['a.py'])
+        self.assertTrue(job.wait(10))
+        self.assertEqual(job.status, GitJob.FAILED)
+        self.assertEqual(job.error, 'Git repository not initialized')
+        self.assertIs(self.jobs.get(job.id), job)
+
+    def test_idle_workers_retire(self):
+        worker = self.jobs._workers[1]
+        worker.thread.join(10)
+        self.assertFalse(worker.thread.is_alive())
+        self.assertNotIn(1, self.jobs._workers)
+
+
+class GitInfoTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings_override = override_settings(PROJECTS_ROOT=root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for cache in (gitinfo._status_cache, gitinfo._log_cache):
+            cache._entries.clear()
+        gitinfo._configured.clear()
+        self.path = project_dir(1)
+        self.path.mkdir(parents=True)
+        self.git('init', '-q', '-b', 'main')
+
+    def git(self, *args):
+        return subprocess.run(
+            ['git', '-c', 'user.name=Ann', '-c', 'user.email=ann@example.com', *args],
+            cwd=self.path, check=True, capture_output=True, text=True
+        ).stdout
+
+    def write(self, path, text):
+        (self.path / path).write_text(text)
+        gitinfo.invalidate_status(1)
+
+    def commit(self, message, *paths):
+        self.git('add', '-A', '--', *paths)
+        self.git('commit', '-q', '-m', message)
+        return self.git('rev-parse', 'HEAD').strip()
+
+    def test_status_of_a_new_repository(self):
+        self.write('new file.py', 'x')
+        self.assertEqual(gitinfo.status(1), {
+            'branch': 'main', 'head': None,
+            'staged': [], 'modified': [], 'deleted': [], 'untracked': ['new file.py'], 'conflicted': [],
+        })
+
+    def test_status_sorts_changes(self):
+        for name in ('edited.py', 'gone.py', 'old name.py', 'staged.py'):
+            self.write(name, f'{name}\n' * 5)
+        head = self.commit('Initial')
+        self.write('edited.py', 'changed\n')
+        os.remove(self.path / 'gone.py')
+        self.git('mv', 'old name.py', 'new name.py')
+        self.write('staged.py', 'staged\n')
+        self.git('add', 'staged.py')
+        self.write('ünïcode.py', '')
+
+        status = gitinfo.status(1)
+        self.assertEqual(status['head'], head)
+        self.assertEqual(sorted(status['staged']), ['new name.py', 'staged.py'])
+        self.assertEqual(status['modified'], ['edited.py'])
+        self.assertEqual(status['deleted'], ['gone.py'])
+        self.assertEqual(status['untracked'], ['ünïcode.py'])
+
+    def test_status_reports_conflicts(self):
+        output = '\0'.join([
+            '# branch.oid ' + 'a' * 40, '# branch.head (detached)',
+            'u UU N... 100644 100644 100644 100644 ' + ' '.join(['b' * 40] * 3) + ' both edited.py', '',
+        ])
+        with mock.patch('project_management.gitinfo._run', return_value=output):
+            status = gitinfo.status(1)
+        self.assertIsNone(status['branch'])
+        self.assertEqual(status['head'], 'a' * 40)
+        self.assertEqual(status['conflicted'], ['both edited.py'])
+
+    def test_status_is_cached_until_invalidated(self):
+        self.write('a.py', 'a')
+        self.assertEqual(gitinfo.status(1)['untracked'], ['a.py'])
+        (self.path / 'b.py').write_text('b')
+        self.assertEqual(gitinfo.status(1)['untracked'], ['a.py'])
+        gitinfo.invalidate_status(1)
+        self.assertEqual(gitinfo.status(1)['untracked'], ['a.py', 'b.py'])
+
+    def test_log_pages_from_a_fixed_head(self):
+        hashes = []
+        for i in range(3):
+            self.write(f'{i}.py', str(i))
+            hashes.append(self.commit(f'Commit {i}\n\nBody {i}'))
+        page = gitinfo.log(1, limit=2)
+        self.assertEqual([c['hash'] for c in page['commits']], hashes[:0:-1])
+        self.assertEqual(page['commits'][0]['message'], 'Commit 2\n\nBody 2')
+        self.assertEqual(page['commits'][0]['files'], ['2.py'])
+        self.assertEqual(page['commits'][0]['email'], 'ann@example.com')
+        self.assertTrue(page['has_more'])
+
+        self.write('3.py', '3')
+        self.commit('Commit 3')
+        rest = gitinfo.log(1, head=page['head'], offset=2, limit=2)
+        self.assertEqual([c['hash'] for c in rest['commits']], hashes[:1])
+        self.assertFalse(rest['has_more'])
+
+    def test_diff_and_refs(self):
+        self.write('a.py', 'one\n')
+        first = self.commit('First')
+        self.write('a.py', 'two\n')
+        stream = gitinfo.open_diff(1, old=first)
+        try:
+            diff = stream.read().decode()
+        finally:
+            stream.close()
+        self.assertIn('-one\n+two\n', diff)
+        for ref in ('--output=/tmp/x', 'HEAD;rm'):
+            with self.assertRaises(gitinfo.GitQueryError):
+                gitinfo.resolve(1, ref)
+        with self.assertRaisesMessage(gitinfo.GitQueryError, 'Unknown revision'):
+            gitinfo.open_diff(1, old='missing')
+
+    def test_missing_repository(self):
+        with self.assertRaises(gitinfo.RepositoryNotFound):
+            gitinfo.status(2)
+
+
+def make_tar(*members):
+    """A tar.gz of ``(name, data)`` members; ``None`` data makes a symlink"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            if data is None:
+                info.type = tarfile.SYMTYPE
+                info.linkname = '/etc/passwd'
+                archive.addfile(info)
+            else:
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+def make_zip(*members):
+    """A zip of ``(name, data)`` members; ``None`` data makes a symlink"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members:
+            if data is None:
+                info = zipfile.ZipInfo(name)
+                info.external_attr = 0o120777 << 16
+                archive.writestr(info, '/etc/passwd')
+            else:
+                archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+class ExtractArchiveTests(SimpleTestCase):
+    def setUp(self):
+        self.target = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.target)
+
+    def extract(self, upload, strip_components=0):
+        return list(extract_archive(upload, self.target, strip_components))
+
+    def test_extracts_tar_and_zip(self):
+        for upload in (make_tar(('src/a.py', b'a\n'), ('b.txt', b'b')),
+                       make_zip(('src/a.py', b'a\n'), ('b.txt', b'b'))):
+            self.assertEqual(self.extract(upload), [('src/a.py', 2, b'a\n'), ('b.txt', 1, b'b')])
+        self.assertEqual((self.target / 'src' / 'a.py').read_bytes(), b'a\n')
+
+    def test_strip_components(self):
+        upload = make_tar(('project-1.0/src/a.py', b'a'), ('README', b'top'))
+        self.assertEqual(self.extract(upload, strip_components=1), [('src/a.py', 1, b'a')])
+
+    def test_rejects_escaping_paths(self):
+        for name in ('../evil.py', 'src/../../evil.py', '/etc/evil', 'c:/evil.py'):
+            for upload in (make_tar((name, b'x')), make_zip((name, b'x'))):
+                with self.subTest(name=name), self.assertRaises(UnsafePathError):
+                    self.extract(upload)
+        self.assertFalse((self.target.parent / 'evil.py').exists())
+
+    def test_rejects_links(self):
+        for upload in (make_tar(('link', None)), make_zip(('link', None))):
+            with self.assertRaisesMessage(ArchiveError, 'Unsupported archive member'):
+                self.extract(upload)
+
+    def test_rejects_file_and_directory_clash(self):
+        with self.assertRaisesMessage(ArchiveError, "Cannot extract 'a/b'"):
+            self.extract(make_tar(('a', b'file'), ('a/b', b'nested')))
+
+    @override_settings(PROJECT_IMPORT_MAX_FILES=1)
+    def test_file_count_limit(self):
+        with self.assertRaisesMessage(ArchiveError, 'PROJECT_IMPORT_MAX_FILES'):
+            self.extract(make_tar(('a', b'a'), ('b', b'b')))
+
+    @override_settings(PROJECT_IMPORT_MAX_BYTES=4)
+    def test_size_limit(self):
+        with self.assertRaisesMessage(ArchiveError, 'PROJECT_IMPORT_MAX_BYTES'):
+            self.extract(make_zip(('a', b'abc'), ('b', b'def')))
+
+    def test_rejects_non_archives(self):
+        with self.assertRaisesMessage(ArchiveError, 'not a tar or zip'):
+            self.extract(io.BytesIO(b'plain text'))
+
+
+class ArchiveImportTests(StorageTestCase):
+    url = '/api/project-management/projects/'
+
+    def setUp(self):
+        super().setUp()
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def upload(self, **fields):
+        archive = make_tar(
+            ('repo/a.py', b'old'), ('repo/.git/HEAD', b'ref: refs/heads/main\n'),
+            ('repo/logo.png', b'\x89PNG\xff'), ('repo/a.py', b'new'),
+        )
+        return self.api.post(f'{self.url}import/', {
+            'archive': SimpleUploadedFile('repo.tar.gz', archive.read()), 'name': 'Imported', **fields,
+        }, format='multipart')
+
+    def test_import_tracks_text_files_only(self):
+        response = self.upload(strip_components=1)
+        self.assertEqual(response.status_code, 201, response.content)
+        project = Project.objects.get(pk=response.json()['id'])
+        self.assertEqual(project.owner, self.user)
+        self.assertEqual([(f.file_path, f.content) for f in ProjectFile.objects.filter(project=project)],
+                         [('a.py', 'new')])
+        root = project_dir(project.id)
+        self.assertEqual((root / 'logo.png').read_bytes(), b'\x89PNG\xff')
+        self.assertTrue((root / '.git' / 'HEAD').exists())
+
+    def test_import_requires_authentication(self):
+        self.api.force_authenticate(None)
+        self.assertEqual(self.upload().status_code, 401)
+        self.assertFalse(Project.objects.exists())
+
+    def test_bad_archive_is_rejected_and_leaves_nothing(self):
+        response = self.api.post(f'{self.url}import/', {
+            'archive': SimpleUploadedFile('x.tar', b'not an archive'), 'name': 'Broken',
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Project.objects.exists())
+        self.assertEqual(os.listdir(f'{self.projects_root}/.staging'), [])
+
+    def test_export_round_trip(self):
+        project = self.ingest({'src/a.py': 'a\n', 'b.txt': 'b'})
+        response = self.api.get(f'{self.url}{project.id}/export/?type=zip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="project.zip"')
+        with zipfile.ZipFile(io.BytesIO(streamed_content(response))) as archive:
+            self.assertEqual(sorted(archive.namelist()), ['b.txt', 'src/a.py'])
+            self.assertEqual(archive.read('src/a.py'), b'a\n')
+        self.assertEqual(self.api.get(f'{self.url}{project.id}/export/?type=rar').status_code, 400)
+
+
+class CloneProjectTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = self.ingest({'src/a.py': 'a = 1\n', 'gone.py': 'x'})
+        ProjectSetting.objects.create(project=self.source, tab_size=2)
+        ProjectFile.objects.filter(project=self.source, file_path='gone.py').update(deleted_at=timezone.now())
+        self.cloner = get_user_model().objects.create_user('cloner', email='cloner@example.com', password='x')
+        self.api = APIClient()
+        self.url = f'/api/project-management/projects/{self.source.id}/clone/'
+
+    def test_clone_copies_files_settings_and_history(self):
+        self.api.force_authenticate(self.cloner)
+        response = self.api.post(self.url, {'name': 'Fork'}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        clone = Project.objects.get(pk=response.json()['id'])
+        self.assertEqual((clone.name, clone.owner), ('Fork', self.cloner))
+        self.assertEqual(clone.metadata['cloned_from'], self.source.id)
+        self.assertEqual(clone.projectsetting.tab_size, 2)
+
+        row = ProjectFile.objects.get(project=clone)
+        source_row = ProjectFile.objects.get(project=self.source, file_path='src/a.py')
+        self.assertEqual((row.file_path, row.content_hash), ('src/a.py', source_row.content_hash))
+        self.assertEqual(row.created_by, self.cloner)
+        self.assertEqual(row.content, 'a = 1\n')
+        self.assertEqual(list(row.revisions.values_list('number', 'kind')), [(1, FileRevision.SNAPSHOT)])
+        self.assertEqual((project_dir(clone.id) / 'src/a.py').read_text(), 'a = 1\n')
+
+    def test_writes_to_a_clone_leave_the_source_alone(self):
+        clone = ProjectService.clone_project(self.source, owner=self.cloner)
+        self.assertEqual(clone.name, 'project (copy)')
+        ProjectService.update_project_file(clone, 'src/a.py', 'a = 2\n', author=self.cloner)
+        self.assertEqual((project_dir(self.source.id) / 'src/a.py').read_text(), 'a = 1\n')
+        self.assertEqual(ProjectFile.objects.get(project=self.source, file_path='src/a.py').content, 'a = 1\n')
+
+    def test_clone_requires_authentication(self):
+        response = self.api.post(self.url, {}, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(Project.objects.count(), 1)
+
+
+class ReconcileTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = self.ingest({'a.py': 'a = 1\n', 'b.py': 'b = 1\n'})
+        self.root = project_dir(self.project.id)
+
+    def write(self, path, data):
+        (self.root / path).write_bytes(data)
+        # Far enough from the ingest that the stat differs on any filesystem
+        os.utime(self.root / path, ns=(10 ** 18, 10 ** 18))
+
+    def reconcile(self):
+        counts = reconcile_project(self.project, max_files_per_second=0)
+        return {key: value for key, value in counts.items() if value and key != 'scanned'}
+
+    def test_unchanged_files_are_not_read(self):
+        with mock.patch('project_management.reconcile._read_text') as read:
+            self.assertEqual(self.reconcile(), {})
+        read.assert_not_called()
+
+    def test_outside_changes_are_picked_up(self):
+        self.write('a.py', b'a = 2\n')
+        self.write('new.py', b'new\n')
+        os.remove(self.root / 'b.py')
+        self.assertEqual(self.reconcile(), {'hashed': 2, 'changed': 1, 'added': 1, 'deleted': 1})
+
+        rows = {row.file_path: row for row in ProjectFile.objects.filter(project=self.project)}
+        self.assertEqual(rows['a.py'].content, 'a = 2\n')
+        self.assertEqual(list(rows['a.py'].revisions.values_list('number', 'message')),
+                         [(1, 'Initial version'), (2, 'Changed on disk')])
+        self.assertEqual(rows['new.py'].content, 'new\n')
+        self.assertIsNotNone(rows['b.py'].deleted_at)
+        self.assertEqual(self.reconcile(), {})
+
+        self.write('b.py', b'b = 1\n')
+        self.assertEqual(self.reconcile(), {'hashed': 1, 'restored': 1})
+        self.assertIsNone(ProjectFile.objects.get(project=self.project, file_path='b.py').deleted_at)
+
+    def test_untracked_files_are_remembered_until_they_change_or_go(self):
+        self.write('logo.png', b'\x89PNG\xff')
+        self.assertEqual(self.reconcile(), {'hashed': 1})
+        self.assertEqual(set(reconcile._untracked[self.project.id]), {'logo.png'})
+        self.assertEqual(self.reconcile(), {})
+
+        self.write('logo.png', b'now text')
+        os.utime(self.root / 'logo.png', ns=(2 * 10 ** 18, 2 * 10 ** 18))
+        self.assertEqual(self.reconcile(), {'hashed': 1, 'added': 1})
+        self.assertNotIn(self.project.id, reconcile._untracked)
+
+        self.write('data.bin', b'\xff\xfe')
+        self.reconcile()
+        os.remove(self.root / 'data.bin')
+        self.reconcile()
+        self.assertNotIn(self.project.id, reconcile._untracked)
+
+    def test_deleted_projects_are_forgotten(self):
+        self.write('logo.png', b'\x89PNG\xff')
+        self.reconcile()
+        self.assertIn(self.project.id, reconcile._untracked)
+        self.project.delete()
+        self.assertNotIn(self.project.id, reconcile._untracked)
+
+
+
+@override_settings(AUTOSAVE_BUFFER='memory', WEB_CONCURRENCY=1, AUTOSAVE_MAX_ATTEMPTS=2)
+class AutosaveTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = self.ingest({'a.py': 'a = 0\n'})
+        self.buffer = AutosaveBuffer()
+        # Flushed by the tests, not the background thread
+        self.buffer._start = mock.Mock()
+        patcher = mock.patch('project_management.views.autosave_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def autosave(self, path, content):
+        return self.api.post('/api/project-management/files/autosave/',
+                             {'project': self.project.id, 'path': path, 'content': content}, format='json')
+
+    def flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.buffer.flush()
+
+    def row(self, path='a.py'):
+        return ProjectFile.objects.get(project=self.project, file_path=path)
+
+    def test_repeated_autosaves_are_written_once(self):
+        for i in range(1, 4):
+            self.assertEqual(self.autosave('a.py', f'a = {i}\n').status_code, 202)
+        self.assertEqual(self.autosave('new.py', 'n\n').status_code, 202)
+        # Reads see the buffered text before it is written
+        self.assertEqual(self.api.get(f'/api/project-management/files/{self.row().id}/').json()['content'], 'a = 3\n')
+        self.assertEqual(self.row().content, 'a = 0\n')
+
+        self.assertEqual(self.flush(), 2)
+        self.assertEqual(self.row().content, 'a = 3\n')
+        self.assertEqual((project_dir(self.project.id) / 'a.py').read_text(), 'a = 3\n')
+        self.assertEqual(list(self.row().revisions.values_list('number', 'message')),
+                         [(1, 'Initial version'), (2, 'Autosave')])
+        self.assertEqual(self.row('new.py').content, 'n\n')
+        self.assertEqual(self.flush(), 0)
+
+    def test_explicit_save_drops_the_buffered_autosave(self):
+        self.autosave('a.py', 'autosaved\n')
+        response = self.api.patch(f'/api/project-management/files/{self.row().id}/', {'content': 'explicit\n'},
+                                  format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIsNone(self.buffer.pending(self.project.id, 'a.py'))
+        self.assertEqual(self.flush(), 0)
+        self.assertEqual(self.row().content, 'explicit\n')
+
+    def test_busy_database_is_retried_and_broken_saves_dropped(self):
+        self.buffer.save(self.project, 'a.py', 'a = 1\n')
+        self.buffer.save(self.project, 'b.py', 'b = 1\n')
+        real_update = ProjectService.update_project_file
+
+        def update(project, file_path, *args, **kwargs):
+            if file_path == 'a.py':
+                raise OperationalError('database is locked')
+            if file_path == 'b.py':
+                raise ValueError('broken')
+            return real_update(project, file_path, *args, **kwargs)
+
+        with mock.patch('project_management.autosave.project_service.update_project_file', side_effect=update):
+            self.assertEqual(self.flush(), 0)
+            self.assertEqual(self.buffer.pending(self.project.id, 'a.py').attempts, 1)
+            self.assertIsNone(self.buffer.pending(self.project.id, 'b.py'))
+            self.assertEqual(self.flush(), 0)
+        # Out of attempts
+        self.assertIsNone(self.buffer.pending(self.project.id, 'a.py'))
+
+    def test_unwritable_paths_are_refused_up_front(self):
+        self.assertEqual(self.autosave('../escape.py', 'x').status_code, 400)
+        self.assertEqual(self.autosave('a.py/nested.py', 'x').status_code, 400)
+        self.assertEqual(self.flush(), 0)
+
+    @override_settings(AUTOSAVE_BUFFER='off')
+    def test_off_writes_through(self):
+        response = self.autosave('a.py', 'a = 1\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.row().content, 'a = 1\n')
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_memory_buffer_is_refused_with_several_workers(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.buffer.save(self.project, 'a.py', 'a = 1\n')
@@ -1,20 +1,70 @@
+import io
 from django.shortcuts import render
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Project, ProjectFile, ProjectSetting
-from .serializers import ProjectSerializer, ProjectFileSerializer, ProjectSettingSerializer
+from rest_framework.pagination import CursorPagination
+from django.conf import settings
+from django.db.models import Count, Q
+from django.http import StreamingHttpResponse
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.parsers import MultiPartParser
+from django.utils.text import slugify
+from .models import FileRevision, Project, ProjectFile, ProjectSetting
+from .serializers import (
+    ProjectSerializer,
+    ProjectFileSerializer,
+    ProjectFileMetadataSerializer,
+    ProjectSettingSerializer,
+    FileRevisionSerializer,
+)
+from . import history
+from . import gitinfo
+from .archives import FORMATS, ArchiveError, stream_project_archive
+from .autosave import autosave_buffer
+from .blobs import blob_hash
+from .gitjobs import git_jobs
+from .reconcile import reconcile_project
 from .services import project_service
-from asgiref.sync import async_to_sync
-import git
-import os
+from .storage import UnsafePathError, project_dir
+from asgiref.sync import async_to_sync, sync_to_async
 
 # Create your views here.
 
+async def stream_blob(stream, chunk_size=64 * 1024):
+    """Async chunks of a blob stream, so ASGI sends them as they are read"""
+    read = sync_to_async(stream.read, thread_sensitive=False)
+    try:
+        while True:
+            chunk = await read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        stream.close()
+
+class ProjectFileCursorPagination(CursorPagination):
+    """Stable pages over a file listing, however many files are added meanwhile"""
+    ordering = ('file_path', 'id')
+    page_size = settings.PROJECT_FILES_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+class FileRevisionCursorPagination(CursorPagination):
+    ordering = '-number'
+    page_size = settings.PROJECT_FILES_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
 class ProjectViewSet(viewsets.ModelViewSet):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
 
+    def get_queryset(self):
+        return Project.objects.select_related('owner', 'projectsetting').annotate(
+            file_count=Count('projectfile', filter=Q(projectfile__deleted_at__isnull=True))
+        ).order_by('-updated_at', 'id')
+
     def create(self, request):
         name = request.data.get('name')
         description = request.data.get('description')
@@ -36,14 +86,16 @@ class ProjectViewSet(viewsets.ModelViewSet):
                     description=description,
                     language=language,
                     ai_prompt=ai_prompt,
-                    git_repo_url=git_repo_url
+                    git_repo_url=git_repo_url,
+                    owner=request.user
                 )
             else:
                 project = Project.objects.create(
                     name=name,
                     description=description,
-                    language=language,
-                    git_repo_url=git_repo_url
+                    programming_language=language,
+                    git_repo_url=git_repo_url,
+                    owner=request.user
                 )
 
             serializer = self.get_serializer(project)
@@ -55,11 +107,110 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=True, methods=['post'])
+    def reconcile(self, request, pk=None):
+        """Bring the file rows in line with the project directory now"""
+        project = self.get_object()
+        return Response(reconcile_project(project))
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def clone(self, request, pk=None):
+        """
+        Fork the project, files and history starting points included, under
+        a new ``name`` (default: "<name> (copy)"). Any project can serve as
+        a template this way; the fork belongs to whoever cloned it.
+        """
+        source = self.get_object()
+        try:
+            project = project_service.clone_project(
+                source,
+                owner=request.user,
+                name=request.data.get('name'),
+                description=request.data.get('description')
+            )
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        project = self.get_queryset().get(pk=project.pk)
+        return Response(self.get_serializer(project).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """
+        The project directory as an archive, streamed as it is built.
+        ?type=tar.gz (default), tar or zip; ?include_git=1 adds .git. (Not
+        ?format=, which DRF reserves for picking a renderer.)
+        """
+        project = self.get_object()
+        fmt = request.query_params.get('type', 'tar.gz')
+        if fmt not in FORMATS:
+            return Response(
+                {'error': f"Type must be one of {', '.join(FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        root = project_dir(project.id)
+        if not root.is_dir():
+            return Response({'error': 'Project has no files on disk'}, status=status.HTTP_404_NOT_FOUND)
+
+        response = StreamingHttpResponse(
+            stream_project_archive(root, fmt, request.query_params.get('include_git') in ('1', 'true')),
+            content_type=FORMATS[fmt][0]
+        )
+        filename = slugify(project.name) or f'project-{project.id}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser],
+            permission_classes=[permissions.IsAuthenticated])
+    def import_archive(self, request):
+        """
+        Create a project from an uploaded tar, tar.gz or zip (``archive``),
+        with ``name``, ``description`` and ``language`` fields.
+        ?strip_components= drops leading path components, as tar does.
+        """
+        archive = request.FILES.get('archive')
+        name = request.data.get('name')
+        if archive is None or not name:
+            return Response({'error': 'An archive and a name are required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            project = project_service.import_archive(
+                name=name,
+                description=request.data.get('description', ''),
+                language=request.data.get('language', ''),
+                archive=archive,
+                owner=request.user,
+                strip_components=int(request.data.get('strip_components', 0))
+            )
+        except (ArchiveError, UnsafePathError, ValueError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        project = self.get_queryset().get(pk=project.pk)
+        return Response(self.get_serializer(project).data, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['get'])
     def files(self, request, pk=None):
+        """File metadata (no content), a cursor page at a time"""
+        project = self.get_object()
+        paginator = ProjectFileCursorPagination()
+        page = paginator.paginate_queryset(project_service.list_project_files(project), request, view=self)
+        serializer = ProjectFileMetadataSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'], url_path='files/stream')
+    def stream_files(self, request, pk=None):
+        """
+        Every file as NDJSON, read and sent in chunks; ``?content=true``
+        includes each file's content.
+        """
         project = self.get_object()
-        files = project_service.get_project_files(project)
-        return Response(files)
+        include_content = request.query_params.get('content', '').lower() in ('1', 'true')
+        response = StreamingHttpResponse(
+            project_service.stream_project_files(project, include_content),
+            content_type='application/x-ndjson'
+        )
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
     @action(detail=True, methods=['post'])
     def init_git(self, request, pk=None):
@@ -70,21 +221,100 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        job = git_jobs.submit_init(project.id, project.git_repo_url)
+        return Response(job.to_dict(), status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'], url_path='git/status')
+    def git_status(self, request, pk=None):
+        """Branch, staged, modified, deleted, untracked and conflicted paths"""
+        project = self.get_object()
         try:
-            # Initialize git repository
-            repo = git.Repo.init(project.name)
-            # Add remote origin
-            origin = repo.create_remote('origin', project.git_repo_url)
-            return Response({"status": "Git repository initialized"})
-        except Exception as e:
-            return Response(
-                {"error": str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            return Response(gitinfo.status(project.id))
+        except gitinfo.RepositoryNotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except gitinfo.GitQueryError as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=True, methods=['get'], url_path='git/diff')
+    def git_diff(self, request, pk=None):
+        """
+        Streamed unified diff. ?from= and ?to= pick revisions (default: the
+        working tree against the index), ?staged=1 diffs the index against
+        HEAD, and ?path= (repeatable) limits it to some files.
+        """
+        project = self.get_object()
+        params = request.query_params
+        try:
+            stream = gitinfo.open_diff(
+                project.id,
+                old=params.get('from') or None,
+                new=params.get('to') or None,
+                staged=params.get('staged') in ('1', 'true'),
+                paths=params.getlist('path'),
+                context=int(params.get('context', 3))
             )
+        except gitinfo.RepositoryNotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except (gitinfo.GitQueryError, ValueError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return StreamingHttpResponse(stream_blob(stream), content_type='text/x-diff; charset=utf-8')
+
+    @action(detail=True, methods=['get'], url_path='git/log')
+    def git_log(self, request, pk=None):
+        """
+        Commit history, newest first, in pages of ?limit=. Follow ``next``,
+        which pins the HEAD the first page started from.
+        """
+        project = self.get_object()
+        params = request.query_params
+        try:
+            offset = max(int(params.get('offset', 0)), 0)
+            limit = min(max(int(params.get('limit', settings.GIT_LOG_PAGE_SIZE)), 1), 500)
+            page = gitinfo.log(project.id, head=params.get('head') or None, offset=offset, limit=limit)
+        except gitinfo.RepositoryNotFound as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except (gitinfo.GitQueryError, ValueError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        next_url = None
+        if page['has_more']:
+            next_url = replace_query_param(request.build_absolute_uri(), 'head', page['head'])
+            next_url = replace_query_param(next_url, 'offset', offset + limit)
+        return Response({'head': page['head'], 'next': next_url, 'results': page['commits']})
+
+    @action(detail=True, methods=['get'], url_path='git/jobs')
+    def list_git_jobs(self, request, pk=None):
+        """Recent git jobs for the project, newest first"""
+        project = self.get_object()
+        return Response([job.to_dict() for job in git_jobs.jobs_for(project.id)])
+
+    @action(detail=True, methods=['get'], url_path=r'git/jobs/(?P<job_id>[0-9a-f]{32})')
+    def git_job_status(self, request, pk=None, job_id=None):
+        project = self.get_object()
+        job = git_jobs.get(job_id)
+        if job is None or job.project_id != project.id:
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job.to_dict())
 
 class ProjectFileViewSet(viewsets.ModelViewSet):
     queryset = ProjectFile.objects.all()
     serializer_class = ProjectFileSerializer
+    pagination_class = ProjectFileCursorPagination
+
+    def get_queryset(self):
+        queryset = ProjectFile.objects.all()
+        if self.action == 'list':
+            # Listings are metadata only; content is fetched per file via retrieve
+            queryset = queryset.only(*ProjectFileMetadataSerializer.Meta.fields).filter(deleted_at__isnull=True)
+            project_id = self.request.query_params.get('project')
+            if project_id:
+                queryset = queryset.filter(project_id=project_id)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ProjectFileMetadataSerializer
+        return ProjectFileSerializer
 
     def create(self, request):
         project_id = request.data.get('project')
@@ -99,7 +329,12 @@ class ProjectFileViewSet(viewsets.ModelViewSet):
 
         try:
             project = Project.objects.get(id=project_id)
-            file_obj = project_service.update_project_file(project, path, content)
+            autosave_buffer.discard(project.id, path)
+            file_obj = project_service.update_project_file(
+                project, path, content,
+                author=request.user if request.user.is_authenticated else None,
+                message=request.data.get('message', '')
+            )
             serializer = self.get_serializer(file_obj)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -108,39 +343,181 @@ class ProjectFileViewSet(viewsets.ModelViewSet):
                 {'error': 'Project not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except UnsafePathError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def perform_update(self, serializer):
+        # Through the service, so the file on disk changes with the row
+        instance = serializer.instance
+        autosave_buffer.discard(instance.project_id, instance.file_path)
+        serializer.instance = project_service.update_project_file(
+            instance.project,
+            instance.file_path,
+            serializer.validated_data.get('content', instance.content),
+            author=self.request.user if self.request.user.is_authenticated else None
+        )
+
     def destroy(self, request, *args, **kwargs):
         file_obj = self.get_object()
-        project_service.delete_project_file(file_obj.project, file_obj.path)
+        autosave_buffer.discard(file_obj.project_id, file_obj.file_path)
+        project_service.delete_project_file(file_obj.project, file_obj.file_path)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def retrieve(self, request, *args, **kwargs):
+        file_obj = self.get_object()
+        pending = autosave_buffer.pending(file_obj.project_id, file_obj.file_path)
+        if pending is not None:
+            # Not saved yet, but what the editor last sent
+            file_obj.content = pending.content
+        return Response(self.get_serializer(file_obj).data)
+
+    @action(detail=False, methods=['post'])
+    def autosave(self, request):
+        """
+        Save a file from the editor's autosave. Acknowledged from the autosave
+        buffer (202) and written with the next flush, or written at once (200)
+        when buffering is off or the buffer cannot take it.
+        """
+        project_id = request.data.get('project')
+        path = request.data.get('path')
+        content = request.data.get('content')
+        if not project_id or not path or content is None:
+            return Response(
+                {'error': 'Project ID, path, and content are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        author = request.user if request.user.is_authenticated else None
+        try:
+            project = Project.objects.get(id=project_id)
+            pending = autosave_buffer.save(project, path, content, author=author)
+            if pending is not None:
+                return Response(pending.to_dict(), status=status.HTTP_202_ACCEPTED)
+            autosave_buffer.discard(project.id, path)
+            file_obj = project_service.update_project_file(project, path, content, author=author)
+            return Response(self.get_serializer(file_obj).data)
+        except Project.DoesNotExist:
+            return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
+        except UnsafePathError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except UnicodeEncodeError:
+            return Response({'error': 'Content is not valid text'}, status=status.HTTP_400_BAD_REQUEST)
+        except OSError as e:
+            return Response({'error': f'Cannot write {path}: {e.strerror}'}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['get'])
+    def raw(self, request, pk=None):
+        """The file's content as text, streamed from the blob store"""
+        file_obj = self.get_object()
+        pending = autosave_buffer.pending(file_obj.project_id, file_obj.file_path)
+        if pending is not None:
+            data = pending.content.encode('utf-8')
+            response = StreamingHttpResponse(stream_blob(io.BytesIO(data)), content_type='text/plain; charset=utf-8')
+            response['Content-Length'] = len(data)
+            response['ETag'] = f'"{blob_hash(data)}"'
+            return response
+        response = StreamingHttpResponse(
+            stream_blob(file_obj.open_content()),
+            content_type='text/plain; charset=utf-8'
+        )
+        response['Content-Length'] = file_obj.size
+        response['ETag'] = f'"{file_obj.content_hash}"'
+        return response
+
+    def _revision_number(self, request, name, default=None):
+        value = request.query_params.get(name, request.data.get(name) if request.method == 'POST' else None)
+        if value in (None, ''):
+            return default
+        return int(value)
+
+    @action(detail=True, methods=['get'])
+    def revisions(self, request, pk=None):
+        """The file's history, newest first"""
+        file_obj = self.get_object()
+        paginator = FileRevisionCursorPagination()
+        queryset = file_obj.revisions.select_related('author').defer('delta')
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(FileRevisionSerializer(page, many=True).data)
+
+    @action(detail=True, methods=['get'], url_path=r'revisions/(?P<number>\d+)')
+    def revision(self, request, pk=None, number=None):
+        """The file's text at one revision"""
+        file_obj = self.get_object()
+        try:
+            return Response({'number': int(number), 'content': history.revision_text(file_obj, int(number))})
+        except FileRevision.DoesNotExist as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+    @action(detail=True, methods=['get'])
+    def diff(self, request, pk=None):
+        """Unified diff between two revisions (?from=&to=, default: the last change)"""
+        file_obj = self.get_object()
+        latest = file_obj.revisions.order_by('-number').values_list('number', flat=True).first()
+        if latest is None:
+            return Response({'error': 'File has no revisions'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            new = self._revision_number(request, 'to', latest)
+            old = self._revision_number(request, 'from', max(new - 1, 1))
+            context = self._revision_number(request, 'context', 3)
+            return Response({'from': old, 'to': new, 'diff': history.diff_revisions(file_obj, old, new, context)})
+        except ValueError:
+            return Response({'error': 'Revision numbers must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        except FileRevision.DoesNotExist as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+    @action(detail=True, methods=['get'])
+    def blame(self, request, pk=None):
+        """The revision that last changed each line (?revision=, default: latest)"""
+        file_obj = self.get_object()
+        try:
+            number = self._revision_number(request, 'revision')
+        except ValueError:
+            return Response({'error': 'Revision must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'revision': number, 'lines': history.blame(file_obj, number)})
+
+    @action(detail=True, methods=['post'])
+    def undo(self, request, pk=None):
+        """
+        Restore an earlier revision (default: the one before the latest).
+        History is never rewritten; the restored text becomes a new revision.
+        """
+        file_obj = self.get_object()
+        latest = file_obj.revisions.order_by('-number').values_list('number', flat=True).first()
+        try:
+            number = self._revision_number(request, 'revision', (latest or 1) - 1)
+            content = history.revision_text(file_obj, number)
+        except ValueError:
+            return Response({'error': 'Revision must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        except FileRevision.DoesNotExist:
+            return Response({'error': 'Nothing to undo'}, status=status.HTTP_404_NOT_FOUND)
+
+        autosave_buffer.discard(file_obj.project_id, file_obj.file_path)
+        file_obj = project_service.update_project_file(
+            file_obj.project, file_obj.file_path, content,
+            author=request.user if request.user.is_authenticated else None,
+            message=request.data.get('message') or f'Restore revision {number}'
+        )
+        return Response(self.get_serializer(file_obj).data)
+
     @action(detail=True, methods=['post'])
     def track_changes(self, request, pk=None):
+        """
+        Queue a commit of the file. Saves tracked in quick succession share
+        one commit; poll the returned job for its outcome.
+        """
         project_file = self.get_object()
-        project = project_file.project
-        
-        try:
-            repo = git.Repo(project.name)
-            file_path = os.path.join(project.name, project_file.file_path)
-            
-            # Stage the file
-            repo.index.add([file_path])
-            
-            # Commit the changes
-            commit_message = request.data.get('commit_message', f'Updated {project_file.file_path}')
-            repo.index.commit(commit_message)
-            
-            return Response({"status": "Changes tracked successfully"})
-        except Exception as e:
-            return Response(
-                {"error": str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        job = git_jobs.submit_commit(
+            project_file.project_id,
+            [project_file.file_path],
+            request.data.get('commit_message', f'Updated {project_file.file_path}'),
+            author=request.user if request.user.is_authenticated else None
+        )
+        return Response(job.to_dict(), status=status.HTTP_202_ACCEPTED)
 
 class ProjectSettingViewSet(viewsets.ModelViewSet):
     serializer_class = ProjectSettingSerializer
@@ -69,6 +69,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'thundercode.wsgi.application'
+# Served by uvicorn so async views run natively on the event loop
+ASGI_APPLICATION = 'thundercode.asgi.application'
 
 # Database
 DATABASES = {
@@ -167,10 +169,91 @@ REST_FRAMEWORK = {
 # AI Model settings
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY', '')
+ANTHROPIC_MODEL = os.getenv('ANTHROPIC_MODEL', 'claude-3-5-sonnet-20241022')
+ANTHROPIC_MAX_TOKENS = int(os.getenv('ANTHROPIC_MAX_TOKENS', '4096'))
 CODELLAMA_API_KEY = os.getenv('CODELLAMA_API_KEY', '')
 QWEN_API_KEY = os.getenv('QWEN_API_KEY', '')
 QWEN_API_BASE = os.getenv('QWEN_API_BASE', '')
 
+# Local inference: workers talk to one shared ml_service process instead of
+# each loading its own model copy
+LOCAL_INFERENCE_URL = os.getenv('LOCAL_INFERENCE_URL', 'http://localhost:8001')
+LOCAL_INFERENCE_UDS = os.getenv('LOCAL_INFERENCE_UDS', '')  # Unix socket path, if set
+LOCAL_INFERENCE_MODEL = os.getenv('LOCAL_INFERENCE_MODEL', '')  # empty = service default
+LOCAL_INFERENCE_MAX_CONNECTIONS = int(os.getenv('LOCAL_INFERENCE_MAX_CONNECTIONS', '20'))
+LOCAL_LLM_IN_PROCESS = os.getenv('LOCAL_LLM_IN_PROCESS', 'False') == 'True'
+LOCAL_LLM_FALLBACK = os.getenv('LOCAL_LLM_FALLBACK', 'False') == 'True'
+# Retries and circuit breaking for LLM provider calls
+LLM_MAX_ATTEMPTS = int(os.getenv('LLM_MAX_ATTEMPTS', '4'))
+LLM_DEADLINE_SECONDS = float(os.getenv('LLM_DEADLINE_SECONDS', '120'))  # per request, across retries
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv('LLM_BACKOFF_BASE_SECONDS', '0.5'))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv('LLM_BACKOFF_MAX_SECONDS', '8'))
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('LLM_CIRCUIT_FAILURE_THRESHOLD', '5'))
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv('LLM_CIRCUIT_RESET_SECONDS', '30'))
+# Connection pool size of each shared provider client (per process)
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '200'))
+# Near-duplicate prompt cache for code generation (0-1 estimated Jaccard similarity)
+PROMPT_CACHE_ENABLED = os.getenv('PROMPT_CACHE_ENABLED', 'True') == 'True'
+PROMPT_CACHE_THRESHOLD = float(os.getenv('PROMPT_CACHE_THRESHOLD', '0.85'))
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv('PROMPT_CACHE_MAX_ENTRIES', '10000'))
+# Project retrieval index: BM25 unless an embedding model (sentence-transformers) is named
+RETRIEVAL_EMBEDDING_MODEL = os.getenv('RETRIEVAL_EMBEDDING_MODEL', '')
+RETRIEVAL_MAX_PROJECTS = int(os.getenv('RETRIEVAL_MAX_PROJECTS', '32'))
+RETRIEVAL_MAX_TOKENS = int(os.getenv('RETRIEVAL_MAX_TOKENS', '1500'))
+# The CodeLlama adapter in code_generation talks to the same ml_service
+CODELLAMA_API_BASE = os.getenv('CODELLAMA_API_BASE', LOCAL_INFERENCE_URL)
+CODELLAMA_MAX_NEW_TOKENS = int(os.getenv('CODELLAMA_MAX_NEW_TOKENS', '2000'))
+
+# On-disk project trees, one directory per project id
+PROJECTS_ROOT = os.getenv('PROJECTS_ROOT') or str(BASE_DIR / 'projects')
+PROJECT_WRITE_WORKERS = int(os.getenv('PROJECT_WRITE_WORKERS', '16'))  # threads writing project files
+PROJECT_BULK_BATCH_SIZE = int(os.getenv('PROJECT_BULK_BATCH_SIZE', '500'))  # rows per INSERT
+PROJECT_FILES_PAGE_SIZE = int(os.getenv('PROJECT_FILES_PAGE_SIZE', '200'))  # file listing page
+PROJECT_STREAM_CHUNK_SIZE = int(os.getenv('PROJECT_STREAM_CHUNK_SIZE', '200'))  # rows per read when streaming
+# Content-addressed storage for file contents and generated code
+BLOB_STORE_BACKEND = os.getenv('BLOB_STORE_BACKEND', 'project_management.blobs.LocalBlobStore')
+BLOB_STORE_OPTIONS = {
+    'root': os.getenv('BLOB_STORE_ROOT') or str(BASE_DIR / 'blobs'),
+    'level': int(os.getenv('BLOB_STORE_ZSTD_LEVEL', '3')),
+}
+# File revision history: a full snapshot at least every N revisions, deltas between
+REVISION_SNAPSHOT_INTERVAL = int(os.getenv('REVISION_SNAPSHOT_INTERVAL', '32'))
+REVISION_DELTA_MAX_RATIO = float(os.getenv('REVISION_DELTA_MAX_RATIO', '0.5'))  # delta/file size before snapshotting
+# Background git jobs (project_management.gitjobs)
+GIT_COMMIT_DEBOUNCE = float(os.getenv('GIT_COMMIT_DEBOUNCE', '2'))  # quiet seconds before committing a batch
+GIT_COMMIT_MAX_DELAY = float(os.getenv('GIT_COMMIT_MAX_DELAY', '10'))  # longest a commit waits for the saves to stop
+GIT_WORKER_IDLE_TIMEOUT = float(os.getenv('GIT_WORKER_IDLE_TIMEOUT', '300'))  # seconds before a repo handle is closed
+GIT_MAX_CONCURRENT_JOBS = int(os.getenv('GIT_MAX_CONCURRENT_JOBS', '4'))
+GIT_JOB_HISTORY = int(os.getenv('GIT_JOB_HISTORY', '1000'))  # finished jobs kept for status lookups
+GIT_STATUS_CACHE_TTL = float(os.getenv('GIT_STATUS_CACHE_TTL', '10'))  # bound on staleness from edits outside the app
+GIT_LOG_PAGE_SIZE = int(os.getenv('GIT_LOG_PAGE_SIZE', '50'))
+# Cloned projects copy files when reflinks are unavailable. Hardlinking
+# instead is only safe if nothing edits project files in place: the app
+# always rewrites by rename, but git, editors and tools working directly in
+# PROJECTS_ROOT may not, and would change every clone sharing the file
+PROJECT_CLONE_HARDLINKS = os.getenv('PROJECT_CLONE_HARDLINKS', 'False') == 'True'
+# Disk-to-database reconciliation (reconcile_projects command)
+RECONCILE_INTERVAL = float(os.getenv('RECONCILE_INTERVAL', '300'))  # seconds between passes over every project
+RECONCILE_MAX_FILES_PER_SECOND = float(os.getenv('RECONCILE_MAX_FILES_PER_SECOND', '5000'))  # 0 for no limit
+RECONCILE_WATCH = os.getenv('RECONCILE_WATCH', 'True') == 'True'  # react to changes at once when watchfiles is installed
+# Write-behind buffer for editor autosaves (project_management.autosave):
+# off (write before acknowledging), redis, or memory (single worker process
+# only; lost on a crash or restart)
+AUTOSAVE_BUFFER = os.getenv('AUTOSAVE_BUFFER', 'off')
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))  # uvicorn worker processes, as uvicorn reads it
+AUTOSAVE_FLUSH_INTERVAL = float(os.getenv('AUTOSAVE_FLUSH_INTERVAL', '5'))  # seconds between flushes
+AUTOSAVE_MAX_PENDING_FILES = int(os.getenv('AUTOSAVE_MAX_PENDING_FILES', '500'))  # flush early past this
+AUTOSAVE_MAX_PENDING_BYTES = int(os.getenv('AUTOSAVE_MAX_PENDING_BYTES', str(32 * 1024 ** 2)))
+AUTOSAVE_MAX_ATTEMPTS = int(os.getenv('AUTOSAVE_MAX_ATTEMPTS', '5'))  # flushes a save is retried by while the database is busy
+AUTOSAVE_REDIS_REPLICAS = int(os.getenv('AUTOSAVE_REDIS_REPLICAS', '0'))  # replicas that must have a save to ack it
+AUTOSAVE_REDIS_WAIT_MS = int(os.getenv('AUTOSAVE_REDIS_WAIT_MS', '100'))
+AUTOSAVE_REDIS_LOCK_TIMEOUT = float(os.getenv('AUTOSAVE_REDIS_LOCK_TIMEOUT', '60'))  # bound on a flush
+# Project archive export/import
+PROJECT_ARCHIVE_QUEUE_CHUNKS = int(os.getenv('PROJECT_ARCHIVE_QUEUE_CHUNKS', '8'))  # 1 MB chunks buffered per export
+PROJECT_IMPORT_MAX_BYTES = int(os.getenv('PROJECT_IMPORT_MAX_BYTES', str(10 * 1024 ** 3)))  # extracted size cap
+PROJECT_IMPORT_MAX_FILES = int(os.getenv('PROJECT_IMPORT_MAX_FILES', '200000'))
+PROJECT_IMPORT_MAX_TEXT_SIZE = int(os.getenv('PROJECT_IMPORT_MAX_TEXT_SIZE', str(2 * 1024 ** 2)))  # larger files stay on disk only
+
 # Redis settings
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 
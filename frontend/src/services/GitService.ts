@@ -1,20 +1,38 @@
 interface GitStatus {
     staged: string[];
     modified: string[];
+    deleted: string[];
     untracked: string[];
-    branch: string;
+    conflicted: string[];
+    branch: string | null;
+    head: string | null;
 }
 
 interface CommitInfo {
     hash: string;
     message: string;
     author: string;
+    email: string;
     date: string;
     files: string[];
 }
 
+interface CommitPage {
+    head: string | null;
+    next: string | null;
+    results: CommitInfo[];
+}
+
+interface DiffOptions {
+    from?: string;
+    to?: string;
+    staged?: boolean;
+    paths?: string[];
+}
+
 class GitService {
     private baseUrl = '/api/git';
+    private projectsUrl = '/api/project-management/projects';
 
     async initRepository(projectId: number, repoUrl: string): Promise<void> {
         try {
@@ -40,7 +58,7 @@ class GitService {
 
     async getStatus(projectId: number): Promise<GitStatus> {
         try {
-            const response = await fetch(`${this.baseUrl}/status/${projectId}`);
+            const response = await fetch(`${this.projectsUrl}/${projectId}/git/status/`);
 
             if (!response.ok) {
                 throw new Error('Failed to get repository status');
@@ -128,10 +146,16 @@ class GitService {
     }
 
     async getCommitHistory(projectId: number, limit: number = 10): Promise<CommitInfo[]> {
+        const page = await this.getCommitPage(
+            `${this.projectsUrl}/${projectId}/git/log/?limit=${limit}`
+        );
+        return page.results;
+    }
+
+    // Pass the previous page's `next` to continue from the same HEAD
+    async getCommitPage(url: string): Promise<CommitPage> {
         try {
-            const response = await fetch(
-                `${this.baseUrl}/history/${projectId}?limit=${limit}`
-            );
+            const response = await fetch(url);
 
             if (!response.ok) {
                 throw new Error('Failed to get commit history');
@@ -144,6 +168,29 @@ class GitService {
         }
     }
 
+    async getDiff(projectId: number, options: DiffOptions = {}): Promise<string> {
+        const params = new URLSearchParams();
+        if (options.from) params.append('from', options.from);
+        if (options.to) params.append('to', options.to);
+        if (options.staged) params.append('staged', '1');
+        (options.paths || []).forEach(path => params.append('path', path));
+
+        try {
+            const response = await fetch(
+                `${this.projectsUrl}/${projectId}/git/diff/?${params.toString()}`
+            );
+
+            if (!response.ok) {
+                throw new Error('Failed to get diff');
+            }
+
+            return response.text();
+        } catch (error) {
+            console.error('Error getting diff:', error);
+            throw error;
+        }
+    }
+
     async createBranch(projectId: number, branchName: string): Promise<void> {
         try {
             const response = await fetch(`${this.baseUrl}/branch`, {